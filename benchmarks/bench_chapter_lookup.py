@@ -0,0 +1,64 @@
+"""章节查找微基准：线性扫描 meta["chapters"] 与 storage 章节索引的对比。
+
+用法：python benchmarks/bench_chapter_lookup.py [章节数 ...]
+在临时目录中建项目，不影响 data/。
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import config
+
+_tmp = tempfile.mkdtemp()
+config.DATA_DIR = _tmp
+config.PROJECTS_DIR = os.path.join(_tmp, "projects")
+
+import storage  # noqa: E402
+
+CHAPTERS_PER_VOLUME = 50
+LOOKUPS = 2000
+
+
+def _per_call_us(fn, args: list) -> float:
+    t = time.perf_counter()
+    for a in args:
+        fn(a)
+    return (time.perf_counter() - t) / len(args) * 1e6
+
+
+def _scan(pid: str, chapter_id: str):
+    return next((c for c in storage.get_project(pid)["chapters"] if c["id"] == chapter_id), None)
+
+
+def run(n_chapters: int) -> None:
+    pid = storage.create_project(f"bench-{n_chapters}")
+    for i in range(n_chapters):
+        storage.add_chapter(pid, i // CHAPTERS_PER_VOLUME, i % CHAPTERS_PER_VOLUME, "走向", "", "摘要")
+    meta = storage.get_project(pid)
+    ids = [c["id"] for c in meta["chapters"]]
+    targets = [random.choice(ids) for _ in range(LOOKUPS)]
+
+    scan = _per_call_us(lambda cid: _scan(pid, cid), targets)
+    indexed = _per_call_us(lambda cid: storage.get_chapter(pid, cid), targets)
+
+    # 旧版 get_rag_context 读当前卷章摘要的方式：遍历全部章节并做 `id in list`
+    last_vol = (n_chapters - 1) // CHAPTERS_PER_VOLUME
+    vol_ids = meta["volumes"][last_vol]["chapters"]
+    reps = list(range(50))
+    old_ctx = _per_call_us(lambda _: [c for c in meta["chapters"] if c["id"] in vol_ids], reps)
+    def _indexed_ctx(_):
+        m, index = storage._indexed(pid)  # get_rag_context 的做法：取一次 meta 与索引
+        return [index.get(m["chapters"], cid) for cid in vol_ids]
+    new_ctx = _per_call_us(_indexed_ctx, reps)
+
+    print(f"{n_chapters:>6} 章 | 按 id 查找：扫描 {scan:8.1f} µs，索引 {indexed:6.2f} µs"
+          f" | 取当前卷章节：扫描 {old_ctx:8.1f} µs，索引 {new_ctx:7.1f} µs")
+
+
+if __name__ == "__main__":
+    for n in [int(a) for a in sys.argv[1:]] or [500, 1000, 2000]:
+        run(n)
@@ -0,0 +1,76 @@
+"""并发写入检查：多个进程（各含多个线程）同时向同一项目添加章节、版本与摘要，
+检查 meta 中没有丢失任何章节或版本（模拟多 worker 部署）。
+
+用法：python benchmarks/bench_concurrent_writes.py [--sqlite] [进程数] [每进程线程数] [每线程章节数]
+在临时目录中建项目，不影响 data/。
+"""
+import multiprocessing as mp
+import os
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+
+
+def _setup(data_dir: str, backend: str):
+    sys.path.insert(0, ROOT)
+    import config
+    config.DATA_DIR = data_dir
+    config.PROJECTS_DIR = os.path.join(data_dir, "projects")
+    config.SQLITE_PATH = os.path.join(data_dir, "novel.db")
+    config.STORAGE_BACKEND = backend
+    import storage
+    return storage
+
+
+def _writer(data_dir: str, backend: str, pid: str, proc: int, threads: int, per_thread: int) -> None:
+    storage = _setup(data_dir, backend)
+
+    def work(t: int) -> None:
+        for i in range(per_thread):
+            cid = storage.add_chapter(pid, proc, t * per_thread + i, "走向", f"正文 {proc}-{t}-{i}", summary_status="pending")
+            storage.add_version(pid, cid, f"修改 {proc}-{t}-{i}", "修改")
+            storage.update_chapter_summary(pid, cid, f"摘要 {proc}-{t}-{i}")
+
+    ts = [threading.Thread(target=work, args=(t,)) for t in range(threads)]
+    for t in ts:
+        t.start()
+    for t in ts:
+        t.join()
+
+
+def main() -> None:
+    args = sys.argv[1:]
+    backend = "sqlite" if "--sqlite" in args else "json"
+    nums = [int(a) for a in args if a != "--sqlite"]
+    procs, threads, per_thread = (nums + [4, 4, 10][len(nums):])[:3]
+    data_dir = tempfile.mkdtemp()
+    storage = _setup(data_dir, backend)
+    pid = storage.create_project("concurrent")
+
+    ctx = mp.get_context("spawn")
+    ps = [ctx.Process(target=_writer, args=(data_dir, backend, pid, p, threads, per_thread)) for p in range(procs)]
+    t = time.perf_counter()
+    for p in ps:
+        p.start()
+    for p in ps:
+        p.join()
+    elapsed = time.perf_counter() - t
+
+    meta = storage.get_project(pid)
+    chapters = meta["chapters"]
+    expected = procs * threads * per_thread
+    in_volumes = sum(len(v["chapters"]) for v in meta["volumes"])
+    versions = sum(len(c["versions"]) for c in chapters)
+    summarized = sum(1 for c in chapters if c["summary_status"] == "done")
+    ok = len(chapters) == in_volumes == summarized == expected and versions == 2 * expected
+    print(f"{'PASS' if ok else 'FAIL'}  {backend}：{procs} 进程 × {threads} 线程 × {per_thread} 章，耗时 {elapsed:.1f} s"
+          f" | 章节 {len(chapters)}/{expected}，卷内登记 {in_volumes}，版本 {versions}/{2 * expected}，摘要 {summarized}")
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
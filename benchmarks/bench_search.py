@@ -0,0 +1,84 @@
+"""全文查找基准：在约 200 万字的随机正文中查找人物名、物品名，对比逐章读取正文 grep 与倒排索引查找，
+并核对返回的偏移确实指向命中词。
+
+用法：python benchmarks/bench_search.py [章节数] [每章字数]
+在临时目录中建项目，不影响 data/。
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import config
+
+_tmp = tempfile.mkdtemp()
+config.DATA_DIR = _tmp
+config.PROJECTS_DIR = os.path.join(_tmp, "projects")
+
+import retrieval  # noqa: E402
+import storage  # noqa: E402
+
+CHARS = "的一是在不了有和人这中大为上个国我以要他时来用们生到作地于出就分对成会可主发年动同工也能下过子说产种面而方后多定行学法所民得经十三之进着等部度家电力里如水化高自二理起小物现实加量都两体制机当使点从业本去把性好应开它合还因由其些然前外天政四日那社义事平形相全表间样与关各重新线内数正心反你明看原又么利比或但质气第向道命此变条只没结解问意建月公无系军很情者最立代想已通并提直题党程展五果料象员革位入常文总次品式活设及管特件长求老头基资边流路级少图山统接知较将组见计别她手角期根论运农指几九区强放决西被干做必战先回则任取据处队南给色光门即保治北造百规热领七海口东导器压志世金增争济阶油思术极交受联什认六共权收证改清己美再采转更单风切打白教速花带安场身车例真务具万每目至达走积示议声报斗完类八离华名确才科张信马节话米整空元况今集温传土许步群广石记需段研界拉林律叫且究观越织装影算低持音众书布复容儿须际商非验连断深难近矿千周委素技备半办青省列习响约支般史感劳便团往酸历市克何除消构府称太准精值号率族维划选标写存候毛亲快效斯院查江型眼王按格养易置派层片始却专状育厂京识适属圆包火住调满县局照参红细引听该铁价严"
+NAMES = ["林晓", "青冥剑", "苏婉儿", "玄天宗"]
+
+
+def _paragraph() -> str:
+    return "".join(random.choices(CHARS, k=random.randint(80, 300))) + "。"
+
+
+def _chapter(n_chars: int) -> str:
+    paras, total = [], 0
+    while total < n_chars:
+        p = _paragraph()
+        if random.random() < 0.05:
+            i = random.randrange(len(p))
+            p = p[:i] + random.choice(NAMES) + p[i:]
+        paras.append(p)
+        total += len(p) + 1
+    return "\n".join(paras)
+
+
+def main() -> None:
+    args = [int(a) for a in sys.argv[1:]]
+    n_chapters, per_chapter = (args + [400, 5000][len(args):])[:2]
+    random.seed(7)
+    pid = storage.create_project("search-bench")
+    t = time.perf_counter()
+    for i in range(n_chapters):
+        storage.add_chapter(pid, i // 50, i % 50, "走向", _chapter(per_chapter), f"摘要：{random.choice(NAMES)}登场")
+    meta = storage.get_project(pid)
+    total = sum(c["char_count"] for c in meta["chapters"])
+    print(f"{n_chapters} 章，共 {total / 10000:.0f} 万字，写入 {time.perf_counter() - t:.1f} s")
+
+    ids = [c["id"] for c in meta["chapters"]]
+    for name in NAMES:
+        t = time.perf_counter()
+        grep = sum(storage.get_chapter_content(pid, cid).count(name) for cid in ids)
+        t_grep = time.perf_counter() - t
+
+        retrieval._indexes.clear()
+        t = time.perf_counter()
+        storage.search_chapters(pid, name, ["content"], limit=1)
+        t_cold = time.perf_counter() - t
+        t = time.perf_counter()
+        res = storage.search_chapters(pid, name, ["content"], sort="position", order="desc", limit=5)
+        t_warm = time.perf_counter() - t
+
+        found = 0
+        for h in storage.search_chapters(pid, name, ["content"])["items"]:
+            content = storage.get_chapter_content(pid, h["chapter_id"])
+            assert all(content[o:o + n] == name for o, n in h["matches"]), h
+            found += len(h["matches"])
+        last = res["items"][0] if res["items"] else None
+        where = f"最近：第{last['volume_idx'] + 1}卷第{last['chapter_idx'] + 1}章 @{last['offset']}" if last else ""
+        print(f"{name:<4} grep {t_grep * 1000:7.1f} ms（{grep} 处） | 索引 冷 {t_cold * 1000:7.1f} ms，热 {t_warm * 1000:5.1f} ms"
+              f"（{res['total']} 段，{found} 处，偏移核对通过） {where}")
+        if found != grep:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
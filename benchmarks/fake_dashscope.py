@@ -0,0 +1,88 @@
+"""本地假 DashScope 文本生成服务：可注入延迟与错误，用于验证 qwen_client 的超时、重试与对冲。
+
+用法：python benchmarks/fake_dashscope.py [端口]
+然后 DASHSCOPE_BASE_URL=http://127.0.0.1:端口/api/v1 DASHSCOPE_API_KEY=fake python main.py
+故障注入通过 POST /fault 设置（JSON 字段见 Fault），也可在进程内直接修改 fault。
+"""
+import asyncio
+import json
+import random
+import sys
+from dataclasses import dataclass
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+
+@dataclass
+class Fault:
+    """按调用序号注入：前 slow_first 次或以 slow_rate 概率改用 slow_latency（模拟长尾），
+    前 fail_first 次返回 fail_status，之后按 error_rate 随机返回。"""
+    latency: float = 0.0          # 首个输出前的延迟（秒）
+    slow_latency: float = 0.0
+    slow_first: int = 0
+    slow_rate: float = 0.0
+    chunk_delay: float = 0.0      # 流式输出每段之间的间隔（秒）
+    fail_first: int = 0
+    error_rate: float = 0.0
+    fail_status: int = 429
+    chunks: int = 5
+    text: str = "测试输出。"
+
+
+fault = Fault()
+calls = 0
+app = FastAPI()
+
+_ERROR_CODES = {429: "Throttling", 500: "InternalError", 503: "ServiceUnavailable"}
+
+
+def _error(status: int) -> dict:
+    return {"code": _ERROR_CODES.get(status, "Error"), "message": f"injected {status}", "request_id": f"fake-{calls}"}
+
+
+def _chunk(text: str, finish: str = "null") -> dict:
+    return {
+        "output": {"choices": [{"message": {"role": "assistant", "content": text}, "finish_reason": finish}]},
+        "usage": {"input_tokens": 1, "output_tokens": 1},
+        "request_id": f"fake-{calls}",
+    }
+
+
+@app.post("/fault")
+async def set_fault(body: dict):
+    global calls
+    for k, v in body.items():
+        setattr(fault, k, v)
+    calls = 0
+    return vars(fault)
+
+
+@app.post("/api/v1/services/aigc/text-generation/generation")
+async def generation(request: Request):
+    global calls
+    calls += 1
+    n = calls
+    stream = request.headers.get("X-DashScope-SSE", "").lower() == "enable" or "text/event-stream" in request.headers.get("Accept", "")
+    slow = n <= fault.slow_first or (fault.slow_rate and random.random() < fault.slow_rate)
+    delay = fault.slow_latency if slow else fault.latency
+    await asyncio.sleep(delay)
+    if n <= fault.fail_first or random.random() < fault.error_rate:
+        return JSONResponse(_error(fault.fail_status), status_code=fault.fail_status)
+
+    if not stream:
+        return JSONResponse(_chunk(fault.text * fault.chunks, "stop"))
+
+    async def events():
+        for i in range(fault.chunks):
+            if i:
+                await asyncio.sleep(fault.chunk_delay)
+            last = i == fault.chunks - 1
+            yield f"id:{i + 1}\nevent:result\n:HTTP_STATUS/200\ndata:{json.dumps(_chunk(fault.text, 'stop' if last else 'null'), ensure_ascii=False)}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host="127.0.0.1", port=int(sys.argv[1]) if len(sys.argv) > 1 else 29148)
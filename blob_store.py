@@ -0,0 +1,90 @@
+"""内容寻址的文本存储：章节正文与各版本按 sha256 去重，zlib 压缩，可对上一版本做增量编码。
+
+对象路径为 blobs/{hash[:2]}/{hash}，经由存储后端的 read_bytes / write_bytes 读写。
+对象格式：1 字节类型 + zlib 压缩数据。
+- b"F"：全文（UTF-8）
+- b"D"：相对 base 对象的按行增量，JSON {"base", "depth", "ops"}；
+  ops 中 [i, j] 表示复制 base 的第 i~j 行，字符串表示新增文本
+增量链长度不超过 config.BLOB_MAX_DELTA_CHAIN，超过则存全文。
+"""
+import difflib
+import hashlib
+import json
+import zlib
+from typing import Any, Optional
+
+import config
+
+_FULL = b"F"
+_DELTA = b"D"
+
+
+def content_hash(content: str) -> str:
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def _path(h: str) -> str:
+    return f"blobs/{h[:2]}/{h}"
+
+
+def _read_obj(backend: Any, project_id: str, h: str) -> Optional[tuple[bytes, bytes]]:
+    raw = backend.read_bytes(project_id, _path(h))
+    if raw is None:
+        return None
+    return raw[:1], zlib.decompress(raw[1:])
+
+
+def _delta_ops(base: str, content: str) -> list:
+    a = base.splitlines(keepends=True)
+    b = content.splitlines(keepends=True)
+    ops: list = []
+    for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(None, a, b, autojunk=False).get_opcodes():
+        if tag == "equal":
+            ops.append([i1, i2])
+        elif j2 > j1:
+            ops.append("".join(b[j1:j2]))
+    return ops
+
+
+def put(backend: Any, project_id: str, content: str, base_hash: Optional[str] = None) -> str:
+    """
+    写入文本，返回其哈希。内容已存在时不写任何数据。
+    给出 base_hash（通常是上一版本）时尝试增量编码，比全文压缩更小才采用。
+    """
+    h = content_hash(content)
+    if backend.read_bytes(project_id, _path(h)) is not None:
+        return h
+
+    data = content.encode("utf-8")
+    obj = _FULL + zlib.compress(data, 6)
+    if base_hash and base_hash != h:
+        base_obj = _read_obj(backend, project_id, base_hash)
+        base = get(backend, project_id, base_hash)
+        if base_obj is not None and base is not None:
+            depth = json.loads(base_obj[1])["depth"] + 1 if base_obj[0] == _DELTA else 1
+            if depth <= config.BLOB_MAX_DELTA_CHAIN:
+                delta = json.dumps(
+                    {"base": base_hash, "depth": depth, "ops": _delta_ops(base, content)},
+                    ensure_ascii=False,
+                ).encode("utf-8")
+                delta_obj = _DELTA + zlib.compress(delta, 6)
+                if len(delta_obj) < len(obj):
+                    obj = delta_obj
+    backend.write_bytes(project_id, _path(h), obj)
+    return h
+
+
+def get(backend: Any, project_id: str, h: str) -> Optional[str]:
+    """按哈希取回文本，沿增量链还原；对象不存在返回 None。"""
+    obj = _read_obj(backend, project_id, h)
+    if obj is None:
+        return None
+    kind, payload = obj
+    if kind == _FULL:
+        return payload.decode("utf-8")
+    delta = json.loads(payload)
+    base = get(backend, project_id, delta["base"])
+    if base is None:
+        return None
+    lines = base.splitlines(keepends=True)
+    return "".join("".join(lines[op[0]:op[1]]) if isinstance(op, list) else op for op in delta["ops"])
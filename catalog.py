@@ -0,0 +1,80 @@
+"""项目目录索引：每个项目一条摘要（名称、时间、卷数、章数、字数）。
+
+项目列表直接分页、排序目录索引，不再逐个读取 meta。索引在每次写 meta 时更新，
+由存储后端持久化（JSON：data/catalog.json；SQLite：catalog 表）；
+首次载入时与后端的项目 id 对账，补齐缺失项（如旧版本创建的项目）。
+写入在 "catalog" 命名锁内进行，多个 worker 进程各自更新时不会互相覆盖。
+"""
+from typing import Any, Callable, Optional
+
+import locks
+
+SORT_KEYS = ("updated_at", "created_at", "name", "chapter_count", "volume_count", "word_count")
+
+
+def entry_for(project_id: str, meta: dict) -> dict:
+    chapters = meta.get("chapters", [])
+    return {
+        "id": project_id,
+        "name": meta.get("name", ""),
+        "created_at": meta.get("created_at", ""),
+        "updated_at": meta.get("updated_at", ""),
+        "volume_count": len(meta.get("volumes", [])),
+        "chapter_count": len(chapters),
+        "word_count": sum(c.get("char_count", 0) for c in chapters),
+    }
+
+
+class Catalog:
+    def __init__(self, backend: Any, get_meta: Callable[[str], Optional[dict]]):
+        self._backend = backend
+        self._get_meta = get_meta
+        self._entries: Optional[dict[str, dict]] = None
+        self._stamp: Any = None
+        self._lock = locks.named_lock("catalog")
+
+    def _ensure_loaded(self) -> dict[str, dict]:
+        """载入索引；其他进程改写过（戳变化）则重新载入。"""
+        stamp = self._backend.catalog_stamp()
+        if self._entries is not None and stamp == self._stamp:
+            return self._entries
+        entries = self._backend.read_catalog() or {}
+        ids = set(self._backend.list_project_ids())
+        missing = ids - entries.keys()
+        stale = entries.keys() - ids
+        for project_id in missing:
+            meta = self._get_meta(project_id)
+            if meta:
+                entries[project_id] = entry_for(project_id, meta)
+        for project_id in stale:
+            del entries[project_id]
+        if missing or stale:
+            self._backend.write_catalog(entries)
+            stamp = self._backend.catalog_stamp()
+        self._entries, self._stamp = entries, stamp
+        return entries
+
+    def update(self, project_id: str, meta: dict) -> None:
+        """写 meta 后调用；摘要无变化时不写盘。"""
+        with self._lock:
+            entries = self._ensure_loaded()
+            entry = entry_for(project_id, meta)
+            if entries.get(project_id) == entry:
+                return
+            entries[project_id] = entry
+            self._backend.write_catalog(entries, changed=project_id)
+            self._stamp = self._backend.catalog_stamp()
+
+    def query(self, offset: int = 0, limit: Optional[int] = None, sort: str = "updated_at", order: str = "desc") -> dict:
+        """分页、排序的项目摘要列表：{"items", "total", "offset", "limit"}。"""
+        if sort not in SORT_KEYS:
+            raise ValueError(f"不支持的排序字段：{sort}")
+        if order not in ("asc", "desc"):
+            raise ValueError(f"不支持的排序方向：{order}")
+        with self._lock:
+            items = list(self._ensure_loaded().values())
+        default = 0 if sort.endswith("_count") else ""
+        items.sort(key=lambda e: (e.get(sort) or default, e["id"]), reverse=order == "desc")
+        offset = max(0, offset)
+        page = items[offset:offset + limit] if limit is not None else items[offset:]
+        return {"items": page, "total": len(items), "offset": offset, "limit": limit}
@@ -3,6 +3,8 @@ import os
 
 # 阿里云 DashScope API Key（环境变量 DASHSCOPE_API_KEY 或在此设置）
 DASHSCOPE_API_KEY = os.getenv("DASHSCOPE_API_KEY", "")
+# DashScope 接口地址（留空用 SDK 默认；可指向本地假服务做故障注入，见 benchmarks/fake_dashscope.py）
+DASHSCOPE_BASE_URL = os.getenv("DASHSCOPE_BASE_URL", "")
 
 # 模型配置（阿里云百炼 DashScope）
 # 逻辑/规划 + 摘要：qwen-max（最强推理），启用 thinking
@@ -17,7 +19,106 @@ CHAPTER_MIN_CHARS = 6000
 CHAPTER_MAX_CHARS = 8000
 # 正文生成 max_tokens（约 1.5 字/token，8k 字需 ~12000）
 CHAPTER_MAX_TOKENS = 12000
+# 正文长度控制：流式计字数，超过 CHAPTER_MAX_CHARS 后在段落边界截断（再超出 CHAPTER_CUTOFF_SLACK_CHARS 仍无换行则在句末截断）；
+# 不足 CHAPTER_MIN_CHARS 时以结尾 CHAPTER_CONTINUATION_TAIL_CHARS 字为引子续写，最多 CHAPTER_MAX_CONTINUATIONS 次
+CHAPTER_LENGTH_CONTROL = True
+CHAPTER_CUTOFF_SLACK_CHARS = 300
+CHAPTER_CONTINUATION_TAIL_CHARS = 1500
+CHAPTER_MAX_CONTINUATIONS = 2
+
+# 摘要 map-reduce：章正文（或一卷的章摘要合计）超过 SUMMARY_CHUNK_CHARS 字时按段落切块，
+# 各块并发摘要（同时最多 SUMMARY_PARALLELISM 个）后再合并
+SUMMARY_CHUNK_CHARS = 6000
+SUMMARY_PARALLELISM = 4
+
+# 多级摘要：章 → 卷 → 篇章（每 SUMMARY_ARC_VOLUMES 卷）→ 全书梗概。
+# 上下文中较早的完整篇章用篇章摘要，最近 SUMMARY_RECENT_ARCS 个篇章之前的合为全书梗概
+SUMMARY_ARC_VOLUMES = 5
+SUMMARY_RECENT_ARCS = 1
 
 # 存储路径
 DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
 PROJECTS_DIR = os.path.join(DATA_DIR, "projects")
+
+# 存储后端："json"（meta.json + 文本文件，默认）或 "sqlite"（WAL 模式单文件数据库）
+# 从 JSON 迁移到 SQLite：python migrate_to_sqlite.py
+STORAGE_BACKEND = os.getenv("NOVEL_STORAGE_BACKEND", "json")
+SQLITE_PATH = os.path.join(DATA_DIR, "novel.db")
+
+# python main.py 启动的 worker 进程数；项目写入经 data/locks/ 下的文件锁互斥，可多进程运行
+# （限流、缓存统计与 /metrics 为各进程独立计数）
+WORKERS = int(os.getenv("NOVEL_WORKERS", "1"))
+
+# 项目元信息进程内缓存上限（字节，估算值）
+META_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# 章节/版本 blob 增量链最大长度（超过则存全文，限制读取时的还原开销）
+BLOB_MAX_DELTA_CHAIN = 16
+
+# RAG 检索：按 user_direction 从章节摘要/走向/正文片段中取回的片段数，及正文片段长度（字）
+RETRIEVAL_TOP_K = 6
+RETRIEVAL_PASSAGE_CHARS = 300
+# 超长段落硬切时相邻片段重叠的字数：跨切点、不超过该值加一字的词也能查到
+RETRIEVAL_PASSAGE_OVERLAP = 15
+# 检索倒排表的增量层（持久化的段之后写入或修改的章节）达到 max(RETRIEVAL_MERGE_MIN, 章节数 × RETRIEVAL_MERGE_RATIO) 章时并入段
+RETRIEVAL_MERGE_MIN = 16
+RETRIEVAL_MERGE_RATIO = 0.05
+# 检索索引进程内缓存上限（字节，估算值），超出按最久未用的项目淘汰
+RETRIEVAL_CACHE_MAX_BYTES = 64 * 1024 * 1024
+# 全文查找（GET /api/projects/{id}/search）结果摘录中命中前后各保留的字数
+SEARCH_SNIPPET_CHARS = 40
+# 长设定（超过 SETTING_INLINE_CHARS 字）按标题/段落分节（每节不超过 SETTING_SECTION_CHARS 字）：
+# 提示词前缀中只放纲要（各节标题与首句，不超过 SETTING_DIGEST_CHARS 字），
+# 另按走向与最近 SETTING_QUERY_CHAPTERS 章的摘要选取相关小节（每项设定不超过 SETTING_SELECT_CHARS 字）
+SETTING_INLINE_CHARS = 6000
+SETTING_SECTION_CHARS = 800
+SETTING_DIGEST_CHARS = 1500
+SETTING_SELECT_CHARS = 6000
+SETTING_QUERY_CHAPTERS = 2
+# 走向中提到的人物：附上其在上一卷之前最近几次出场（人物出场索引）的章摘要
+ENTITY_RECENT_CHAPTERS = 3
+
+# 上下文 token 预算：走向规划（qwen-max）与正文生成（qwen-plus）各自给 RAG 上下文的上限，
+# 实际预算不超过模型上下文窗口减去输出预留（走向含 thinking，正文为 CHAPTER_MAX_TOKENS）与提示词其余部分
+MODEL_CONTEXT_TOKENS = {"qwen-max": 32768, "qwen-plus": 131072}
+CONTEXT_BUDGET_DIRECTION = 16000
+CONTEXT_BUDGET_CONTENT = 24000
+CONTEXT_RESERVE_DIRECTION = 10000
+CONTEXT_PROMPT_OVERHEAD = 2000
+# 项目设定（放在提示词前缀、不随章节变化）最多占上下文预算的比例
+CONTEXT_STATIC_SHARE = 0.5
+# 本地 token 估算：中文约 1.5 字/token，其他字符约 4 字符/token
+TOKEN_EST_CJK_CHARS = 1.5
+TOKEN_EST_OTHER_CHARS = 4.0
+
+# LLM 响应本地缓存（仅摘要等确定性调用）：有效期（秒，<=0 关闭）与总大小上限
+LLM_CACHE_DIR = os.path.join(DATA_DIR, "llm_cache")
+LLM_CACHE_TTL = 7 * 24 * 3600
+LLM_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# DashScope 调用限流（按账号配额调整）：每个模型每分钟请求数 rpm 与 token 数 tpm（估算输入 + 输出上限）；
+# 未列出的模型不限流
+RATE_LIMITS = {
+    "qwen-max": {"rpm": 600, "tpm": 1000000},
+    "qwen-plus": {"rpm": 15000, "tpm": 5000000},
+}
+# 未指定 max_tokens 的调用，按此估算输出 token 数（thinking 调用另加 thinking_budget）
+RATE_LIMIT_DEFAULT_OUTPUT_TOKENS = 2000
+
+# 各阶段调用超时（秒，None 不限）：first_token 为发出请求到收到首段输出（非流式为整个响应），total 为单次调用总时长
+LLM_TIMEOUTS = {
+    "direction": {"first_token": 90, "total": 600},
+    "content": {"first_token": 60, "total": 900},
+    "summary": {"first_token": 90, "total": 300},
+}
+# 重试：最多尝试次数，退避为 [0, min(max_delay, base_delay * 2^n)] 内随机（秒）；
+# 仅对以下状态码、网络错误与超时重试；流式输出已产出内容后不再重试
+LLM_RETRY_ATTEMPTS = 3
+LLM_RETRY_BASE_DELAY = 1.0
+LLM_RETRY_MAX_DELAY = 20.0
+LLM_RETRY_STATUS = {429, 500, 502, 503, 504}
+# 对冲请求：非流式调用超过该秒数仍未返回时再发一份相同请求，取先成功者（None 关闭；会多消耗配额）
+LLM_HEDGE_AFTER = {"direction": None, "summary": None}
+
+# 追踪日志：每个生成阶段、每次模型调用输出一行 "trace=... span=... ms=..."（logger "novel.trace"，stderr）
+TRACE_LOG = True
@@ -0,0 +1,146 @@
+"""按 token 预算组装 RAG 上下文。
+
+各段（设定、卷摘要、章摘要、检索片段）带优先级，按优先级依次放入预算：
+放不下时先改用其更高层的摘要（如上一卷的章摘要改用卷摘要），可截断的段截断，否则丢弃；
+输出仍按原有顺序排列，并报告每段的去留。token 数用本地估算（中文约 1.5 字/token）。
+
+不随章节变化的段（static，即项目设定）先在预算的 CONTEXT_STATIC_SHARE 内单独取舍，
+其结果只取决于设定本身与预算，组成逐字节稳定的提示词前缀（prefix），其余段组成 body。
+"""
+import re
+from typing import Optional
+
+import config
+
+_CJK = re.compile(r"[　-〿㐀-鿿豈-﫿＀-￯]")
+_SEP = "\n\n"
+_TRIM_MARK = "\n……（已截断）"
+# 剩余预算低于此值时不再截断，直接丢弃
+_MIN_TRIM_TOKENS = 200
+
+
+def estimate_tokens(text: str) -> int:
+    """估算 token 数：中文字符（含全角标点）按 TOKEN_EST_CJK_CHARS 字/token，其余按 TOKEN_EST_OTHER_CHARS 字符/token。"""
+    if not text:
+        return 0
+    cjk = len(_CJK.findall(text))
+    other = len(text) - cjk
+    return int(cjk / config.TOKEN_EST_CJK_CHARS + other / config.TOKEN_EST_OTHER_CHARS) + 1
+
+
+def budget_for(call: str) -> int:
+    """
+    某次调用（"direction" 或 "content"）可给上下文的 token 预算：
+    配置的预算，且不超过模型上下文窗口减去输出预留与提示词其余部分。
+    """
+    if call == "direction":
+        model, budget, reserve = config.MODEL_PLANNING, config.CONTEXT_BUDGET_DIRECTION, config.CONTEXT_RESERVE_DIRECTION
+    else:
+        model, budget, reserve = config.MODEL_CONTENT, config.CONTEXT_BUDGET_CONTENT, config.CHAPTER_MAX_TOKENS
+    window = config.MODEL_CONTEXT_TOKENS.get(model, 32768)
+    return max(0, min(budget, window - reserve - config.CONTEXT_PROMPT_OVERHEAD))
+
+
+class Section:
+    """
+    上下文中的一段（text 已含标题）。
+    priority 越小越先放入，同级按 rank；order 决定输出位置；
+    fallback 为放不下时改用的更高层摘要；trimmable 的段放不下时截断；
+    static 的段不随章节变化，放在提示词前缀中。
+    """
+
+    def __init__(
+        self,
+        label: str,
+        text: str,
+        priority: int,
+        order: int,
+        rank: int = 0,
+        fallback: Optional["Section"] = None,
+        trimmable: bool = False,
+        static: bool = False,
+    ):
+        self.label = label
+        self.text = text
+        self.priority = priority
+        self.order = order
+        self.rank = rank
+        self.fallback = fallback
+        self.trimmable = trimmable
+        self.static = static
+
+
+def _trim(text: str, max_tokens: int) -> str:
+    """截到估算不超过 max_tokens，尽量断在换行处。"""
+    lo, hi = 0, len(text)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if estimate_tokens(text[:mid] + _TRIM_MARK) <= max_tokens:
+            lo = mid
+        else:
+            hi = mid - 1
+    cut = text[:lo]
+    nl = cut.rfind("\n")
+    if nl > len(cut) // 2:
+        cut = cut[:nl]
+    return cut + _TRIM_MARK
+
+
+def _fill(sections: list[Section], left: float) -> tuple[list[tuple[int, str]], list[dict], float]:
+    """按优先级把各段放入剩余预算 left，返回 (选中的 (order, 文本), 报告, 剩余预算)。"""
+    sep_tokens = estimate_tokens(_SEP)
+    chosen: list[tuple[int, str]] = []
+    report = []
+    for s in sorted(sections, key=lambda s: (s.priority, s.rank)):
+        cost = estimate_tokens(s.text) + sep_tokens
+        if cost <= left:
+            chosen.append((s.order, s.text))
+            left -= cost
+            report.append({"section": s.label, "status": "kept", "tokens": cost})
+            continue
+        fb = s.fallback
+        if fb is not None and estimate_tokens(fb.text) + sep_tokens <= left:
+            cost = estimate_tokens(fb.text) + sep_tokens
+            chosen.append((s.order, fb.text))
+            left -= cost
+            report.append({"section": s.label, "status": "replaced", "tokens": cost, "by": fb.label})
+            continue
+        if s.trimmable and left - sep_tokens >= _MIN_TRIM_TOKENS:
+            text = _trim(s.text, int(left - sep_tokens))
+            cost = estimate_tokens(text) + sep_tokens
+            chosen.append((s.order, text))
+            left -= cost
+            report.append({"section": s.label, "status": "trimmed", "tokens": cost})
+            continue
+        report.append({"section": s.label, "status": "dropped", "tokens": 0})
+    chosen.sort(key=lambda x: x[0])
+    return chosen, report, left
+
+
+def assemble(sections: list[Section], budget: Optional[int] = None) -> dict:
+    """
+    在 budget（None 为不限）内组装上下文。
+    返回 {"text", "prefix", "body", "tokens", "budget", "sections": [{"section", "status", "tokens"}],
+    "dropped": [未完整保留的段]}；text 为 prefix 与 body 相接，
+    status 为 kept / trimmed / replaced（改用 fallback）/ dropped。
+    """
+    left = budget if budget is not None else float("inf")
+    static_left = left * config.CONTEXT_STATIC_SHARE if budget is not None else left
+    static_chosen, report, static_rest = _fill([s for s in sections if s.static], static_left)
+    if budget is not None:
+        left -= static_left - static_rest
+    body_chosen, body_report, _ = _fill([s for s in sections if not s.static], left)
+    report += body_report
+
+    prefix = _SEP.join(t for _, t in static_chosen)
+    body = _SEP.join(t for _, t in body_chosen)
+    text = _SEP.join(t for t in (prefix, body) if t)
+    return {
+        "text": text,
+        "prefix": prefix,
+        "body": body,
+        "tokens": estimate_tokens(text),
+        "budget": budget,
+        "sections": report,
+        "dropped": [r["section"] for r in report if r["status"] != "kept"],
+    }
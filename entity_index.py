@@ -0,0 +1,321 @@
+"""人物出场索引：人物名（含括号中的别名）取自人物设定，用 Aho–Corasick 自动机一次扫描章节正文匹配全部名字，
+记录每章各人物的出现次数与首次、最后一次出现的偏移。
+
+每章一个分片（经由存储后端持久化于 entities/{chapter_id}），签名为 名单签名 + 正文哈希：
+章节写入或正文修改时只重扫该章；人物设定改动使名单变化时由 rebuild 按新名单重扫全书
+（其他进程或漏掉的改动在下次读取时同样按签名补建）。
+进程内按项目缓存各章分片，每个项目一把锁，一个项目重扫时不阻塞其他项目。
+"""
+import hashlib
+import json
+import re
+import threading
+import zlib
+from collections import deque
+from typing import Any, Callable, Iterator, Optional
+
+# 分片格式版本：格式变化时旧分片的签名不再匹配，读取时自动重建
+_SHARD_VERSION = "1"
+_NAME_LINE = re.compile(
+    r"^(?:#{1,6}\s*|[-*•·]\s*|[0-9]{1,2}[.、．]\s*)?【?(?P<name>[^\s，。、；！？,.;!?：:（）()【】#/]{2,12})】?"
+    r"(?:\s*[（(](?P<alias>[^）)]{1,40})[）)])?\s*(?:[：:]|$)"
+)
+_VALUE = re.compile(r"[：:]\s*(?P<name>[^\s，。、；！？,.;!?（）()]{2,12})")
+# 「姓名：林晓」格式取冒号后的值
+_NAME_FIELDS = ("姓名", "名字", "名称")
+# 含这些词的标题、字段名不是人物名
+_NOT_NAMES = (
+    "人物", "角色", "设定", "主角", "配角", "反派", "势力", "简介", "介绍", "说明", "概述", "信息", "其他", "备注",
+    "关系", "背景", "性格", "外貌", "样貌", "特征", "特点", "能力", "技能", "身份", "年龄", "性别", "出身", "经历",
+    "爱好", "武器", "功法", "目标", "动机", "弱点", "称号", "别名", "外号", "绰号", "所属", "阵营", "门派", "等级", "境界",
+)
+_ALIAS_SPLIT = re.compile(r"[、，,/／;；\s]+")
+_ALIAS_PREFIX = re.compile(r"^(?:又名|别名|外号|绰号|人称|昵称|字|号)[：:]?")
+
+
+def extract_names(character_setting: str) -> dict[str, str]:
+    """从人物设定中取人物名：{名字或别名: 人物名}，按在设定中出现的顺序。"""
+    names: dict[str, str] = {}
+    for line in (character_setting or "").split("\n"):
+        s = line.strip()
+        m = _NAME_LINE.match(s)
+        if not m:
+            continue
+        name = m.group("name")
+        if name in _NAME_FIELDS:
+            v = _VALUE.search(s)
+            if not v:
+                continue
+            name = v.group("name")
+        if any(w in name for w in _NOT_NAMES):
+            continue
+        names.setdefault(name, name)
+        for alias in _ALIAS_SPLIT.split(m.group("alias") or ""):
+            alias = _ALIAS_PREFIX.sub("", alias)
+            if 2 <= len(alias) <= 12:
+                names.setdefault(alias, name)
+    return names
+
+
+class Automaton:
+    """Aho–Corasick 自动机：一次扫描找出文本中所有词的出现位置。"""
+
+    def __init__(self, words: list[str]):
+        self.goto: list[dict[str, int]] = [{}]
+        self.fail: list[int] = [0]
+        self.out: list[list[str]] = [[]]
+        for w in words:
+            node = 0
+            for c in w:
+                nxt = self.goto[node].get(c)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[node][c] = nxt
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append([])
+                node = nxt
+            self.out[node].append(w)
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for c, nxt in self.goto[node].items():
+                queue.append(nxt)
+                f = self.fail[node]
+                while f and c not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[nxt] = self.goto[f].get(c, 0)
+                self.out[nxt] = self.out[nxt] + self.out[self.fail[nxt]]
+
+    def iter(self, text: str) -> Iterator[tuple[int, str]]:
+        """逐个产出 (起始偏移, 词)，按结束位置递增；重叠的出现全部产出。"""
+        goto, fail, out = self.goto, self.fail, self.out
+        node = 0
+        for i, c in enumerate(text):
+            while node and c not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(c, 0)
+            for w in out[node]:
+                yield i - len(w) + 1, w
+
+    def find(self, text: str) -> list[tuple[int, str]]:
+        """不重叠的出现（最左、最长优先，如「林晓月」不再计作「林晓」），按偏移排序。"""
+        hits = sorted(self.iter(text), key=lambda h: (h[0], -len(h[1])))
+        out, end = [], 0
+        for start, w in hits:
+            if start >= end:
+                out.append((start, w))
+                end = start + len(w)
+        return out
+
+
+class Roster:
+    """一份人物名单：别名表、自动机与签名。"""
+
+    def __init__(self, names: dict[str, str]):
+        self.names = names
+        self.sig = hashlib.sha1(json.dumps(names, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()
+        self.automaton = Automaton(list(names))
+
+    def people(self) -> list[str]:
+        """人物名（去掉别名），按设定中的顺序。"""
+        return list(dict.fromkeys(self.names.values()))
+
+    def aliases(self, name: str) -> list[str]:
+        return [a for a, n in self.names.items() if n == name and a != name]
+
+    def resolve(self, name: str) -> Optional[str]:
+        return self.names.get(name)
+
+    def scan(self, text: str) -> dict[str, list[int]]:
+        """{人物名: [出现次数, 首次偏移, 最后偏移]}。"""
+        mentions: dict[str, list[int]] = {}
+        for start, w in self.automaton.find(text):
+            name = self.names[w]
+            m = mentions.get(name)
+            if m is None:
+                mentions[name] = [1, start, start]
+            else:
+                m[0] += 1
+                m[2] = start
+        return mentions
+
+    def mentioned(self, text: str) -> list[str]:
+        """text 中提到的人物名，按首次出现的顺序。"""
+        return list(dict.fromkeys(self.names[w] for _, w in self.automaton.find(text)))
+
+
+_rosters: dict[str, Roster] = {}
+_shards: dict[str, dict[str, dict]] = {}
+_project_locks: dict[str, threading.Lock] = {}
+# 保护以上三个字典本身；各项目分片的读写在该项目的锁内
+_lock = threading.Lock()
+
+
+def _project_lock(project_id: str) -> threading.Lock:
+    with _lock:
+        return _project_locks.setdefault(project_id, threading.Lock())
+
+
+def roster(character_setting: str) -> Roster:
+    """人物设定对应的名单（按设定内容缓存）。"""
+    key = hashlib.sha1((character_setting or "").encode("utf-8")).hexdigest()
+    with _lock:
+        r = _rosters.get(key)
+    if r is None:
+        r = Roster(extract_names(character_setting))
+        with _lock:
+            if len(_rosters) >= 64:
+                _rosters.clear()
+            _rosters[key] = r
+    return r
+
+
+def _signature(r: Roster, chapter: dict) -> str:
+    return f"{_SHARD_VERSION}:{r.sig[:16]}:{chapter.get('content_hash', '')}"
+
+
+def _shard_path(chapter_id: str) -> str:
+    return f"entities/{chapter_id}"
+
+
+def _read_shard(backend: Any, project_id: str, chapter_id: str) -> Optional[dict]:
+    raw = backend.read_bytes(project_id, _shard_path(chapter_id))
+    if raw is None:
+        return None
+    try:
+        return json.loads(zlib.decompress(raw))
+    except (zlib.error, ValueError):
+        return None
+
+
+def _write_shard(backend: Any, project_id: str, chapter_id: str, shard: dict) -> None:
+    data = json.dumps(shard, ensure_ascii=False).encode("utf-8")
+    backend.write_bytes(project_id, _shard_path(chapter_id), zlib.compress(data, 6))
+
+
+def _build_shard(r: Roster, chapter: dict, content: str) -> dict:
+    return {"sig": _signature(r, chapter), "mentions": r.scan(content)}
+
+
+def index_chapter(backend: Any, project_id: str, chapter: dict, content: str, character_setting: str) -> None:
+    """章节写入或正文修改后重扫该章并持久化。"""
+    r = roster(character_setting)
+    shard = _build_shard(r, chapter, content)
+    _write_shard(backend, project_id, chapter["id"], shard)
+    with _project_lock(project_id):
+        with _lock:
+            shards = _shards.get(project_id)
+        if shards is not None:
+            shards[chapter["id"]] = shard
+
+
+def _sync(backend: Any, project_id: str, r: Roster, chapters: list[dict], load_content: Callable[[str], str]) -> dict[str, dict]:
+    """让内存中的分片与 chapters 一致：签名不符的先读持久化分片，仍不符则重扫正文。调用方持有该项目的锁。"""
+    with _lock:
+        shards = _shards.setdefault(project_id, {})
+    live = set()
+    for ch in chapters:
+        cid = ch["id"]
+        live.add(cid)
+        sig = _signature(r, ch)
+        shard = shards.get(cid)
+        if shard is not None and shard["sig"] == sig:
+            continue
+        shard = _read_shard(backend, project_id, cid)
+        if shard is None or shard.get("sig") != sig:
+            shard = _build_shard(r, ch, load_content(cid))
+            _write_shard(backend, project_id, cid, shard)
+        shards[cid] = shard
+    for cid in set(shards) - live:
+        del shards[cid]
+    return shards
+
+
+def rebuild(
+    backend: Any,
+    project_id: str,
+    chapters: list[dict],
+    character_setting: str,
+    load_content: Callable[[str], str],
+) -> None:
+    """人物设定改动后按新名单重扫 chapters（已是新名单的分片跳过），使之后的查询与生成不必再重扫。"""
+    r = roster(character_setting)
+    with _project_lock(project_id):
+        _sync(backend, project_id, r, chapters, load_content)
+
+
+def _where(ch: dict, offset: int) -> dict:
+    return {"chapter_id": ch["id"], "volume_idx": ch.get("volume_idx", 0), "chapter_idx": ch.get("chapter_idx", 0), "offset": offset}
+
+
+def entities(
+    backend: Any,
+    project_id: str,
+    chapters: list[dict],
+    character_setting: str,
+    load_content: Callable[[str], str],
+) -> list[dict]:
+    """
+    各人物的出场概况（chapters 为阅读顺序的章节）：
+    [{name, aliases, chapters（出场章数）, mentions（总次数）, first, last}]，first / last 为 {chapter_id, volume_idx, chapter_idx, offset}，
+    未出场为 None；按人物设定中的顺序。
+    """
+    r = roster(character_setting)
+    with _project_lock(project_id):
+        shards = _sync(backend, project_id, r, chapters, load_content)
+        stats = {name: {"name": name, "aliases": r.aliases(name), "chapters": 0, "mentions": 0, "first": None, "last": None}
+                 for name in r.people()}
+        for ch in chapters:
+            for name, (count, first, last) in shards[ch["id"]]["mentions"].items():
+                s = stats.get(name)
+                if s is None:
+                    continue
+                s["chapters"] += 1
+                s["mentions"] += count
+                if s["first"] is None:
+                    s["first"] = _where(ch, first)
+                s["last"] = _where(ch, last)
+    return list(stats.values())
+
+
+def appearances_many(
+    backend: Any,
+    project_id: str,
+    chapters: list[dict],
+    character_setting: str,
+    load_content: Callable[[str], str],
+    names: list[str],
+) -> dict[str, list[dict]]:
+    """
+    names 中各人物（可为别名）按阅读顺序的出场章节，只同步一次分片：
+    {人物名: [{chapter_id, volume_idx, chapter_idx, count, first, last}]}，
+    first / last 为该章内首次、最后一次出现的偏移；名单中没有的名字不在结果中。
+    """
+    r = roster(character_setting)
+    out = {n: [] for n in (r.resolve(name) for name in names) if n is not None}
+    if not out:
+        return out
+    with _project_lock(project_id):
+        shards = _sync(backend, project_id, r, chapters, load_content)
+        for ch in chapters:
+            for name, m in shards[ch["id"]]["mentions"].items():
+                if name in out:
+                    out[name].append({"chapter_id": ch["id"], "volume_idx": ch.get("volume_idx", 0),
+                                      "chapter_idx": ch.get("chapter_idx", 0), "count": m[0], "first": m[1], "last": m[2]})
+    return out
+
+
+def appearances(
+    backend: Any,
+    project_id: str,
+    chapters: list[dict],
+    character_setting: str,
+    load_content: Callable[[str], str],
+    name: str,
+) -> Optional[list[dict]]:
+    """某人物（name 可为别名）按阅读顺序的出场章节（见 appearances_many）；名单中没有该人物时返回 None。"""
+    name = roster(character_setting).resolve(name)
+    if name is None:
+        return None
+    return appearances_many(backend, project_id, chapters, character_setting, load_content, [name])[name]
@@ -0,0 +1,207 @@
+"""整书导出：TXT / Markdown / EPUB。
+
+按卷序、章序（storage.book_chapters）逐章读取正文并即时转换，以生成器逐块输出，
+整本书不会在内存中拼接；EPUB 为流式写出的 ZIP（每写完一章即输出已压缩的部分）。
+"""
+import html
+import io
+import re
+import uuid
+import zipfile
+from datetime import datetime, timezone
+from typing import Iterator, Union
+
+import storage
+
+# 格式 → (Content-Type, 扩展名)
+FORMATS = {
+    "txt": ("text/plain; charset=utf-8", "txt"),
+    "md": ("text/markdown; charset=utf-8", "md"),
+    "epub": ("application/epub+zip", "epub"),
+}
+
+# XML 1.0 不允许的控制字符
+_INVALID_XML = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+
+def _volume_title(volume_idx: int) -> str:
+    return f"第{volume_idx + 1}卷"
+
+
+def _chapter_title(chapter: dict) -> str:
+    return f"第{chapter.get('chapter_idx', 0) + 1}章"
+
+
+def _paragraphs(content: str) -> list[str]:
+    return [p.strip() for p in content.split("\n") if p.strip()]
+
+
+def export(project_id: str, fmt: str) -> Iterator[Union[str, bytes]]:
+    """导出整书，逐块产出（txt/md 为 str，epub 为 bytes）；项目不存在或格式不支持时抛 ValueError。"""
+    if fmt not in FORMATS:
+        raise ValueError(f"不支持的导出格式：{fmt}")
+    meta, chapters = storage.book_chapters(project_id)
+    if meta is None:
+        raise ValueError("项目不存在")
+    writer = {"txt": _txt, "md": _markdown, "epub": _epub}[fmt]
+    return writer(project_id, meta, chapters)
+
+
+def _txt(project_id: str, meta: dict, chapters: list[dict]) -> Iterator[str]:
+    yield f"{meta.get('name', '')}\n"
+    volume = None
+    for ch in chapters:
+        if ch.get("volume_idx", 0) != volume:
+            volume = ch.get("volume_idx", 0)
+            yield f"\n\n{_volume_title(volume)}\n"
+        body = "\n\n".join(_paragraphs(storage.read_chapter_content(project_id, ch)))
+        yield f"\n{_chapter_title(ch)}\n\n{body}\n"
+
+
+def _md_escape(paragraph: str) -> str:
+    """转义段首的 Markdown 标记（#、>、-、1. 等），避免正文被当作标题、引用或列表。"""
+    paragraph = re.sub(r"^(\d+)([.)])", r"\1\\\2", paragraph)
+    return re.sub(r"^([#>*+\-=|`~])", r"\\\1", paragraph)
+
+
+def _markdown(project_id: str, meta: dict, chapters: list[dict]) -> Iterator[str]:
+    yield f"# {meta.get('name', '')}\n"
+    volume = None
+    for ch in chapters:
+        if ch.get("volume_idx", 0) != volume:
+            volume = ch.get("volume_idx", 0)
+            yield f"\n## {_volume_title(volume)}\n"
+        paras = [_md_escape(p) for p in _paragraphs(storage.read_chapter_content(project_id, ch))]
+        yield f"\n### {_chapter_title(ch)}\n\n" + "\n\n".join(paras) + "\n"
+
+
+class _Sink(io.RawIOBase):
+    """只追加、不可 seek 的写入目标：zipfile 据此改用数据描述符流式写出，已写部分由 drain 取走。"""
+
+    def __init__(self):
+        self._buf = bytearray()
+        self._pos = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        self._buf += b
+        self._pos += len(b)
+        return len(b)
+
+    def tell(self) -> int:
+        return self._pos
+
+    def drain(self) -> bytes:
+        out = bytes(self._buf)
+        self._buf.clear()
+        return out
+
+
+def _xml(text: str) -> str:
+    return html.escape(_INVALID_XML.sub("", text), quote=True)
+
+
+def _xhtml(title: str, body: str) -> str:
+    return f"""<?xml version="1.0" encoding="utf-8"?>
+<!DOCTYPE html>
+<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops" xml:lang="zh-CN" lang="zh-CN">
+<head>
+<meta charset="utf-8"/>
+<title>{_xml(title)}</title>
+<link rel="stylesheet" type="text/css" href="style.css"/>
+</head>
+<body>
+{body}
+</body>
+</html>
+"""
+
+
+_CONTAINER = """<?xml version="1.0" encoding="utf-8"?>
+<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+  <rootfiles>
+    <rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/>
+  </rootfiles>
+</container>
+"""
+
+_STYLE = """body { line-height: 1.8; }
+h1 { text-align: center; margin: 3em 0 2em; }
+h2 { text-align: center; margin: 1.5em 0 1em; }
+p { text-indent: 2em; margin: 0 0 0.6em; }
+"""
+
+
+def _opf(project_id: str, meta: dict, files: list[str]) -> str:
+    book_id = uuid.uuid5(uuid.NAMESPACE_URL, f"novel:{project_id}")
+    modified = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    items = "\n".join(f'    <item id="c{i}" href="{f}" media-type="application/xhtml+xml"/>' for i, f in enumerate(files))
+    spine = "\n".join(f'    <itemref idref="c{i}"/>' for i in range(len(files)))
+    return f"""<?xml version="1.0" encoding="utf-8"?>
+<package xmlns="http://www.idpf.org/2007/opf" version="3.0" unique-identifier="book-id" xml:lang="zh-CN">
+  <metadata xmlns:dc="http://purl.org/dc/elements/1.1/">
+    <dc:identifier id="book-id">urn:uuid:{book_id}</dc:identifier>
+    <dc:title>{_xml(meta.get("name", "") or project_id)}</dc:title>
+    <dc:language>zh-CN</dc:language>
+    <meta property="dcterms:modified">{modified}</meta>
+  </metadata>
+  <manifest>
+    <item id="nav" href="nav.xhtml" media-type="application/xhtml+xml" properties="nav"/>
+    <item id="style" href="style.css" media-type="text/css"/>
+{items}
+  </manifest>
+  <spine>
+{spine}
+  </spine>
+</package>
+"""
+
+
+def _nav(meta: dict, chapters: list[dict], files: list[str]) -> str:
+    """目录：卷 → 章两级；卷链接到该卷第一章。"""
+    out, volume = [], None
+    for ch, f in zip(chapters, files):
+        vi = ch.get("volume_idx", 0)
+        if vi != volume:
+            if volume is not None:
+                out.append("</ol></li>")
+            out.append(f'<li><a href="{f}">{_volume_title(vi)}</a><ol>')
+            volume = vi
+        out.append(f'<li><a href="{f}">{_chapter_title(ch)}</a></li>')
+    if volume is not None:
+        out.append("</ol></li>")
+    body = f'<nav epub:type="toc" id="toc">\n<h1>{_xml(meta.get("name", ""))}</h1>\n<ol>\n' + "\n".join(out) + "\n</ol>\n</nav>"
+    return _xhtml("目录", body)
+
+
+def _epub(project_id: str, meta: dict, chapters: list[dict]) -> Iterator[bytes]:
+    files = [f"v{ch.get('volume_idx', 0) + 1}_c{ch.get('chapter_idx', 0) + 1}.xhtml" for ch in chapters]
+    sink = _Sink()
+    now = datetime.now().timetuple()[:6]
+
+    def entry(zf: zipfile.ZipFile, name: str, text: str, compress: int = zipfile.ZIP_DEFLATED) -> None:
+        zf.writestr(zipfile.ZipInfo(name, now), text.encode("utf-8"), compress_type=compress)
+
+    with zipfile.ZipFile(sink, "w") as zf:
+        # mimetype 须为第一个、不压缩的条目
+        entry(zf, "mimetype", "application/epub+zip", zipfile.ZIP_STORED)
+        entry(zf, "META-INF/container.xml", _CONTAINER)
+        entry(zf, "OEBPS/content.opf", _opf(project_id, meta, files))
+        entry(zf, "OEBPS/nav.xhtml", _nav(meta, chapters, files))
+        entry(zf, "OEBPS/style.css", _STYLE)
+        yield sink.drain()
+
+        volume = None
+        for ch, f in zip(chapters, files):
+            head = []
+            if ch.get("volume_idx", 0) != volume:
+                volume = ch.get("volume_idx", 0)
+                head.append(f"<h1>{_volume_title(volume)}</h1>")
+            title = _chapter_title(ch)
+            head.append(f"<h2>{title}</h2>")
+            paras = "\n".join(f"<p>{_xml(p)}</p>" for p in _paragraphs(storage.read_chapter_content(project_id, ch)))
+            entry(zf, f"OEBPS/{f}", _xhtml(f"{_volume_title(volume)} {title}", "\n".join(head) + "\n" + paras))
+            yield sink.drain()
+    yield sink.drain()
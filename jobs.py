@@ -0,0 +1,283 @@
+"""章节生成任务：走向 → 正文 → 保存 → 摘要，每个阶段完成即写入磁盘检查点。
+
+任务记录存于 data/jobs/{job_id}.json（写临时文件后原子替换）。
+执行中的任务持有命名锁 job-{job_id}，多个 worker 进程不会同时执行同一任务。
+进程崩溃或某阶段失败后，resume 从最后完成的阶段继续：已生成的走向与正文不会重新调用模型，
+章节已保存后只补做摘要。任务在后台 asyncio 任务中执行，客户端断开不影响；
+listener 队列可接收 stage/context/direction/token/done/summary/error 事件，供 SSE 转发。
+每次执行以任务 id 为追踪 id，各阶段耗时记入 metrics 并输出追踪日志；
+模型调用的 token 用量在追踪中累计，随每个检查点一并计入项目（被取消时未写检查点的部分不计）。
+执行中的检查点写入、上下文组装与章节保存经 asyncio.to_thread 在线程中进行，不阻塞事件循环。
+"""
+import asyncio
+import json
+import logging
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+import config
+import context_builder
+import locks
+import metrics
+import qwen_client
+import storage
+import summary_worker
+
+log = logging.getLogger(__name__)
+
+JOBS_DIR = Path(config.DATA_DIR) / "jobs"
+# 阶段顺序；stage 记录最后完成的阶段（"" 表示尚未开始）
+STAGES = ("direction", "content", "saved", "summary")
+
+_tasks: dict[str, asyncio.Task] = {}
+
+
+def _now() -> str:
+    return datetime.now().isoformat()
+
+
+def _path(job_id: str) -> Path:
+    return JOBS_DIR / f"{job_id}.json"
+
+
+def get_job(job_id: str) -> Optional[dict]:
+    try:
+        with open(_path(job_id), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _save(job: dict) -> None:
+    job["updated_at"] = _now()
+    locks.atomic_write(_path(job["id"]), json.dumps(job, ensure_ascii=False).encode("utf-8"))
+
+
+async def _checkpoint(job: dict) -> None:
+    """写入任务检查点，并把自上个检查点以来本任务模型调用的 token 用量计入项目。"""
+    usage = metrics.take_usage()
+
+    def write() -> None:
+        _save(job)
+        if usage:
+            storage.add_token_usage(job["project_id"], usage)
+
+    await asyncio.to_thread(write)
+
+
+def _lock(job_id: str) -> locks.NamedLock:
+    return locks.named_lock(f"job-{job_id}")
+
+
+def create_job(project_id: str, volume_idx: int, chapter_idx: int, user_direction: str, gen: dict) -> dict:
+    """新建任务（status="queued"）；生成参数 gen 随任务保存，续跑时保持一致。"""
+    if not storage.get_project(project_id):
+        raise ValueError("项目不存在")
+    job = {
+        "id": uuid.uuid4().hex[:12],
+        "project_id": project_id,
+        "volume_idx": volume_idx,
+        "chapter_idx": chapter_idx,
+        "user_direction": user_direction,
+        "gen": gen,
+        "status": "queued",
+        "stage": "",
+        "error": "",
+        "direction": "",
+        "content": "",
+        "chapter_id": "",
+        "summary": "",
+        "context": None,
+        "created_at": _now(),
+    }
+    _save(job)
+    return job
+
+
+def _done(job: dict, stage: str) -> bool:
+    return STAGES.index(stage) <= (STAGES.index(job["stage"]) if job["stage"] else -1)
+
+
+def is_running(job_id: str) -> bool:
+    """任务是否正在本进程或其他 worker 进程中执行。"""
+    t = _tasks.get(job_id)
+    return (t is not None and not t.done()) or _lock(job_id).held()
+
+
+def start(job_id: str, listener: Optional[asyncio.Queue] = None, stream: bool = False) -> asyncio.Task:
+    """
+    在后台执行（或续跑）任务，返回 asyncio.Task（结果为完成后的任务记录，失败时抛出该阶段的异常）。
+    stream=True 时正文走流式并向 listener 推送 token 事件。listener 收到 None 表示结束；
+    任务已在本进程执行时返回原 Task，listener 只收到一条 error；在其他进程执行时抛 RuntimeError。
+    """
+    t = _tasks.get(job_id)
+    if t is not None and not t.done():
+        if listener is not None:
+            listener.put_nowait(("error", {"detail": "任务正在执行"}))
+            listener.put_nowait(None)
+        return t
+    lock = _lock(job_id)
+    if not lock.acquire(blocking=False):
+        raise RuntimeError("任务正在其他进程中执行")
+    # 取得锁之后再读任务记录，拿到其他进程最后写入的检查点
+    job = get_job(job_id)
+    if not job:
+        lock.release()
+        raise ValueError("任务不存在")
+    t = asyncio.create_task(_run(job, listener, stream))
+    # 后台任务可能无人 await，先取一次异常避免 "never retrieved" 警告
+    t.add_done_callback(lambda f: f.cancelled() or f.exception())
+    t.add_done_callback(lambda f: _tasks.pop(job_id, None))
+    t.add_done_callback(lambda f: lock.release())
+    _tasks[job_id] = t
+    return t
+
+
+async def resume_interrupted() -> int:
+    """启动时续跑上次进程退出前未完成（queued/running）的任务，返回续跑数；跳过其他进程正在执行的任务。"""
+    if not JOBS_DIR.exists():
+        return 0
+    n = 0
+    for p in JOBS_DIR.glob("*.json"):
+        job = get_job(p.stem)
+        if job and job["status"] in ("queued", "running") and not is_running(job["id"]):
+            try:
+                start(job["id"])
+            except RuntimeError:
+                continue
+            n += 1
+    return n
+
+
+async def shutdown() -> None:
+    """进程退出时取消本进程执行中的任务：任务记录保持 running 与最后的检查点，下次启动由 resume_interrupted 续跑。"""
+    tasks = list(_tasks.values())
+    for t in tasks:
+        t.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def _build_contexts(job: dict) -> dict:
+    """分别按走向规划与正文生成的 token 预算组装 RAG 上下文（各段只构建一次）。"""
+    sections = storage.get_rag_sections(job["project_id"], current_volume_idx=job["volume_idx"], query=job["user_direction"])
+    return {call: context_builder.assemble(sections, context_builder.budget_for(call)) for call in ("direction", "content")}
+
+
+def _context_report(ctx: dict) -> dict:
+    """上下文取舍报告：各次调用的估算 token 数、预算与未完整保留的段。"""
+    return {call: {"tokens": c["tokens"], "budget": c["budget"], "dropped": c["dropped"]} for call, c in ctx.items()}
+
+
+async def _run(job: dict, listener: Optional[asyncio.Queue], stream: bool) -> dict:
+    def emit(event: str, data: dict) -> None:
+        if listener is not None:
+            listener.put_nowait((event, data))
+
+    job["status"] = "running"
+    job["error"] = ""
+    await asyncio.to_thread(_save, job)
+    with metrics.trace(job["id"], job["project_id"]):
+        try:
+            with metrics.span("job", resumed_from=job["stage"]):
+                await _run_stages(job, emit, stream)
+            job["status"] = "done"
+            await _checkpoint(job)
+            return job
+        except Exception as e:
+            log.exception("生成任务失败 job=%s stage=%s", job["id"], job["stage"])
+            job["status"] = "error"
+            job["error"] = str(e)
+            await _checkpoint(job)
+            emit("error", {"detail": str(e), "job_id": job["id"]})
+            raise
+        finally:
+            if listener is not None:
+                listener.put_nowait(None)
+
+
+async def _run_stages(job: dict, emit, stream: bool) -> None:
+    gen = job["gen"]
+    pid = job["project_id"]
+    ctx = None
+
+    if not _done(job, "direction"):
+        emit("stage", {"stage": "direction"})
+        with metrics.span("wait_summaries"):
+            await summary_worker.wait_for_context(pid, job["volume_idx"], job["user_direction"])
+        with metrics.span("context"):
+            ctx = await asyncio.to_thread(_build_contexts, job)
+        job["context"] = _context_report(ctx)
+        emit("context", job["context"])
+        with metrics.span("direction"):
+            job["direction"] = await qwen_client.agenerate_chapter_direction(
+                project_context=ctx["direction"]["prefix"],
+                rag_context=ctx["direction"]["body"],
+                user_direction=job["user_direction"],
+                volume_idx=job["volume_idx"],
+                chapter_idx=job["chapter_idx"],
+                temperature=gen.get("temperature"),
+                top_p=gen.get("top_p"),
+            )
+        job["stage"] = "direction"
+        await _checkpoint(job)
+    emit("direction", {"direction": job["direction"]})
+
+    if not _done(job, "content"):
+        emit("stage", {"stage": "content"})
+        if ctx is None:
+            with metrics.span("context"):
+                ctx = await asyncio.to_thread(_build_contexts, job)
+            job["context"] = _context_report(ctx)
+        request = dict(
+            project_context=ctx["content"]["prefix"],
+            rag_context=ctx["content"]["body"],
+            direction=job["direction"],
+            volume_idx=job["volume_idx"],
+            chapter_idx=job["chapter_idx"],
+            temperature=gen.get("temperature"),
+            top_p=gen.get("top_p"),
+        )
+        with metrics.span("content", stream=stream):
+            if stream:
+                parts = []
+                async for delta in qwen_client.agenerate_chapter_content_stream(**request):
+                    parts.append(delta)
+                    emit("token", {"text": delta})
+                job["content"] = "".join(parts).strip()
+            else:
+                job["content"] = await qwen_client.agenerate_chapter_content(**request)
+        job["stage"] = "content"
+        await _checkpoint(job)
+
+    if not _done(job, "saved"):
+        with metrics.span("save", chars=len(job["content"])):
+            job["chapter_id"] = await asyncio.to_thread(
+                storage.add_chapter,
+                project_id=pid,
+                volume_idx=job["volume_idx"],
+                chapter_idx=job["chapter_idx"],
+                direction=job["direction"],
+                content=job["content"],
+                summary_status="pending",
+            )
+        job["stage"] = "saved"
+        await _checkpoint(job)
+    emit("done", {
+        "job_id": job["id"],
+        "chapter_id": job["chapter_id"],
+        "direction": job["direction"],
+        "content": job["content"],
+        "summary": "",
+        "summary_status": "pending",
+    })
+
+    if not _done(job, "summary"):
+        emit("stage", {"stage": "summary"})
+        fut = summary_worker.chapter_future(pid, job["chapter_id"]) or await summary_worker.enqueue_chapter(pid, job["chapter_id"], gen)
+        with metrics.span("summary_wait", chapter=job["chapter_id"]):
+            job["summary"] = await asyncio.shield(fut)
+        job["stage"] = "summary"
+        await _checkpoint(job)
+    emit("summary", {"chapter_id": job["chapter_id"], "summary": job["summary"], "summary_status": "done"})
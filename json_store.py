@@ -0,0 +1,88 @@
+"""JSON 文件存储后端：data/projects/{id}/meta.json + 文本文件（默认后端）。
+
+所有写入为原子替换（locks.atomic_write），崩溃不会留下截断的文件；
+版本戳含 inode，其他进程替换文件后即可察觉。
+"""
+import json
+from pathlib import Path
+from typing import Optional
+
+import config
+import locks
+
+
+def _project_path(project_id: str) -> Path:
+    return Path(config.PROJECTS_DIR) / project_id
+
+
+def list_project_ids() -> list[str]:
+    """列出所有存在 meta.json 的项目 id。"""
+    base = Path(config.PROJECTS_DIR)
+    if not base.exists():
+        return []
+    return [d.name for d in base.iterdir() if d.is_dir() and (d / "meta.json").exists()]
+
+
+def meta_stamp(project_id: str) -> Optional[tuple[int, int, int]]:
+    """meta.json 的 (inode, mtime_ns, size)，用于缓存失效判断；不存在返回 None。"""
+    try:
+        st = (_project_path(project_id) / "meta.json").stat()
+    except FileNotFoundError:
+        return None
+    return st.st_ino, st.st_mtime_ns, st.st_size
+
+
+def read_meta(project_id: str) -> Optional[dict]:
+    """读取项目元信息，不存在返回 None。"""
+    meta_path = _project_path(project_id) / "meta.json"
+    if not meta_path.exists():
+        return None
+    with open(meta_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def write_meta(project_id: str, meta: dict) -> None:
+    """整体写回项目元信息。"""
+    data = json.dumps(meta, ensure_ascii=False, indent=2).encode("utf-8")
+    locks.atomic_write(_project_path(project_id) / "meta.json", data)
+
+
+def _catalog_path() -> Path:
+    return Path(config.DATA_DIR) / "catalog.json"
+
+
+def catalog_stamp() -> Optional[tuple[int, int, int]]:
+    """catalog.json 的 (inode, mtime_ns, size)；不存在返回 None。"""
+    try:
+        st = _catalog_path().stat()
+    except FileNotFoundError:
+        return None
+    return st.st_ino, st.st_mtime_ns, st.st_size
+
+
+def read_catalog() -> Optional[dict]:
+    """读取项目目录索引 {project_id: 摘要}，不存在返回 None。"""
+    p = _catalog_path()
+    if not p.exists():
+        return None
+    with open(p, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def write_catalog(entries: dict, changed: Optional[str] = None) -> None:
+    """整体写回项目目录索引（changed 仅供按行存储的后端使用）。"""
+    locks.atomic_write(_catalog_path(), json.dumps(entries, ensure_ascii=False).encode("utf-8"))
+
+
+def read_bytes(project_id: str, rel_path: str) -> Optional[bytes]:
+    """读取项目目录下的文件（如 chapters/{id}.txt），不存在返回 None。"""
+    p = _project_path(project_id) / rel_path
+    if not p.exists():
+        return None
+    with open(p, "rb") as f:
+        return f.read()
+
+
+def write_bytes(project_id: str, rel_path: str, data: bytes) -> None:
+    """写入项目目录下的文件（原子替换），自动创建子目录。"""
+    locks.atomic_write(_project_path(project_id) / rel_path, data)
@@ -0,0 +1,130 @@
+"""LLM 响应的本地磁盘缓存：键为 (模型, 消息, 采样参数, thinking 预算, max_tokens) 的哈希。
+
+只用于确定性的调用（摘要等，见 qwen_client 中 cache=True 的请求）；正文与走向每次重新生成。
+条目存于 data/llm_cache/{key[:2]}/{key}.json，超过 LLM_CACHE_TTL 秒视为过期；
+总大小超过 LLM_CACHE_MAX_BYTES 时按最近使用时间（命中时刷新 mtime）淘汰。
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+import config
+import locks
+
+_lock = threading.Lock()
+_total: Optional[int] = None  # 缓存目录总字节数，首次写入时统计
+# 命中/未命中计数，由 _count_lock 保护（不与写入、淘汰共用 _lock，读缓存不必等待写盘）
+_count_lock = threading.Lock()
+_hits = 0
+_misses = 0
+
+
+def _count(hit: bool) -> None:
+    global _hits, _misses
+    with _count_lock:
+        if hit:
+            _hits += 1
+        else:
+            _misses += 1
+
+
+def make_key(**params) -> str:
+    raw = json.dumps(params, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _path(key: str) -> Path:
+    return Path(config.LLM_CACHE_DIR) / key[:2] / f"{key}.json"
+
+
+def _files() -> list[tuple[float, int, Path]]:
+    base = Path(config.LLM_CACHE_DIR)
+    if not base.exists():
+        return []
+    out = []
+    for p in base.glob("*/*.json"):
+        try:
+            st = p.stat()
+        except FileNotFoundError:
+            continue
+        out.append((st.st_mtime, st.st_size, p))
+    return out
+
+
+def get(key: str) -> Optional[str]:
+    """命中且未过期时返回缓存文本，否则返回 None（过期条目顺带删除）。"""
+    if config.LLM_CACHE_TTL <= 0:
+        return None
+    p = _path(key)
+    try:
+        with open(p, "r", encoding="utf-8") as f:
+            entry = json.load(f)
+    except (FileNotFoundError, ValueError):
+        _count(False)
+        return None
+    if time.time() - entry.get("created", 0) > config.LLM_CACHE_TTL:
+        _remove(p)
+        _count(False)
+        return None
+    try:
+        os.utime(p)
+    except FileNotFoundError:
+        pass
+    _count(True)
+    return entry["text"]
+
+
+def put(key: str, text: str) -> None:
+    """写入缓存；总大小超限时淘汰最久未用的条目。"""
+    global _total
+    if config.LLM_CACHE_TTL <= 0:
+        return
+    p = _path(key)
+    data = json.dumps({"created": time.time(), "text": text}, ensure_ascii=False).encode("utf-8")
+    with _lock:
+        if _total is None:
+            _total = sum(size for _, size, _ in _files())
+        try:
+            _total -= p.stat().st_size
+        except FileNotFoundError:
+            pass
+        locks.atomic_write(p, data)
+        _total += len(data)
+        if _total > config.LLM_CACHE_MAX_BYTES:
+            _evict()
+
+
+def _evict() -> None:
+    """按 mtime 从旧到新删除，直到总大小降到上限的 90%。调用方持有 _lock。"""
+    global _total
+    files = sorted(_files())
+    _total = sum(size for _, size, _ in files)
+    target = config.LLM_CACHE_MAX_BYTES * 0.9
+    for _, size, p in files:
+        if _total <= target:
+            break
+        _remove(p)
+        _total -= size
+
+
+def _remove(p: Path) -> None:
+    try:
+        p.unlink()
+    except FileNotFoundError:
+        pass
+
+
+def stats() -> dict:
+    with _count_lock:
+        hits, misses = _hits, _misses
+    return {
+        "hits": hits,
+        "misses": misses,
+        "bytes": _total,
+        "max_bytes": config.LLM_CACHE_MAX_BYTES,
+        "ttl": config.LLM_CACHE_TTL,
+    }
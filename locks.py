@@ -0,0 +1,147 @@
+"""命名锁与原子写入：多线程、多 worker 进程同时读改写同一项目时互斥，写入中途崩溃不留下半截文件。
+
+named_lock(name) 同时持有进程内的可重入锁与 data/locks/{name}.lock 上的文件锁
+（fcntl.flock；Windows 上用 msvcrt.locking），同一线程可嵌套获取，外层释放时才放开文件锁。
+atomic_write 先写同目录下的临时文件并 fsync，再 os.replace 替换目标文件。
+"""
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Union
+
+import config
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+def _lock_dir() -> Path:
+    return Path(config.DATA_DIR) / "locks"
+
+
+def _lock_fd(fd: int, blocking: bool) -> bool:
+    if fcntl is not None:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            return True
+        except BlockingIOError:
+            return False
+    while True:
+        os.lseek(fd, 0, os.SEEK_SET)
+        try:
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+            return True
+        except OSError:
+            if not blocking:
+                return False
+            time.sleep(0.01)
+
+
+def _unlock_fd(fd: int) -> None:
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+    else:
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+
+class NamedLock:
+    """进程内可重入、跨进程互斥的命名锁；可用作 with 语句。"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._rlock = threading.RLock()
+        self._fd: int | None = None
+        self._depth = 0
+
+    def acquire(self, blocking: bool = True) -> bool:
+        if not self._rlock.acquire(blocking):
+            return False
+        if self._depth == 0:
+            try:
+                d = _lock_dir()
+                d.mkdir(parents=True, exist_ok=True)
+                fd = os.open(d / f"{self.name}.lock", os.O_RDWR | os.O_CREAT, 0o644)
+            except BaseException:
+                self._rlock.release()
+                raise
+            try:
+                ok = _lock_fd(fd, blocking)
+            except BaseException:
+                os.close(fd)
+                self._rlock.release()
+                raise
+            if not ok:
+                os.close(fd)
+                self._rlock.release()
+                return False
+            self._fd = fd
+        self._depth += 1
+        return True
+
+    def release(self) -> None:
+        self._depth -= 1
+        if self._depth == 0:
+            fd, self._fd = self._fd, None
+            try:
+                _unlock_fd(fd)
+            finally:
+                os.close(fd)
+        self._rlock.release()
+
+    def held(self) -> bool:
+        """是否有线程或其他进程正持有该锁（本线程持有也算）。"""
+        if self._depth:
+            return True
+        if not self.acquire(blocking=False):
+            return True
+        self.release()
+        return False
+
+    def __enter__(self) -> "NamedLock":
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.release()
+
+
+_locks: dict[str, NamedLock] = {}
+_registry_lock = threading.Lock()
+
+
+def named_lock(name: str) -> NamedLock:
+    """取名为 name 的锁（同名共享同一对象）；name 用作文件名，只含字母、数字与 -_。"""
+    with _registry_lock:
+        lock = _locks.get(name)
+        if lock is None:
+            lock = _locks[name] = NamedLock(name)
+        return lock
+
+
+def project_lock(project_id: str) -> NamedLock:
+    """项目锁：meta、用量等项目文件的读-改-写在其中进行。"""
+    return named_lock(f"project-{project_id}")
+
+
+def atomic_write(path: Union[str, Path], data: bytes) -> None:
+    """原子写入文件：读者只会看到旧内容或完整的新内容；自动创建父目录。"""
+    p = Path(path)
+    p.parent.mkdir(parents=True, exist_ok=True)
+    tmp = p.with_name(f".{p.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        with open(tmp, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, p)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except FileNotFoundError:
+            pass
+        raise
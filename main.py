@@ -1,19 +1,62 @@
 """FastAPI 主入口。"""
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form
+from fastapi import FastAPI, HTTPException, Request, UploadFile, File, Form
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from typing import Optional
+from typing import AsyncIterator, Optional
+from contextlib import asynccontextmanager
+import asyncio
+import hashlib
+import json
+import logging
 import os
 from pathlib import Path
+from urllib.parse import quote
 
 import storage
 import settings_store
+import export
+import jobs
+import llm_cache
+import locks
+import metrics
 import qwen_client
+from scheduler import scheduler
+import summary_worker
 import config
 
-app = FastAPI(title="Qwen 双模型小说生成")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 上次退出前未完成的摘要重新入队，未完成的生成任务从检查点续跑；
+    # 多 worker 时只由取得 "resume" 锁的进程执行，并持有到退出，后启动的 worker 不再重复续跑
+    leader = locks.named_lock("resume")
+    is_leader = leader.acquire(blocking=False)
+    if is_leader:
+        await summary_worker.resume_pending(settings_store.get_settings())
+        await jobs.resume_interrupted()
+    try:
+        yield
+    finally:
+        # 先停下后台生成与摘要（其进度留待下次启动续跑），再关闭它们共用的 DashScope 会话
+        await jobs.shutdown()
+        await summary_worker.shutdown()
+        await qwen_client.aclose_session()
+        if is_leader:
+            leader.release()
+
+
+# 追踪日志（每个阶段、每次模型调用一行）输出到 stderr
+if config.TRACE_LOG and not metrics.log.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("%(asctime)s %(name)s %(message)s"))
+    metrics.log.addHandler(_handler)
+    metrics.log.setLevel(logging.INFO)
+    metrics.log.propagate = False
+
+
+app = FastAPI(title="Qwen 双模型小说生成", lifespan=lifespan)
 app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])
 
 # 静态文件
@@ -57,6 +100,30 @@ class UpdateChapterReq(BaseModel):
     content: str
 
 
+def _etag(*parts) -> str:
+    """由版本计数、内容哈希与请求参数生成强 ETag（同一资源的不同表示取不同值）。"""
+    raw = json.dumps(parts, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return '"' + hashlib.sha1(raw.encode("utf-8")).hexdigest()[:20] + '"'
+
+
+def _not_modified(request: Request, etag: str) -> bool:
+    """If-None-Match 中有与 etag 相同的值（或为 *）时为真；按 RFC 9110 用弱比较。"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    tags = [t.strip() for t in header.split(",")]
+    return "*" in tags or etag in (t[2:] if t.startswith("W/") else t for t in tags)
+
+
+def _with_etag(request: Request, etag: str, build) -> Response:
+    """条件请求：ETag 未变时返回 304（不再构造响应体），否则返回 build() 的 JSON 并带上 ETag。
+    Cache-Control: no-cache 使浏览器缓存响应、每次用 If-None-Match 重新验证。"""
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if _not_modified(request, etag):
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(build(), headers=headers)
+
+
 # ----- 路由 -----
 @app.get("/")
 def index():
@@ -64,8 +131,11 @@ def index():
 
 
 @app.get("/api/projects")
-def list_projects_api():
-    return storage.list_projects()
+def list_projects_api(offset: int = 0, limit: int = 50, sort: str = "updated_at", order: str = "desc"):
+    try:
+        return storage.list_projects(offset=offset, limit=max(1, min(limit, 500)), sort=sort, order=order)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 
 @app.post("/api/projects")
@@ -88,26 +158,67 @@ async def create_project_from_txt(
     character_setting_file: Optional[UploadFile] = File(None),
     outline_file: Optional[UploadFile] = File(None),
 ):
-    def _read(f) -> str:
+    async def _read(f) -> str:
         if not f or not f.filename:
             return ""
-        return (f.file.read().decode("utf-8", errors="ignore")).strip()
+        return ((await f.read()).decode("utf-8", errors="ignore")).strip()
 
     ws = await _read(world_setting_file) if world_setting_file else ""
     bs = await _read(background_setting_file) if background_setting_file else ""
     cs = await _read(character_setting_file) if character_setting_file else ""
     ol = await _read(outline_file) if outline_file else ""
 
-    pid = storage.create_project(name=name, world_setting=ws, background_setting=bs, character_setting=cs, outline=ol)
+    # 建项目要取项目锁与目录锁并建设定索引，放到线程中执行，不阻塞事件循环（下同）
+    pid = await asyncio.to_thread(
+        storage.create_project, name=name, world_setting=ws, background_setting=bs, character_setting=cs, outline=ol,
+    )
     return {"project_id": pid, "message": "ok"}
 
 
 @app.get("/api/projects/{project_id}")
-def get_project_api(project_id: str):
+def get_project_api(project_id: str, request: Request, chapters: bool = True):
+    """
+    项目元信息。chapters=false 时不含章节与卷列表（另给出 chapter_count、volume_count），
+    章节列表改用 /api/projects/{id}/chapters 分页获取。带 ETag（随 meta 写入计数变化），支持 If-None-Match。
+    """
     p = storage.get_project(project_id)
     if not p:
         raise HTTPException(404, "项目不存在")
-    return p
+
+    def build() -> dict:
+        if chapters:
+            return p
+        lean = {k: v for k, v in p.items() if k not in ("chapters", "volumes")}
+        lean["chapter_count"] = len(p.get("chapters", []))
+        lean["volume_count"] = len(p.get("volumes", []))
+        return lean
+
+    return _with_etag(request, _etag("project", project_id, p.get("rev", 0), chapters), build)
+
+
+@app.get("/api/projects/{project_id}/chapters")
+def list_chapters_api(
+    project_id: str,
+    request: Request,
+    offset: int = 0,
+    limit: int = 200,
+    fields: Optional[str] = None,
+    volume: Optional[int] = None,
+):
+    """
+    分页列出章节的精简信息：fields 为逗号分隔的 id/volume_idx/chapter_idx/summary_status/char_count/version_count/created_at，
+    缺省为 id、卷、章与摘要状态；volume 限定某一卷。走向、摘要、正文与版本列表按需从单章接口获取。
+    带 ETag（随 meta 写入计数与参数变化），支持 If-None-Match。
+    """
+    field_list = [f.strip() for f in fields.split(",") if f.strip()] if fields else None
+    limit = max(1, min(limit, 1000))
+    try:
+        res = storage.list_chapters(project_id, offset, limit, field_list, volume)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if res is None:
+        raise HTTPException(404, "项目不存在")
+    return _with_etag(request, _etag("chapters", project_id, res["rev"], res["offset"], limit, field_list, volume), lambda: res)
 
 
 @app.put("/api/projects/{project_id}")
@@ -129,14 +240,14 @@ async def update_project_from_txt(
     character_setting_file: Optional[UploadFile] = File(None),
     outline_file: Optional[UploadFile] = File(None),
 ):
-    p = storage.get_project(project_id)
+    p = await asyncio.to_thread(storage.get_project, project_id)
     if not p:
         raise HTTPException(404, "项目不存在")
 
-    def _read(f) -> str | None:
+    async def _read(f) -> str | None:
         if not f or not f.filename:
             return None
-        return (f.file.read().decode("utf-8", errors="ignore")).strip()
+        return ((await f.read()).decode("utf-8", errors="ignore")).strip()
 
     d = {}
     if (ws := await _read(world_setting_file)) is not None:
@@ -149,10 +260,31 @@ async def update_project_from_txt(
         d["outline"] = ol
 
     if d:
-        storage.update_project(project_id, **d)
+        # 改动人物设定时会重建整书的出场索引
+        await asyncio.to_thread(storage.update_project, project_id, **d)
     return {"message": "ok"}
 
 
+@app.get("/api/stats")
+def stats_api():
+    """运行状态：元信息缓存、LLM 响应缓存的命中情况，各模型限流队列的深度与等待时间等。"""
+    return {"meta_cache": storage.cache_stats(), "llm_cache": llm_cache.stats(), "scheduler": scheduler.stats()}
+
+
+@app.get("/metrics")
+def metrics_api():
+    """Prometheus 抓取端点：各阶段与模型调用的耗时、首段时间、token 数、错误数，存储读写耗时与字节数。"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/api/projects/{project_id}/usage")
+def project_usage_api(project_id: str):
+    """项目累计的模型 token 用量（按模型、按阶段）。"""
+    if not storage.get_project(project_id):
+        raise HTTPException(404, "项目不存在")
+    return storage.get_token_usage(project_id)
+
+
 @app.get("/api/settings")
 def get_settings_api():
     return settings_store.get_settings()
@@ -169,78 +301,170 @@ def update_settings_api(req: UpdateSettingsReq):
     return settings_store.save_settings(d)
 
 
+async def _create_job(req: GenerateChapterReq) -> dict:
+    gen = await asyncio.to_thread(settings_store.get_settings)
+    try:
+        return await asyncio.to_thread(jobs.create_job, req.project_id, req.volume_idx, req.chapter_idx, req.user_direction, gen)
+    except ValueError as e:
+        raise HTTPException(404, str(e))
+
+
 @app.post("/api/generate-chapter")
-def generate_chapter_api(req: GenerateChapterReq):
-    """生成新章节：1.规划走向 2.生成正文 3.章摘要 4.视情况压缩早期卷"""
+async def generate_chapter_api(req: GenerateChapterReq):
+    """
+    生成新章节：1.规划走向 2.生成正文 3.保存并返回；章摘要与卷摘要由后台队列补上。
+    经生成任务执行，各阶段完成即写检查点；失败后可用 /api/jobs/{job_id}/resume 从断点续跑。
+    """
+    job = await _create_job(req)
+    events: asyncio.Queue = asyncio.Queue()
+    task = jobs.start(job["id"], events)
     try:
-        gen = settings_store.get_settings()
-        rag = storage.get_rag_context(req.project_id, current_volume_idx=req.volume_idx)
-        direction = qwen_client.generate_chapter_direction(
-            rag_context=rag,
-            user_direction=req.user_direction,
-            volume_idx=req.volume_idx,
-            chapter_idx=req.chapter_idx,
-            temperature=gen.get("temperature"),
-            top_p=gen.get("top_p"),
-        )
-        content = qwen_client.generate_chapter_content(
-            rag_context=rag,
-            direction=direction,
-            volume_idx=req.volume_idx,
-            chapter_idx=req.chapter_idx,
-            temperature=gen.get("temperature"),
-            top_p=gen.get("top_p"),
-        )
-        summary = qwen_client.summarize_chapter(
-            content, direction,
-            temperature=gen.get("temperature"),
-            top_p=gen.get("top_p"),
-        )
-
-        chapter_id = storage.add_chapter(
-            project_id=req.project_id,
-            volume_idx=req.volume_idx,
-            chapter_idx=req.chapter_idx,
-            direction=direction,
-            content=content,
-            summary=summary,
-        )
-
-        # 早期卷：若该卷章节数达到阈值，压缩成卷摘要
-        meta = storage.get_project(req.project_id)
-        vols = meta.get("volumes", [])
-        if req.volume_idx < len(vols):
-            vol = vols[req.volume_idx]
-            ch_ids = vol.get("chapters", [])
-            if len(ch_ids) >= 3:  # 每卷≥3章时生成卷摘要
-                ch_summaries = [
-                    next((c["summary"] for c in meta.get("chapters", []) if c["id"] == cid), "")
-                    for cid in ch_ids
-                ]
-                vol_sum = qwen_client.summarize_volume(
-                    ch_summaries,
-                    temperature=gen.get("temperature"),
-                    top_p=gen.get("top_p"),
-                )
-                storage.update_volume_summary(req.project_id, req.volume_idx, vol_sum)
-
-        return {"chapter_id": chapter_id, "direction": direction, "content": content, "summary": summary}
+        while (item := await events.get()) is not None:
+            event, data = item
+            if event == "done":
+                return {**data, "context": ((await asyncio.to_thread(jobs.get_job, job["id"])) or {}).get("context")}
+        await asyncio.shield(task)
+        raise RuntimeError("任务未完成")
     except ValueError as e:
         raise HTTPException(400, str(e))
     except RuntimeError as e:
         raise HTTPException(500, str(e))
 
 
+def _sse(event: str, data: dict) -> str:
+    """编码一条 Server-Sent Events 消息。"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.post("/api/generate-chapter/stream")
+async def generate_chapter_stream_api(req: GenerateChapterReq):
+    """
+    流式生成新章节（SSE）。流程与 /api/generate-chapter 相同，依次推送：
+    job → stage(direction) → context → direction → stage(content) → token* → done（章节已保存）→ stage(summary) → summary；
+    出错时推送 error。任务在后台执行，客户端断开也不影响检查点与摘要。
+    """
+    job = await _create_job(req)
+
+    async def events() -> AsyncIterator[str]:
+        yield _sse("job", {"job_id": job["id"]})
+        q: asyncio.Queue = asyncio.Queue()
+        jobs.start(job["id"], q, stream=True)
+        while (item := await q.get()) is not None:
+            yield _sse(*item)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.post("/api/jobs")
+async def create_job_api(req: GenerateChapterReq):
+    """提交生成任务并立即返回 job_id；进度见 GET /api/jobs/{job_id}。"""
+    job = await _create_job(req)
+    jobs.start(job["id"])
+    return {"job_id": job["id"], "status": "running"}
+
+
+@app.get("/api/jobs/{job_id}")
+def get_job_api(job_id: str):
+    """任务状态：status（queued/running/done/error）、最后完成的阶段 stage、各阶段产出与错误信息。"""
+    job = jobs.get_job(job_id)
+    if not job:
+        raise HTTPException(404, "任务不存在")
+    if job["status"] == "running" and not jobs.is_running(job_id):
+        job["status"] = "interrupted"
+    return job
+
+
+@app.post("/api/jobs/{job_id}/resume")
+async def resume_job_api(job_id: str):
+    """从最后完成的阶段继续执行失败或中断的任务；已完成的阶段不会重新调用模型。"""
+    job = await asyncio.to_thread(jobs.get_job, job_id)
+    if not job:
+        raise HTTPException(404, "任务不存在")
+    if job["status"] == "done" or jobs.is_running(job_id):
+        return {"job_id": job_id, "status": job["status"], "stage": job["stage"]}
+    try:
+        jobs.start(job_id)
+    except RuntimeError as e:
+        raise HTTPException(409, str(e))
+    return {"job_id": job_id, "status": "running", "stage": job["stage"]}
+
+
+@app.get("/api/projects/{project_id}/search")
+def search_api(project_id: str, q: str, kind: Optional[str] = None, sort: str = "score", order: str = "desc", offset: int = 0, limit: int = 20):
+    """
+    全文查找章节正文、摘要与走向：q 按空格分词，须全部逐字出现；kind 为逗号分隔的 content/summary/direction。
+    sort=position&order=desc 可查某人物、物品、地点最近一次出现的位置。各项含章节、命中偏移与摘录。
+    """
+    if not storage.get_project(project_id):
+        raise HTTPException(404, "项目不存在")
+    kinds = [k.strip() for k in kind.split(",") if k.strip()] if kind else None
+    try:
+        return storage.search_chapters(project_id, q, kinds, sort, order, offset, max(1, min(limit, 200)))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/api/projects/{project_id}/entities")
+def list_entities_api(project_id: str):
+    """人物设定中各人物（含括号中的别名）的出场概况：出场章数、总次数、首次与最近一次出场的章节及偏移。"""
+    items = storage.list_entities(project_id)
+    if items is None:
+        raise HTTPException(404, "项目不存在")
+    return {"items": items}
+
+
+@app.get("/api/projects/{project_id}/entities/{name}")
+def entity_appearances_api(project_id: str, name: str, order: str = "asc", offset: int = 0, limit: int = 50):
+    """某人物按卷、章顺序的出场章节（order=desc 时最近的在前），各章含出现次数与首末偏移。"""
+    if order not in ("asc", "desc"):
+        raise HTTPException(400, f"不支持的排序方向：{order}")
+    if not storage.get_project(project_id):
+        raise HTTPException(404, "项目不存在")
+    items = storage.entity_appearances(project_id, name)
+    if items is None:
+        raise HTTPException(404, "人物设定中没有该人物")
+    if order == "desc":
+        items.reverse()
+    offset, limit = max(0, offset), max(1, min(limit, 500))
+    return {"name": name, "items": items[offset:offset + limit], "total": len(items), "offset": offset, "limit": limit}
+
+
+@app.get("/api/projects/{project_id}/export")
+def export_api(project_id: str, format: str = "txt"):
+    """导出整书（format=txt|md|epub）：按卷、章顺序逐章转换并流式下载，大书也能立即开始下载、内存占用平稳。"""
+    try:
+        chunks = export.export(project_id, format)
+    except ValueError as e:
+        raise HTTPException(404 if format in export.FORMATS else 400, str(e))
+    media_type, ext = export.FORMATS[format]
+    name = (storage.get_project(project_id) or {}).get("name") or project_id
+    return StreamingResponse(
+        chunks,
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename*=UTF-8''{quote(f'{name}.{ext}')}"},
+    )
+
+
 @app.get("/api/projects/{project_id}/chapters/{chapter_id}")
-def get_chapter_api(project_id: str, chapter_id: str):
-    content = storage.get_chapter_content(project_id, chapter_id)
+def get_chapter_api(project_id: str, chapter_id: str, request: Request):
+    """单章正文、走向、摘要与版本列表。ETag 由章节记录（正文哈希、版本列表、摘要等）生成，未变时 304 且不读正文。"""
     meta = storage.get_project(project_id)
     if not meta:
         raise HTTPException(404, "项目不存在")
-    ch_info = next((c for c in meta.get("chapters", []) if c["id"] == chapter_id), None)
+    ch_info = storage.get_chapter(project_id, chapter_id)
     if not ch_info:
         raise HTTPException(404, "章节不存在")
-    return {"content": content, "direction": ch_info.get("direction"), "summary": ch_info.get("summary"), "versions": ch_info.get("versions", [])}
+    return _with_etag(request, _etag("chapter", project_id, ch_info), lambda: {
+        "content": storage.read_chapter_content(project_id, ch_info),
+        "direction": ch_info.get("direction"),
+        "summary": ch_info.get("summary"),
+        "summary_status": ch_info.get("summary_status", "done"),
+        "versions": ch_info.get("versions", []),
+    })
 
 
 @app.put("/api/projects/{project_id}/chapters/{chapter_id}")
@@ -262,26 +486,27 @@ def get_version_api(project_id: str, chapter_id: str, version_id: str):
 
 
 @app.post("/api/projects/{project_id}/chapters/{chapter_id}/summarize")
-def summarize_chapter_api(project_id: str, chapter_id: str):
-    """对已有章节重新做摘要（手动触发）。"""
-    gen = settings_store.get_settings()
-    content = storage.get_chapter_content(project_id, chapter_id)
-    meta = storage.get_project(project_id)
+async def summarize_chapter_api(project_id: str, chapter_id: str):
+    """对已有章节重新做摘要（手动触发）。经后台队列执行以保持项目内摘要顺序。"""
+    gen = await asyncio.to_thread(settings_store.get_settings)
+    meta = await asyncio.to_thread(storage.get_project, project_id)
     if not meta:
         raise HTTPException(404, "项目不存在")
-    ch = next((c for c in meta.get("chapters", []) if c["id"] == chapter_id), None)
+    ch = await asyncio.to_thread(storage.get_chapter, project_id, chapter_id)
     if not ch:
         raise HTTPException(404, "章节不存在")
-    direction = ch.get("direction", "")
-    summary = qwen_client.summarize_chapter(
-        content, direction,
-        temperature=gen.get("temperature"),
-        top_p=gen.get("top_p"),
-    )
-    storage.update_chapter_summary(project_id, chapter_id, summary)
+    try:
+        summary = await asyncio.shield(await summary_worker.enqueue_chapter(project_id, chapter_id, gen))
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    except RuntimeError as e:
+        raise HTTPException(500, str(e))
     return {"summary": summary}
 
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=29147)
+    if config.WORKERS > 1:
+        uvicorn.run("main:app", host="0.0.0.0", port=29147, workers=config.WORKERS)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=29147)
@@ -0,0 +1,96 @@
+"""项目元信息的进程内 LRU 缓存。
+
+以 project_id 为键，每项附带后端给出的版本戳（JSON 为 meta.json 的 mtime/size，
+SQLite 为写入计数），戳不一致即视为失效；按估算内存占用淘汰最久未用的项目。
+"""
+import threading
+from collections import OrderedDict
+from typing import Any, Optional
+
+
+def clone(obj: Any) -> Any:
+    """复制 JSON 结构（dict/list/标量），比 copy.deepcopy 快。"""
+    if isinstance(obj, dict):
+        return {k: clone(v) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [clone(v) for v in obj]
+    return obj
+
+
+def approx_size(obj: Any) -> int:
+    """粗略估算 JSON 结构的内存占用（字节）。"""
+    if isinstance(obj, str):
+        return 49 + len(obj) * 2
+    if isinstance(obj, dict):
+        return 64 + sum(approx_size(k) + approx_size(v) for k, v in obj.items())
+    if isinstance(obj, list):
+        return 56 + sum(approx_size(v) for v in obj)
+    return 32
+
+
+class MetaCache:
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._bytes = 0
+        # project_id -> [stamp, meta, size, index]；index 为附属于该 meta 对象的派生索引
+        self._items: OrderedDict[str, list] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, project_id: str, stamp: Any) -> Optional[dict]:
+        """戳一致时返回缓存的 meta，否则返回 None 并丢弃旧项。"""
+        with self._lock:
+            item = self._items.get(project_id)
+            if item is not None and item[0] == stamp:
+                self._items.move_to_end(project_id)
+                self.hits += 1
+                return item[1]
+            if item is not None:
+                self._drop(project_id)
+            self.misses += 1
+            return None
+
+    def put(self, project_id: str, stamp: Any, meta: dict, index: Any = None) -> None:
+        size = approx_size(meta)
+        with self._lock:
+            self._drop(project_id)
+            if size > self.max_bytes:
+                return
+            self._items[project_id] = [stamp, meta, size, index]
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                self._drop(next(iter(self._items)))
+
+    def get_index(self, project_id: str, meta: dict) -> Any:
+        """取附属于 meta（必须是当前缓存的同一对象）的索引，没有则返回 None。"""
+        with self._lock:
+            item = self._items.get(project_id)
+            if item is not None and item[1] is meta:
+                return item[3]
+            return None
+
+    def set_index(self, project_id: str, meta: dict, index: Any) -> None:
+        with self._lock:
+            item = self._items.get(project_id)
+            if item is not None and item[1] is meta:
+                item[3] = index
+
+    def invalidate(self, project_id: str) -> None:
+        with self._lock:
+            self._drop(project_id)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._items),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+    def _drop(self, project_id: str) -> None:
+        item = self._items.pop(project_id, None)
+        if item is not None:
+            self._bytes -= item[2]
@@ -0,0 +1,271 @@
+"""运行指标（Prometheus 文本格式，见 /metrics）与按请求的阶段追踪日志。
+
+指标：各阶段耗时；模型调用按 (模型, 阶段) 的耗时、首段输出时间、输入/输出/推理 token 数与错误数；
+存储读写按操作的耗时与字节数。直方图与计数器为进程内实现，不依赖 prometheus_client。
+
+追踪：trace(trace_id, project_id) 为当前上下文（asyncio 任务或线程，经 contextvars 传递）设定追踪 id，
+之后 span() 与模型调用各输出一行 "trace=... span=... ms=..." 日志（logger "novel.trace"），
+同一次生成（trace_id 即任务 id）的走向、正文、保存、摘要可据此串起来。
+追踪中的模型调用还累计 token 用量，由开启追踪的一方（生成任务、摘要队列）取出后写入项目。
+"""
+import contextvars
+import logging
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+log = logging.getLogger("novel.trace")
+
+_LATENCY_BUCKETS = (0.005, 0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+_TOKEN_BUCKETS = (100, 500, 1000, 2000, 4000, 8000, 16000, 32000, 64000)
+_BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+_lock = threading.Lock()
+_registry: list["_Metric"] = []
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...]):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values: dict[tuple, object] = {}
+        _registry.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(k, "")) for k in self.labels)
+
+    def _fmt(self, key: tuple, extra: str = "") -> str:
+        pairs = [f'{k}="{_escape(v)}"' for k, v in zip(self.labels, key)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, value: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with _lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def render(self) -> list[str]:
+        return [f"{self.name}{self._fmt(k)} {_num(v)}" for k, v in sorted(self.values.items())]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...], buckets: tuple = _LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with _lock:
+            h = self.values.get(key)
+            if h is None:
+                h = self.values[key] = [[0] * len(self.buckets), 0, 0.0]
+            i = bisect_left(self.buckets, value)
+            if i < len(self.buckets):
+                h[0][i] += 1
+            h[1] += 1
+            h[2] += value
+
+    def render(self) -> list[str]:
+        out = []
+        for key, (counts, n, total) in sorted(self.values.items()):
+            acc = 0
+            for le, c in zip(self.buckets + ("+Inf",), counts + [n - sum(counts)]):
+                acc += c
+                bound = 'le="%s"' % (le if isinstance(le, str) else _num(le))
+                out.append(f"{self.name}_bucket{self._fmt(key, bound)} {acc}")
+            out.append(f"{self.name}_sum{self._fmt(key)} {_num(total)}")
+            out.append(f"{self.name}_count{self._fmt(key)} {n}")
+        return out
+
+
+def _escape(v: str) -> str:
+    return v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _num(v: float) -> str:
+    return str(int(v)) if float(v).is_integer() else repr(float(v))
+
+
+def render() -> str:
+    """所有指标的 Prometheus 文本格式。"""
+    lines = []
+    with _lock:
+        for m in _registry:
+            lines.append(f"# HELP {m.name} {m.help}")
+            lines.append(f"# TYPE {m.name} {m.kind}")
+            lines.extend(m.render())
+    return "\n".join(lines) + "\n"
+
+
+STAGE_SECONDS = Histogram("novel_stage_seconds", "生成流水线各阶段耗时（秒）", ("stage",))
+STAGE_ERRORS = Counter("novel_stage_errors_total", "生成流水线各阶段失败次数", ("stage",))
+LLM_SECONDS = Histogram("novel_llm_request_seconds", "单次模型调用耗时（秒）", ("model", "stage"))
+LLM_FIRST_TOKEN = Histogram("novel_llm_first_token_seconds", "模型调用首段输出时间（秒）", ("model", "stage"))
+LLM_TOKENS = Histogram("novel_llm_tokens", "单次模型调用的 token 数", ("model", "stage", "kind"), _TOKEN_BUCKETS)
+LLM_TOKENS_TOTAL = Counter("novel_llm_tokens_total", "模型调用 token 数累计", ("model", "stage", "kind"))
+LLM_ERRORS = Counter("novel_llm_errors_total", "模型调用错误数", ("model", "stage", "code"))
+STORAGE_SECONDS = Histogram("novel_storage_seconds", "存储读写耗时（秒）", ("op",))
+STORAGE_BYTES = Histogram("novel_storage_bytes", "存储读写字节数", ("op",), _BYTES_BUCKETS)
+
+
+# ----- 追踪 -----
+_trace: contextvars.ContextVar[Optional[dict]] = contextvars.ContextVar("novel_trace", default=None)
+
+
+@contextmanager
+def trace(trace_id: Optional[str] = None, project_id: str = "") -> Iterator[dict]:
+    """在当前上下文中开启追踪；其中创建的 asyncio 任务继承同一追踪（及其 token 用量累计）。"""
+    ctx = {"id": trace_id or uuid.uuid4().hex[:12], "project_id": project_id, "usage": {}}
+    token = _trace.set(ctx)
+    try:
+        yield ctx
+    finally:
+        _trace.reset(token)
+
+
+def current_trace_id() -> Optional[str]:
+    ctx = _trace.get()
+    return ctx["id"] if ctx else None
+
+
+def take_usage() -> dict[tuple[str, str], dict[str, int]]:
+    """取出并清空当前追踪中累计的模型 token 用量：{(模型, 阶段): {calls, input, output, reasoning}}。"""
+    ctx = _trace.get()
+    if not ctx:
+        return {}
+    usage, ctx["usage"] = ctx["usage"], {}
+    return usage
+
+
+def log_span(span: str, seconds: float, **attrs) -> None:
+    ctx = _trace.get()
+    if not ctx:
+        return
+    extra = "".join(f" {k}={v}" for k, v in attrs.items() if v not in (None, ""))
+    log.info("trace=%s project=%s span=%s ms=%d%s", ctx["id"], ctx["project_id"], span, seconds * 1000, extra)
+
+
+@contextmanager
+def span(stage: str, **attrs) -> Iterator[None]:
+    """计时一个流水线阶段：记入 novel_stage_seconds（失败时另计错误数）并输出追踪日志。"""
+    start = time.monotonic()
+    status = "ok"
+    try:
+        yield
+    except BaseException:
+        status = "error"
+        STAGE_ERRORS.inc(stage=stage)
+        raise
+    finally:
+        elapsed = time.monotonic() - start
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        log_span(stage, elapsed, status=status, **attrs)
+
+
+@contextmanager
+def storage_op(op: str, nbytes: Optional[int] = None) -> Iterator[dict]:
+    """计时一次存储读写；字节数可预先给出，或在块内写入 rec["bytes"]。"""
+    rec = {"bytes": nbytes}
+    start = time.monotonic()
+    try:
+        yield rec
+    finally:
+        STORAGE_SECONDS.observe(time.monotonic() - start, op=op)
+        if rec["bytes"] is not None:
+            STORAGE_BYTES.observe(rec["bytes"], op=op)
+
+
+class InstrumentedBackend:
+    """包装存储后端模块：meta 与文件读写计入 novel_storage_*，其余属性原样转发。"""
+
+    def __init__(self, backend):
+        self._backend = backend
+
+    def __getattr__(self, name: str):
+        return getattr(self._backend, name)
+
+    def read_meta(self, project_id: str):
+        with storage_op("read_meta"):
+            return self._backend.read_meta(project_id)
+
+    def write_meta(self, project_id: str, meta: dict) -> None:
+        with storage_op("write_meta"):
+            self._backend.write_meta(project_id, meta)
+
+    def read_bytes(self, project_id: str, rel_path: str):
+        with storage_op("read_bytes") as rec:
+            data = self._backend.read_bytes(project_id, rel_path)
+            rec["bytes"] = len(data) if data is not None else None
+            return data
+
+    def write_bytes(self, project_id: str, rel_path: str, data: bytes) -> None:
+        with storage_op("write_bytes", len(data)):
+            self._backend.write_bytes(project_id, rel_path, data)
+
+
+class LLMCall:
+    """一次模型调用（一次尝试）的计时、首段时间、usage 与错误记录。"""
+
+    def __init__(self, model: str, stage: Optional[str]):
+        self.model = model
+        self.stage = stage or "other"
+        self.start = time.monotonic()
+        self.first: Optional[float] = None
+        self.usage = None
+        self.error: Optional[BaseException] = None
+
+    def chunk(self, resp) -> None:
+        if self.first is None:
+            self.first = time.monotonic()
+        usage = getattr(resp, "usage", None)
+        if usage:
+            self.usage = usage
+
+    def tokens(self) -> dict[str, int]:
+        u = self.usage or {}
+        details = u.get("output_tokens_details") or {}
+        out = {"input": u.get("input_tokens") or 0, "output": u.get("output_tokens") or 0,
+               "reasoning": details.get("reasoning_tokens") or 0}
+        return {k: int(v) for k, v in out.items() if v}
+
+    def finish(self) -> dict[str, int]:
+        """记入指标、累计到当前追踪的用量（见 take_usage）并输出追踪日志，返回本次的 token 数 {input/output/reasoning: n}。"""
+        labels = {"model": self.model, "stage": self.stage}
+        elapsed = time.monotonic() - self.start
+        LLM_SECONDS.observe(elapsed, **labels)
+        if self.first is not None:
+            LLM_FIRST_TOKEN.observe(self.first - self.start, **labels)
+        if self.error is not None:
+            code = getattr(self.error, "status", None) or type(self.error).__name__
+            LLM_ERRORS.inc(code=code, **labels)
+        tokens = self.tokens()
+        for kind, n in tokens.items():
+            LLM_TOKENS.observe(n, kind=kind, **labels)
+            LLM_TOKENS_TOTAL.inc(n, kind=kind, **labels)
+        ctx = _trace.get()
+        if ctx and tokens:
+            acc = ctx["usage"].setdefault((self.model, self.stage), {"calls": 0})
+            acc["calls"] += 1
+            for kind, n in tokens.items():
+                acc[kind] = acc.get(kind, 0) + n
+        log_span(
+            f"llm.{self.stage}", elapsed,
+            model=self.model,
+            ttft_ms=int((self.first - self.start) * 1000) if self.first is not None else None,
+            error=type(self.error).__name__ if self.error is not None else None,
+            **tokens,
+        )
+        return tokens
@@ -0,0 +1,51 @@
+"""一次性迁移：data/projects/*/ 下的 meta.json 与其余全部文件 → SQLite（config.SQLITE_PATH）。
+
+除 meta.json 外，项目目录中的文件都是经由存储后端 read_bytes / write_bytes 读写的内容，
+按相对路径逐个写入 blobs 表：章节与版本内容、内容块（blobs/）、token 用量（usage.json）、
+检索分片（retrieval/）、人物出场分片（entities/）与长设定索引（setting_index/）。
+各索引带签名，缺失或过期的在首次读取时自动重建。
+
+用法：python migrate_to_sqlite.py [--force]
+已存在于数据库中的项目默认跳过，--force 时覆盖。迁移完成后设置
+环境变量 NOVEL_STORAGE_BACKEND=sqlite 启动即可；原 JSON 文件保持不动。
+"""
+import sys
+from pathlib import Path
+
+import config
+import json_store
+import sqlite_store
+
+
+def migrate(force: bool = False) -> tuple[int, int]:
+    """迁移所有项目，返回 (迁移项目数, 跳过项目数)。"""
+    existing = set(sqlite_store.list_project_ids())
+    migrated = skipped = 0
+    for project_id in sorted(json_store.list_project_ids()):
+        if project_id in existing and not force:
+            skipped += 1
+            continue
+        meta = json_store.read_meta(project_id)
+        if meta is None:
+            continue
+        if project_id in existing:
+            sqlite_store.read_meta(project_id)  # 载入旧行，覆盖时删除多余的行
+        sqlite_store.write_meta(project_id, meta)
+
+        base = Path(config.PROJECTS_DIR) / project_id
+        files = 0
+        for f in sorted(base.rglob("*")):
+            # 跳过 meta.json（已写入）与原子写入残留的临时文件
+            if not f.is_file() or f.name.endswith(".tmp") or f == base / "meta.json":
+                continue
+            rel = f.relative_to(base).as_posix()
+            sqlite_store.write_bytes(project_id, rel, json_store.read_bytes(project_id, rel))
+            files += 1
+        migrated += 1
+        print(f"已迁移 {project_id} {meta.get('name', '')}（{files} 个文件）")
+    return migrated, skipped
+
+
+if __name__ == "__main__":
+    m, s = migrate(force="--force" in sys.argv[1:])
+    print(f"完成：迁移 {m} 个项目，跳过 {s} 个 → {config.SQLITE_PATH}")
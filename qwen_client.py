@@ -1,15 +1,41 @@
 """Qwen API 客户端：规划模型(thinking) + 正文模型(plus)。"""
+import asyncio
+import itertools
 import json
-from typing import Optional
+import random
+import weakref
+from contextlib import aclosing
+from typing import AsyncIterator, Awaitable, Callable, Optional
 
+import aiohttp
 import dashscope
-from dashscope import Generation
+from dashscope import AioGeneration
 from dashscope.api_entities.dashscope_response import GenerationResponse
 
 import config
+import context_builder
+import llm_cache
+import metrics
+from scheduler import INTERACTIVE, BACKGROUND, scheduler
 
 
-def _call(
+class LLMError(RuntimeError):
+    """DashScope 调用失败。retryable 表示可重试（限流、服务端错误、超时）。"""
+
+    def __init__(self, message: str, status: int | None = None, retryable: bool = False):
+        super().__init__(message)
+        self.status = status
+        self.retryable = retryable
+
+
+class LLMTimeout(LLMError):
+    """首段输出或整次调用超过 config.LLM_TIMEOUTS 的限制。"""
+
+    def __init__(self, message: str):
+        super().__init__(message, retryable=True)
+
+
+def _build_kwargs(
     model: str,
     messages: list[dict],
     enable_thinking: bool = False,
@@ -17,13 +43,20 @@ def _call(
     max_tokens: int | None = None,
     temperature: float | None = None,
     top_p: float | None = None,
-) -> str:
-    """调用千问 API。enable_thinking 时必须用流式，且只返回最终 content。"""
+    stream: bool = False,
+    request_timeout: float | None = None,
+) -> dict:
+    """组装 Generation.call 参数。thinking 与 stream 都走增量流式输出。"""
     dashscope.api_key = config.DASHSCOPE_API_KEY
     if not dashscope.api_key:
         raise ValueError("请设置环境变量 DASHSCOPE_API_KEY 或在 config.py 中配置")
 
     kwargs = {"model": model, "messages": messages}
+    if config.DASHSCOPE_BASE_URL:
+        kwargs["base_address"] = config.DASHSCOPE_BASE_URL
+    if request_timeout is not None:
+        # SDK 层兜底：超时后被放弃的连接也会在此时限内关闭
+        kwargs["request_timeout"] = int(request_timeout) + 1
     if max_tokens is not None:
         kwargs["max_tokens"] = max_tokens
     if temperature is not None:
@@ -31,47 +64,353 @@ def _call(
     if top_p is not None:
         kwargs["top_p"] = top_p
     if enable_thinking:
-        kwargs["result_format"] = "message"
         kwargs["enable_thinking"] = True
         kwargs["thinking_budget"] = thinking_budget
+    if enable_thinking or stream:
+        kwargs["result_format"] = "message"
         kwargs["stream"] = True
         kwargs["incremental_output"] = True
+    return kwargs
 
+
+def _estimated_tokens(messages: list[dict], enable_thinking: bool, thinking_budget: int, max_tokens: int | None) -> int:
+    """限流用的 token 估算：输入估算 + 输出上限（未指定时用默认值，thinking 另加 thinking_budget）。"""
+    out = max_tokens or config.RATE_LIMIT_DEFAULT_OUTPUT_TOKENS
     if enable_thinking:
-        # 流式：只收集 content，忽略 reasoning_content
-        completion = Generation.call(**kwargs)
-        answer_content = ""
-        for chunk in completion:
-            if chunk.output and chunk.output.choices:
-                msg = chunk.output.choices[0].message
-                if msg and msg.content:
-                    answer_content += msg.content or ""
-        return answer_content.strip()
-
-    resp: GenerationResponse = Generation.call(**kwargs)
+        out += thinking_budget
+    return sum(context_builder.estimate_tokens(m.get("content", "")) for m in messages) + out
+
+
+# ----- 超时、重试与对冲 -----
+def _timeouts(stage: str | None) -> tuple[float | None, float | None]:
+    """该阶段的 (first_token, total) 超时秒数。"""
+    t = config.LLM_TIMEOUTS.get(stage) or {}
+    return t.get("first_token"), t.get("total")
+
+
+def _next_deadline(start: float, first: bool, first_token: float | None, total: float | None) -> tuple[float | None, str]:
+    """下一段输出的截止时刻（None 不限）及超时说明。"""
+    limits = []
+    if total is not None:
+        limits.append((start + total, f"总时长超过 {total} 秒"))
+    if first and first_token is not None:
+        limits.append((start + first_token, f"首段输出超过 {first_token} 秒"))
+    if not limits:
+        return None, ""
+    return min(limits)
+
+
+def _check(resp: GenerationResponse) -> None:
     if resp.status_code != 200:
-        raise RuntimeError(f"API 错误: {resp.code} {resp.message}")
+        raise LLMError(
+            f"API 错误: {resp.code} {resp.message}",
+            status=resp.status_code,
+            retryable=resp.status_code in config.LLM_RETRY_STATUS,
+        )
 
+
+def _response_text(resp: GenerationResponse) -> str:
+    _check(resp)
     output = resp.output
     if not output or not output.choices:
-        raise RuntimeError("API 返回空")
+        raise LLMError("API 返回空")
+    return (output.choices[0].message.content or "").strip()
+
+
+def _retryable(e: BaseException) -> bool:
+    if isinstance(e, LLMError):
+        return e.retryable
+    # requests 的异常与 TimeoutError 都是 OSError；aiohttp 的断连不是
+    return isinstance(e, (OSError, aiohttp.ClientError))
+
+
+def _backoff(attempt: int) -> float:
+    """第 attempt 次（从 0 起）失败后的等待秒数：指数退避 + 全抖动。"""
+    return random.uniform(0, min(config.LLM_RETRY_MAX_DELAY, config.LLM_RETRY_BASE_DELAY * 2 ** attempt))
+
+
+def _may_retry(e: BaseException, attempt: int) -> bool:
+    return attempt + 1 < config.LLM_RETRY_ATTEMPTS and _retryable(e)
+
+
+async def _adeadline_iter(agen: AsyncIterator, first_token: float | None, total: float | None) -> AsyncIterator:
+    """
+    逐个转交 agen 的输出，首段超过 first_token、整体超过 total 秒即抛 LLMTimeout；
+    超时时取消正在等待的读取并关闭 agen（及 SDK 的流）。
+    """
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    first = True
+    try:
+        while True:
+            deadline, reason = _next_deadline(start, first, first_token, total)
+            try:
+                item = await asyncio.wait_for(
+                    agen.__anext__(),
+                    None if deadline is None else max(0.0, deadline - loop.time()),
+                )
+            except StopAsyncIteration:
+                return
+            except asyncio.TimeoutError:
+                raise LLMTimeout(f"API 超时: {reason}") from None
+            first = False
+            yield item
+    finally:
+        await agen.aclose()
+
+
+async def _ahedged(attempt: Callable[[], Awaitable[str]], after: float | None) -> str:
+    """
+    after 秒内 attempt 未返回则并发再发一份，取先成功者；都失败时抛先出现的错误。
+    落后的一份被取消：仍在排队的退出队列，已发出的关闭流并退回未用的限流令牌。
+    """
+    if after is None:
+        return await attempt()
+    tasks = [asyncio.ensure_future(attempt())]
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=after)
+        if not done:
+            tasks.append(asyncio.ensure_future(attempt()))
+        error = None
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for t in done:
+                if t.exception() is None:
+                    return t.result()
+                error = error or t.exception()
+        raise error
+    finally:
+        # 等落后的一份处理完取消，其流与响应在返回前关闭
+        losers = [t for t in tasks if not t.done()]
+        for t in losers:
+            t.cancel()
+        if losers:
+            await asyncio.wait(losers)
+
+
+def _release_unused(rec: metrics.LLMCall, tokens: int) -> None:
+    """被放弃的一次调用退回按估算预扣、实际没有用到的限流 token。"""
+    scheduler.release(rec.model, tokens - sum(rec.tokens().values()))
+
+
+def _cache_key(
+    model: str,
+    messages: list[dict],
+    enable_thinking: bool,
+    thinking_budget: int,
+    max_tokens: int | None,
+    temperature: float | None,
+    top_p: float | None,
+) -> str:
+    return llm_cache.make_key(
+        model=model,
+        messages=messages,
+        thinking_budget=thinking_budget if enable_thinking else None,
+        max_tokens=max_tokens,
+        temperature=temperature,
+        top_p=top_p,
+    )
 
-    text = output.choices[0].message.content or ""
-    return text.strip()
+
+# ----- 异步调用 -----
+# 每个事件循环一个共享的 aiohttp 会话（aiohttp 会话绑定事件循环），由 aclose_session 关闭；
+# 不用 SDK 自建的共享会话，它在事件循环结束时不会被关闭
+_aio_sessions: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, aiohttp.ClientSession]" = weakref.WeakKeyDictionary()
+
+
+def _aio_session() -> aiohttp.ClientSession:
+    loop = asyncio.get_running_loop()
+    session = _aio_sessions.get(loop)
+    if session is None or session.closed:
+        session = aiohttp.ClientSession(trust_env=True)
+        _aio_sessions[loop] = session
+    return session
+
+
+async def aclose_session() -> None:
+    """关闭当前事件循环的共享会话及其连接；应用关闭（lifespan）或 asyncio.run 结束前调用。"""
+    session = _aio_sessions.pop(asyncio.get_running_loop(), None)
+    if session is not None:
+        await session.close()
+
+
+async def _araw_chunks(kwargs: dict) -> AsyncIterator[GenerationResponse]:
+    resp = await AioGeneration.call(**kwargs, session=_aio_session())
+    if kwargs.get("stream"):
+        # 提前关闭（超时、对冲落败被取消）时一并关闭 SDK 的流，释放响应与连接
+        async with aclosing(resp) as chunks:
+            async for chunk in chunks:
+                yield chunk
+    else:
+        yield resp
+
+
+async def _astream_once(kwargs: dict, stage: str | None, tokens: int) -> AsyncIterator[str]:
+    """
+    一次流式调用（不排队、不重试），逐段产出 content 增量（忽略 reasoning_content）。
+    tokens 为排队时预扣的估算量，超时、被取消（对冲落败）或提前关闭时退回未用的部分。
+    """
+    first_token, total = _timeouts(stage)
+    rec = metrics.LLMCall(kwargs["model"], stage)
+    try:
+        async with aclosing(_adeadline_iter(_araw_chunks(kwargs), first_token, total)) as chunks:
+            async for chunk in chunks:
+                rec.chunk(chunk)
+                _check(chunk)
+                if chunk.output and chunk.output.choices:
+                    msg = chunk.output.choices[0].message
+                    if msg and msg.content:
+                        yield msg.content
+    except (asyncio.CancelledError, GeneratorExit):
+        _release_unused(rec, tokens)
+        raise
+    except Exception as e:
+        rec.error = e
+        if isinstance(e, LLMTimeout):
+            _release_unused(rec, tokens)
+        raise
+    finally:
+        rec.finish()
+
+
+async def _astream(
+    model: str,
+    messages: list[dict],
+    enable_thinking: bool = False,
+    thinking_budget: int = 8000,
+    max_tokens: int | None = None,
+    temperature: float | None = None,
+    top_p: float | None = None,
+    priority: int = INTERACTIVE,
+    stage: str | None = None,
+) -> AsyncIterator[str]:
+    """
+    流式调用千问 API，逐段产出 content 增量（忽略 reasoning_content）。
+    每次尝试前经 scheduler 按 priority 排队限流；尚未产出内容时遇到可重试错误按退避重试。
+    """
+    kwargs = _build_kwargs(
+        model, messages,
+        enable_thinking=enable_thinking,
+        thinking_budget=thinking_budget,
+        max_tokens=max_tokens,
+        temperature=temperature,
+        top_p=top_p,
+        stream=True,
+        request_timeout=_timeouts(stage)[1],
+    )
+    tokens = _estimated_tokens(messages, enable_thinking, thinking_budget, max_tokens)
+    for attempt in itertools.count():
+        await scheduler.acquire(model, tokens, priority)
+        started = False
+        gen = _astream_once(kwargs, stage, tokens)
+        try:
+            async for delta in gen:
+                started = True
+                yield delta
+            return
+        except Exception as e:
+            if started or not _may_retry(e, attempt):
+                raise
+        finally:
+            # 调用方提前关闭（如正文按字数截断）时立即关闭本次的流并退回未用的令牌，不留给垃圾回收
+            await gen.aclose()
+        await asyncio.sleep(_backoff(attempt))
+
+
+async def _acall_once(kwargs: dict, tokens: int, priority: int, stage: str | None) -> str:
+    """一次完整调用：先排队限流，enable_thinking 时必须用流式，且只返回最终 content。"""
+    await scheduler.acquire(kwargs["model"], tokens, priority)
+    if kwargs.get("stream"):
+        return "".join([delta async for delta in _astream_once(kwargs, stage, tokens)]).strip()
+    rec = metrics.LLMCall(kwargs["model"], stage)
+    try:
+        # 非流式的响应一次到达：first_token 即限制整个响应
+        async with aclosing(_adeadline_iter(_araw_chunks(kwargs), *_timeouts(stage))) as chunks:
+            async for resp in chunks:
+                rec.chunk(resp)
+                return _response_text(resp)
+        raise LLMError("API 返回空")
+    except asyncio.CancelledError:
+        _release_unused(rec, tokens)
+        raise
+    except Exception as e:
+        rec.error = e
+        if isinstance(e, LLMTimeout):
+            _release_unused(rec, tokens)
+        raise
+    finally:
+        rec.finish()
+
+
+async def _acall(
+    model: str,
+    messages: list[dict],
+    enable_thinking: bool = False,
+    thinking_budget: int = 8000,
+    max_tokens: int | None = None,
+    temperature: float | None = None,
+    top_p: float | None = None,
+    cache: bool = False,
+    priority: int = INTERACTIVE,
+    stage: str | None = None,
+) -> str:
+    """
+    调用千问 API。cache=True 时先查本地响应缓存（见 llm_cache），未命中再调用并写入。
+    每次尝试前经 scheduler 按 priority 排队限流；stage 决定超时（config.LLM_TIMEOUTS）与对冲（config.LLM_HEDGE_AFTER），
+    可重试的错误按指数退避重试。
+    """
+    key = _cache_key(model, messages, enable_thinking, thinking_budget, max_tokens, temperature, top_p) if cache else None
+    if key:
+        text = llm_cache.get(key)
+        if text is not None:
+            return text
+    kwargs = _build_kwargs(
+        model, messages,
+        enable_thinking=enable_thinking,
+        thinking_budget=thinking_budget,
+        max_tokens=max_tokens,
+        temperature=temperature,
+        top_p=top_p,
+        request_timeout=_timeouts(stage)[1],
+    )
+    tokens = _estimated_tokens(messages, enable_thinking, thinking_budget, max_tokens)
+    hedge_after = config.LLM_HEDGE_AFTER.get(stage)
+    for attempt in itertools.count():
+        try:
+            text = await _ahedged(lambda: _acall_once(kwargs, tokens, priority, stage), hedge_after)
+            break
+        except Exception as e:
+            if not _may_retry(e, attempt):
+                raise
+        await asyncio.sleep(_backoff(attempt))
+    if key:
+        llm_cache.put(key, text)
+    return text
+
+
+def _with_project_context(system: str, project_context: str) -> str:
+    """
+    把项目设定拼进 system：提示词开头（system 说明 + 项目设定）对同一项目逐字节不变，
+    便于服务端上下文缓存命中；随章节变化的内容都放在其后的 user 消息里。
+    """
+    if not project_context:
+        return system
+    return f"{system}\n\n---\n{project_context}"
 
 
-def generate_chapter_direction(
+def _direction_request(
     rag_context: str,
     user_direction: str,
     volume_idx: int,
     chapter_idx: int,
     temperature: float | None = None,
     top_p: float | None = None,
-) -> str:
+    project_context: str = "",
+) -> dict:
     """
-    使用 qwen-max + thinking 生成本章具体走向。
-    输入：RAG 上下文 + 用户指定剧情走向。
-    输出：本章具体走向（纯文本）。
+    本章走向规划的调用参数（qwen-max + thinking）。
+    project_context 为项目设定等不随章节变化的材料，放在 system 中形成稳定前缀；rag_context 为其余上下文。
     """
     system = """你是一名专业的小说策划。根据世界设定、背景设定、人物设定、已有大纲和已写内容的摘要，以及用户指定的剧情走向，输出【本章的具体走向】。
 
@@ -91,29 +430,49 @@ def generate_chapter_direction(
 ---
 请输出：第{volume_idx + 1}卷 第{chapter_idx + 1}章 的具体走向。只输出走向内容，不要其他说明。"""
 
-    return _call(
+    return dict(
         model=config.MODEL_PLANNING,
         messages=[
-            {"role": "system", "content": system},
+            {"role": "system", "content": _with_project_context(system, project_context)},
             {"role": "user", "content": user},
         ],
         enable_thinking=config.MODEL_PLANNING_THINKING,
         temperature=temperature,
         top_p=top_p,
+        stage="direction",
     )
 
 
-def generate_chapter_content(
+async def agenerate_chapter_direction(
     rag_context: str,
-    direction: str,
+    user_direction: str,
     volume_idx: int,
     chapter_idx: int,
     temperature: float | None = None,
     top_p: float | None = None,
+    project_context: str = "",
 ) -> str:
     """
-    使用 qwen-plus 根据本章走向生成格式化小说正文。
-    篇幅要求：config.CHAPTER_MIN_CHARS ~ CHAPTER_MAX_CHARS 字。
+    使用 qwen-max + thinking 生成本章具体走向。
+    输入：RAG 上下文 + 用户指定剧情走向。
+    输出：本章具体走向（纯文本）。
+    """
+    return await _acall(**_direction_request(rag_context, user_direction, volume_idx, chapter_idx, temperature, top_p, project_context))
+
+
+def _content_request(
+    rag_context: str,
+    direction: str,
+    volume_idx: int,
+    chapter_idx: int,
+    temperature: float | None = None,
+    top_p: float | None = None,
+    project_context: str = "",
+    written: str = "",
+) -> dict:
+    """
+    正文生成的调用参数（qwen-plus）。篇幅要求：config.CHAPTER_MIN_CHARS ~ CHAPTER_MAX_CHARS 字。
+    written 非空时为续写请求：以已写正文的结尾为引子，只要求补足剩余篇幅；system 不变，提示词前缀仍可命中缓存。
     """
     min_c, max_c = config.CHAPTER_MIN_CHARS, config.CHAPTER_MAX_CHARS
     system = f"""你是一名专业的小说作家。根据设定、大纲、已有内容摘要和本章具体走向，写出本章的完整小说正文。
@@ -125,7 +484,22 @@ def generate_chapter_content(
 - 多分段，单段不宜过长：避免大段连贯叙述，适当换行，每段以 1–3 句为宜，对话可单独成段
 - 与设定和前后文风格一致，人物性格、口吻符合人物设定"""
 
-    user = f"""{rag_context}
+    if written:
+        n = len(written)
+        user = f"""{rag_context}
+
+---
+【本章具体走向】
+{direction}
+
+---
+【本章已写正文的结尾】
+……{written[-config.CHAPTER_CONTINUATION_TAIL_CHARS:]}
+
+---
+第{volume_idx + 1}卷 第{chapter_idx + 1}章目前已写约 {n} 字，不足 {min_c} 字。请紧接上文结尾继续写，再写 {max(min_c - n, 0)}–{max_c - n} 字，按本章走向推进并收束剧情，不要重复已写内容、不要重新开头。只输出续写的正文。"""
+    else:
+        user = f"""{rag_context}
 
 ---
 【本章具体走向】
@@ -134,24 +508,163 @@ def generate_chapter_content(
 ---
 请写出第{volume_idx + 1}卷 第{chapter_idx + 1}章的完整正文。篇幅须在 {min_c}–{max_c} 字之间。只输出正文内容。"""
 
-    return _call(
+    return dict(
         model=config.MODEL_CONTENT,
         messages=[
-            {"role": "system", "content": system},
+            {"role": "system", "content": _with_project_context(system, project_context)},
             {"role": "user", "content": user},
         ],
-        enable_thinking=False,
         max_tokens=config.CHAPTER_MAX_TOKENS,
         temperature=temperature,
         top_p=top_p,
+        stage="content",
+    )
+
+
+_SENTENCE_ENDS = "。！？…」』”"
+
+
+class _LengthCutoff:
+    """
+    按字数截断流式正文：累计超过 max_chars 后在下一个段落边界（换行）处结束；
+    超过 max_chars + CHAPTER_CUTOFF_SLACK_CHARS 仍无换行时在其后的第一个句末处结束。
+    """
+
+    def __init__(self, max_chars: int):
+        self.max_chars = max_chars
+        self.hard_max = max_chars + config.CHAPTER_CUTOFF_SLACK_CHARS
+        self.n = 0
+        self.done = False
+
+    def feed(self, delta: str) -> str:
+        """返回 delta 中应当输出的部分；到达截断点后 done 为 True，调用方应停止读取。"""
+        start = max(0, self.max_chars - self.n)
+        if start >= len(delta):
+            self.n += len(delta)
+            return delta
+        i = delta.find("\n", start)
+        if i < 0 and self.n + len(delta) > self.hard_max:
+            hard = max(start, self.hard_max - self.n)
+            ends = [j for j in (delta.find(c, hard) for c in _SENTENCE_ENDS) if j >= 0]
+            i = min(ends) + 1 if ends else -1
+        if i < 0:
+            self.n += len(delta)
+            return delta
+        self.done = True
+        self.n += i
+        return delta[:i]
+
+
+async def _alength_controlled(stream: Callable[[dict], AsyncIterator[str]], request: dict) -> AsyncIterator[str]:
+    """
+    正文长度控制：边流式输出边计字数，超过 CHAPTER_MAX_CHARS 后在段落边界处停止（关闭连接，不再消耗输出 token）；
+    结束时不足 CHAPTER_MIN_CHARS 则以已写正文的结尾为引子发续写请求（最多 CHAPTER_MAX_CONTINUATIONS 次），不整章重写。
+    request 为 _content_request 的参数。
+    """
+    cut = _LengthCutoff(config.CHAPTER_MAX_CHARS)
+    written = ""
+    for n in range(config.CHAPTER_MAX_CONTINUATIONS + 1):
+        sep = "\n" if n and not written.endswith("\n") else ""
+        async with aclosing(stream(_content_request(**request, written=written))) as deltas:
+            async for delta in deltas:
+                if sep:
+                    delta, sep = sep + delta.lstrip("\n"), ""
+                out = cut.feed(delta)
+                written += out
+                if out:
+                    yield out
+                if cut.done:
+                    return
+        if len(written.strip()) >= config.CHAPTER_MIN_CHARS:
+            return
+
+
+def _content_args(rag_context, direction, volume_idx, chapter_idx, temperature, top_p, project_context) -> dict:
+    return dict(
+        rag_context=rag_context,
+        direction=direction,
+        volume_idx=volume_idx,
+        chapter_idx=chapter_idx,
+        temperature=temperature,
+        top_p=top_p,
+        project_context=project_context,
     )
 
 
-def summarize_chapter(content: str, direction: str, temperature: float | None = None, top_p: float | None = None) -> str:
+async def agenerate_chapter_content(
+    rag_context: str,
+    direction: str,
+    volume_idx: int,
+    chapter_idx: int,
+    temperature: float | None = None,
+    top_p: float | None = None,
+    project_context: str = "",
+) -> str:
     """
-    使用 qwen-max + thinking 对章节正文做摘要。
-    只对章节摘要，输出简洁的摘要文本。
+    使用 qwen-plus 根据本章走向生成格式化小说正文。
+    篇幅要求：config.CHAPTER_MIN_CHARS ~ CHAPTER_MAX_CHARS 字；CHAPTER_LENGTH_CONTROL 时按实际字数截断或续写。
     """
+    args = _content_args(rag_context, direction, volume_idx, chapter_idx, temperature, top_p, project_context)
+    if config.CHAPTER_LENGTH_CONTROL:
+        return "".join([delta async for delta in _alength_controlled(lambda r: _astream(**r), args)]).strip()
+    return await _acall(**_content_request(**args))
+
+
+def agenerate_chapter_content_stream(
+    rag_context: str,
+    direction: str,
+    volume_idx: int,
+    chapter_idx: int,
+    temperature: float | None = None,
+    top_p: float | None = None,
+    project_context: str = "",
+) -> AsyncIterator[str]:
+    """与 agenerate_chapter_content 相同，但逐段产出正文增量，供 SSE 推送。"""
+    args = _content_args(rag_context, direction, volume_idx, chapter_idx, temperature, top_p, project_context)
+    if config.CHAPTER_LENGTH_CONTROL:
+        return _alength_controlled(lambda r: _astream(**r), args)
+    return _astream(**_content_request(**args))
+
+
+def _split_paragraphs(text: str, max_chars: int) -> list[str]:
+    """按段落边界把 text 切成不超过 max_chars 字的块（单段超长时硬切）。"""
+    chunks, cur = [], ""
+    for para in text.split("\n"):
+        while len(para) > max_chars:
+            if cur:
+                chunks.append(cur)
+                cur = ""
+            chunks.append(para[:max_chars])
+            para = para[max_chars:]
+        if cur and len(cur) + 1 + len(para) > max_chars:
+            chunks.append(cur)
+            cur = ""
+        cur = f"{cur}\n{para}" if cur else para
+    if cur.strip():
+        chunks.append(cur)
+    return [c for c in chunks if c.strip()]
+
+
+def _summary_request(system: str, user: str, thinking_budget: int, temperature: float | None, top_p: float | None) -> dict:
+    """摘要类调用的公共参数（qwen-max + thinking，可缓存，后台优先级）。"""
+    return dict(
+        model=config.MODEL_PLANNING,
+        messages=[
+            {"role": "system", "content": system},
+            {"role": "user", "content": user},
+        ],
+        enable_thinking=config.MODEL_PLANNING_THINKING,
+        thinking_budget=thinking_budget,
+        temperature=temperature,
+        top_p=top_p,
+        cache=True,
+        priority=BACKGROUND,
+        stage="summary",
+    )
+
+
+def _chapter_summary_request(content: str, direction: str, temperature: float | None = None, top_p: float | None = None) -> dict:
+    """章摘要的调用参数（qwen-max + thinking）。content 不超过 config.SUMMARY_CHUNK_CHARS 时直接用这一请求。"""
     system = """你是摘要专家。将给定的小说章节正文压缩成一段简洁的摘要，用于后续 RAG 检索和保持剧情连贯。
 
 要求：
@@ -164,32 +677,108 @@ def summarize_chapter(content: str, direction: str, temperature: float | None =
 {direction[:500]}
 
 【正文】
-{content[:8000]}
+{content}
 
 ---
 请输出本章摘要（100-300字）。只输出摘要内容。"""
 
-    return _call(
-        model=config.MODEL_PLANNING,
-        messages=[
-            {"role": "system", "content": system},
-            {"role": "user", "content": user},
-        ],
-        enable_thinking=config.MODEL_PLANNING_THINKING,
-        thinking_budget=4000,
-        temperature=temperature,
-        top_p=top_p,
-    )
+    return _summary_request(system, user, 4000, temperature, top_p)
+
+
+def _chapter_part_request(
+    part: str,
+    direction: str,
+    part_idx: int,
+    n_parts: int,
+    temperature: float | None = None,
+    top_p: float | None = None,
+) -> dict:
+    """长章节 map 阶段：单个正文片段的摘要请求。"""
+    system = """你是摘要专家。给定的是一章小说正文中按顺序切出的一个片段，请概括这一片段，之后会与其余片段的摘要合并成章摘要。
+
+要求：
+- 篇幅 80–200 字
+- 按时间或因果顺序概括，保留关键情节、人物行为、重要对话或决断
+- 片段结尾处的悬念、转折与未解决的冲突务必保留
+- 只输出摘要正文，不要加标题或说明"""
+
+    user = f"""【本章走向参考】
+{direction[:500]}
+
+【正文片段 {part_idx + 1}/{n_parts}】
+{part}
+
+---
+请输出该片段的摘要（80-200字）。只输出摘要内容。"""
+
+    return _summary_request(system, user, 2000, temperature, top_p)
+
+
+def _chapter_reduce_request(part_summaries: list[str], direction: str, temperature: float | None = None, top_p: float | None = None) -> dict:
+    """长章节 reduce 阶段：把按顺序排列的片段摘要合并成章摘要。"""
+    system = """你是摘要专家。给定的是一章小说按顺序各片段的摘要，请合并成该章的一段完整摘要，用于后续 RAG 检索和保持剧情连贯。
+
+要求：
+- 篇幅 100–300 字
+- 按时间或因果顺序概括，保留关键情节、人物行为、重要对话或决断
+- 包含人物关系变化、场景转换、情绪转折等对后续剧情有影响的信息
+- 章末的悬念与转折务必保留
+- 只输出摘要正文，不要加标题或说明"""
+
+    combined = "\n\n".join(f"片段{i + 1}：{s}" for i, s in enumerate(part_summaries))
+    user = f"""【本章走向参考】
+{direction[:500]}
+
+【各片段摘要】
+{combined}
+
+---
+请输出本章摘要（100-300字）。只输出摘要内容。"""
 
+    return _summary_request(system, user, 4000, temperature, top_p)
 
-def summarize_volume(chapter_summaries: list[str], temperature: float | None = None, top_p: float | None = None) -> str:
+
+async def _agather_calls(requests: list[dict]) -> list[str]:
+    """并发执行多个调用（最多 config.SUMMARY_PARALLELISM 个同时进行），按原顺序返回结果。"""
+    sem = asyncio.Semaphore(config.SUMMARY_PARALLELISM)
+
+    async def one(r: dict) -> str:
+        async with sem:
+            return await _acall(**r)
+
+    return list(await asyncio.gather(*(one(r) for r in requests)))
+
+
+def _chapter_part_requests(content: str, direction: str, temperature: float | None, top_p: float | None) -> list[dict]:
+    parts = _split_paragraphs(content, config.SUMMARY_CHUNK_CHARS)
+    return [_chapter_part_request(p, direction, i, len(parts), temperature, top_p) for i, p in enumerate(parts)]
+
+
+async def asummarize_chapter(content: str, direction: str, temperature: float | None = None, top_p: float | None = None) -> str:
     """
-    使用 qwen-max + thinking 将多章摘要压缩成卷摘要。
-    对过于早期的卷，把章摘要压成卷摘要。
+    使用 qwen-max + thinking 对章节正文做摘要。
+    只对章节摘要，输出简洁的摘要文本。正文超过 config.SUMMARY_CHUNK_CHARS 时按段落切块，
+    各块并发摘要（map）后合并（reduce），覆盖整章而不截断结尾。
     """
-    if not chapter_summaries:
-        return ""
-    system = """你是摘要专家。将多章摘要压缩成该卷的一段卷摘要，用于 RAG 检索。
+    if len(content) <= config.SUMMARY_CHUNK_CHARS:
+        return await _acall(**_chapter_summary_request(content, direction, temperature, top_p))
+    parts = await _agather_calls(_chapter_part_requests(content, direction, temperature, top_p))
+    return await _acall(**_chapter_reduce_request(parts, direction, temperature, top_p))
+
+
+def _volume_summary_request(
+    chapter_summaries: list[str],
+    temperature: float | None = None,
+    top_p: float | None = None,
+    first_chapter: int = 1,
+    partial: bool = False,
+) -> dict:
+    """
+    卷摘要的调用参数（qwen-max + thinking）。章号从 first_chapter 起；
+    partial=True 时为 map 阶段，只概括卷中连续的一段章节。
+    """
+    scope = "该卷中连续的一段章节" if partial else "该卷"
+    system = f"""你是摘要专家。将多章摘要压缩成{scope}的一段卷摘要，用于 RAG 检索。
 
 要求：
 - 篇幅 200–500 字
@@ -198,21 +787,185 @@ def summarize_volume(chapter_summaries: list[str], temperature: float | None = N
 - 若与前/后卷有承启关系，可简要提及
 - 只输出摘要正文，不要加标题或说明"""
 
-    combined = "\n\n".join(f"第{i+1}章：{s}" for i, s in enumerate(chapter_summaries))
+    combined = "\n\n".join(f"第{first_chapter + i}章：{s}" for i, s in enumerate(chapter_summaries))
     user = f"""【各章摘要】
-{combined[:6000]}
+{combined}
+
+---
+请输出{scope}的摘要（200-500字）。只输出摘要内容。"""
+
+    return _summary_request(system, user, 4000, temperature, top_p)
+
+
+def _volume_reduce_request(part_summaries: list[tuple[int, int, str]], temperature: float | None = None, top_p: float | None = None) -> dict:
+    """卷摘要 reduce 阶段：part_summaries 为 (起始章号, 结束章号, 该段摘要)，按顺序合并成卷摘要。"""
+    system = """你是摘要专家。给定的是一卷小说按章节顺序分段概括的摘要，请合并成该卷的一段卷摘要，用于 RAG 检索。
+
+要求：
+- 篇幅 200–500 字
+- 突出本卷主线与重要支线，保留核心情节线、人物弧光、重要转折点
+- 概括人物关系变化、主要冲突与解决、伏笔收放（如有）
+- 卷末的悬念与转折务必保留
+- 只输出摘要正文，不要加标题或说明"""
+
+    combined = "\n\n".join(f"第{a}–{b}章：{s}" for a, b, s in part_summaries)
+    user = f"""【各段摘要】
+{combined}
 
 ---
 请输出该卷的卷摘要（200-500字）。只输出摘要内容。"""
 
-    return _call(
-        model=config.MODEL_PLANNING,
-        messages=[
-            {"role": "system", "content": system},
-            {"role": "user", "content": user},
-        ],
-        enable_thinking=config.MODEL_PLANNING_THINKING,
-        thinking_budget=4000,
-        temperature=temperature,
-        top_p=top_p,
-    )
+    return _summary_request(system, user, 4000, temperature, top_p)
+
+
+def _volume_groups(chapter_summaries: list[str]) -> list[tuple[int, list[str]]]:
+    """把章摘要按顺序分组，每组合计不超过 config.SUMMARY_CHUNK_CHARS 字；返回 (起始章号, 该组章摘要)。"""
+    groups: list[tuple[int, list[str]]] = []
+    size = 0
+    for i, s in enumerate(chapter_summaries):
+        if not groups or size + len(s) > config.SUMMARY_CHUNK_CHARS:
+            groups.append((i + 1, []))
+            size = 0
+        groups[-1][1].append(s)
+        size += len(s) + 8
+    return groups
+
+
+def _volume_part_requests(groups: list[tuple[int, list[str]]], temperature: float | None, top_p: float | None) -> list[dict]:
+    return [_volume_summary_request(g, temperature, top_p, first_chapter=start, partial=True) for start, g in groups]
+
+
+def _volume_parts(groups: list[tuple[int, list[str]]], summaries: list[str]) -> list[tuple[int, int, str]]:
+    return [(start, start + len(g) - 1, s) for (start, g), s in zip(groups, summaries)]
+
+
+async def asummarize_volume(chapter_summaries: list[str], temperature: float | None = None, top_p: float | None = None) -> str:
+    """
+    使用 qwen-max + thinking 将多章摘要压缩成卷摘要。
+    对过于早期的卷，把章摘要压成卷摘要。章摘要合计超过 config.SUMMARY_CHUNK_CHARS 时分组并发摘要后合并。
+    """
+    if not chapter_summaries:
+        return ""
+    groups = _volume_groups(chapter_summaries)
+    if len(groups) == 1:
+        return await _acall(**_volume_summary_request(chapter_summaries, temperature, top_p))
+    parts = await _agather_calls(_volume_part_requests(groups, temperature, top_p))
+    return await _acall(**_volume_reduce_request(_volume_parts(groups, parts), temperature, top_p))
+
+
+def _merge_request(
+    items: list[tuple[str, str]],
+    scope: str,
+    base: str = "",
+    temperature: float | None = None,
+    top_p: float | None = None,
+) -> dict:
+    """
+    卷以上层级（篇章摘要、全书梗概）的调用参数：把按顺序排列的下级摘要 items（(标签, 摘要)）合并成 scope 的一段摘要；
+    base 非空时为增量更新，只把 items 并入已有摘要。
+    """
+    system = f"""你是摘要专家。将按时间顺序排列的各部分摘要合并成{scope}的一段摘要，用于长篇小说后续创作时回顾前情。
+
+要求：
+- 篇幅 300–600 字
+- 只保留对后续剧情仍有影响的主线、人物弧光、关键转折与未回收的伏笔，细节从简
+- 按时间顺序叙述，结尾处的局势与悬念务必保留
+- 只输出摘要正文，不要加标题或说明"""
+
+    combined = "\n\n".join(f"{label}：{s}" for label, s in items)
+    if base:
+        body = f"【已有摘要】\n{base}\n\n【需并入的后续部分】\n{combined}"
+    else:
+        body = f"【各部分摘要】\n{combined}"
+    user = f"""{body}
+
+---
+请输出{scope}的摘要（300-600字）。只输出摘要内容。"""
+
+    return _summary_request(system, user, 4000, temperature, top_p)
+
+
+def _merge_groups(items: list[tuple[str, str]]) -> list[list[tuple[str, str]]]:
+    """按顺序分组，每组合计不超过 config.SUMMARY_CHUNK_CHARS 字。"""
+    groups: list[list[tuple[str, str]]] = []
+    size = 0
+    for label, s in items:
+        if not groups or size + len(s) > config.SUMMARY_CHUNK_CHARS:
+            groups.append([])
+            size = 0
+        groups[-1].append((label, s))
+        size += len(label) + len(s)
+    return groups
+
+
+def _merge_part_requests(groups: list[list[tuple[str, str]]], temperature: float | None, top_p: float | None) -> list[dict]:
+    return [_merge_request(g, f"{g[0][0]}至{g[-1][0]}", temperature=temperature, top_p=top_p) for g in groups]
+
+
+def _merge_parts(groups: list[list[tuple[str, str]]], summaries: list[str]) -> list[tuple[str, str]]:
+    return [(f"{g[0][0]}至{g[-1][0]}", s) for g, s in zip(groups, summaries)]
+
+
+async def amerge_summaries(
+    items: list[tuple[str, str]],
+    scope: str,
+    base: str = "",
+    temperature: float | None = None,
+    top_p: float | None = None,
+) -> str:
+    """
+    使用 qwen-max + thinking 把下级摘要合并成上级摘要（见 _merge_request）。
+    从头合并且合计超过 config.SUMMARY_CHUNK_CHARS 时，分组并发合并后再合并一次。
+    """
+    if not items:
+        return base
+    groups = _merge_groups(items)
+    if len(groups) > 1 and not base:
+        items = _merge_parts(groups, await _agather_calls(_merge_part_requests(groups, temperature, top_p)))
+    return await _acall(**_merge_request(items, scope, base, temperature, top_p))
+
+
+def _volume_fold_request(
+    volume_summary: str,
+    new_summaries: list[tuple[int, str]],
+    revised_summaries: list[tuple[int, str]],
+    temperature: float | None = None,
+    top_p: float | None = None,
+) -> dict:
+    """增量卷摘要的调用参数：只把新增/改动的章摘要并入已有卷摘要。章号从 1 开始。"""
+    system = """你是摘要专家。在已有的卷摘要基础上，并入新增章节的摘要、修正已改动章节的内容，输出更新后的卷摘要，用于 RAG 检索。
+
+要求：
+- 篇幅 200–500 字
+- 保留原卷摘要中仍然成立的主线、支线、人物弧光与重要转折点
+- 新增章节的情节按时间顺序并入；已改动章节以新的章摘要为准，替换原卷摘要中与之矛盾的描述
+- 概括人物关系变化、主要冲突与解决、伏笔收放（如有）
+- 只输出摘要正文，不要加标题或说明"""
+
+    parts = [f"【已有卷摘要】\n{volume_summary}"]
+    if revised_summaries:
+        parts.append("【已改动章节的新摘要】\n" + "\n\n".join(f"第{n}章：{s}" for n, s in revised_summaries))
+    if new_summaries:
+        parts.append("【新增章节摘要】\n" + "\n\n".join(f"第{n}章：{s}" for n, s in new_summaries))
+    user = "\n\n".join(parts) + """
+
+---
+请输出更新后的卷摘要（200-500字）。只输出摘要内容。"""
+
+    return _summary_request(system, user, 4000, temperature, top_p)
+
+
+async def afold_volume_summary(
+    volume_summary: str,
+    new_summaries: list[tuple[int, str]],
+    revised_summaries: list[tuple[int, str]],
+    temperature: float | None = None,
+    top_p: float | None = None,
+) -> str:
+    """
+    使用 qwen-max + thinking 增量更新卷摘要：输入已有卷摘要与 (章号, 章摘要) 列表，
+    只处理新增/改动的章节，避免每章都重新压缩整卷。
+    """
+    if not new_summaries and not revised_summaries:
+        return volume_summary
+    return await _acall(**_volume_fold_request(volume_summary, new_summaries, revised_summaries, temperature, top_p))
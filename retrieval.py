@@ -0,0 +1,697 @@
+"""本地检索：章节摘要、走向与正文片段上的 BM25 索引（中文按字二元组切分，无需联网、无需分词库）。
+
+每章一个分片（该章各片段的文本与位置），经由存储后端持久化于 retrieval/{chapter_id}。
+倒排表持久化为若干段：retrieval/segments 记录各段所含章节的签名、片段编号与各片段的类别、长度，
+段的倒排项按词的哈希分桶存于 retrieval/postings/{槽}/{桶}，查询某词时每段只读取其所在的一个桶，冷启动不必载入全书。
+章节写入、正文修改、摘要更新时重建该章分片，未写入任何段的章节在内存中建增量倒排；
+增量达到 RETRIEVAL_MERGE_MIN 章与全书 RETRIEVAL_MERGE_RATIO 中的较大者时，由写入方（持有项目锁）写成新段，
+并与末尾规模相近的段合并（段数随全书规模按对数增长，每章只被重写对数次）。
+新段写入未被使用的槽，写完后才替换段列表；读到已被重用的槽时重新载入段列表。
+"""
+import hashlib
+import json
+import math
+import re
+import struct
+import sys
+import threading
+import zlib
+from array import array
+from collections import OrderedDict
+from typing import Any, Callable, Optional
+
+import config
+
+_K1 = 1.5
+_B = 0.75
+# 分片 / 段格式版本：格式变化时旧分片的签名不再匹配、旧段不再使用，检索时自动重建
+_SHARD_VERSION = "3"
+_SEGMENT_VERSION = "1"
+# 每段的桶数按其倒排项数取，每桶约 _BUCKET_POSTINGS 项
+_BUCKET_POSTINGS = 4096
+_MAX_BUCKETS = 256
+_SEGMENTS_PATH = "retrieval/segments"
+_KINDS = ("summary", "direction", "content")
+_CJK = re.compile(r"[㐀-鿿豈-﫿]+")
+_WORD = re.compile(r"[A-Za-z0-9]+")
+
+
+def tokenize(text: str) -> list[str]:
+    """中文连续段切成字二元组（单字段保留单字），英文/数字按词小写。"""
+    terms = []
+    for run in _CJK.findall(text):
+        if len(run) == 1:
+            terms.append(run)
+        else:
+            terms.extend(run[i:i + 2] for i in range(len(run) - 1))
+    terms.extend(w.lower() for w in _WORD.findall(text))
+    return terms
+
+
+def chunk_spans(content: str, size: int, overlap: int = 0) -> list[tuple[int, int]]:
+    """
+    按段落把正文合并成不超过 size 字的片段（超长段落按 size 硬切，相邻两片重叠 overlap 字），
+    返回各片段在正文中的 [start, end)；片段不含首尾空白，段落间的换行保留在片段内。
+    """
+    spans = []
+    cur: Optional[tuple[int, int]] = None
+    pos = 0
+    for line in content.split("\n"):
+        start, pos = pos, pos + len(line) + 1
+        stripped = line.strip()
+        if not stripped:
+            continue
+        s = start + len(line) - len(line.lstrip())
+        e = s + len(stripped)
+        while e - s > size:
+            if cur:
+                spans.append(cur)
+                cur = None
+            spans.append((s, s + size))
+            s += size - overlap
+        if cur and e - cur[0] > size:
+            spans.append(cur)
+            cur = None
+        cur = (cur[0], e) if cur else (s, e)
+    if cur:
+        spans.append(cur)
+    return spans
+
+
+def bm25(tf: int, idf: float, length: int, avg_len: float) -> float:
+    """一个词在一个片段中的 BM25 得分。"""
+    return idf * tf * (_K1 + 1) / (tf + _K1 * (1 - _B + _B * length / avg_len))
+
+
+def idf(n_docs: int, df: int) -> float:
+    return math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+
+
+def chapter_signature(chapter: dict) -> str:
+    """章节可检索内容的签名：摘要、走向、正文哈希任一变化即需重建分片。"""
+    key = "\0".join([_SHARD_VERSION, chapter.get("summary", ""), chapter.get("direction", ""), chapter.get("content_hash", "")])
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+def _passage(kind: str, text: str, start: int = 0, overlap: int = 0) -> dict:
+    return {"kind": kind, "text": text, "start": start, "overlap": overlap}
+
+
+def _meta_passages(chapter: dict) -> list[dict]:
+    return [_passage(kind, chapter[kind]) for kind in ("summary", "direction") if chapter.get(kind)]
+
+
+def _build_shard(chapter: dict, content: str, content_passages: Optional[list[dict]] = None) -> dict:
+    if content_passages is None:
+        content_passages, end = [], 0
+        for s, e in chunk_spans(content, config.RETRIEVAL_PASSAGE_CHARS, config.RETRIEVAL_PASSAGE_OVERLAP):
+            content_passages.append(_passage("content", content[s:e], s, max(0, end - s)))
+            end = e
+    return {
+        "version": _SHARD_VERSION,
+        "sig": chapter_signature(chapter),
+        "content_hash": chapter.get("content_hash", ""),
+        "passages": _meta_passages(chapter) + content_passages,
+    }
+
+
+def _tf(text: str) -> dict[str, int]:
+    tf: dict[str, int] = {}
+    for t in tokenize(text):
+        tf[t] = tf.get(t, 0) + 1
+    return tf
+
+
+def _shard_path(chapter_id: str) -> str:
+    return f"retrieval/{chapter_id}"
+
+
+def _postings_path(slot: int, bucket: int) -> str:
+    return f"retrieval/postings/{slot}/{bucket:02x}"
+
+
+def _read(backend: Any, project_id: str, path: str) -> Optional[Any]:
+    raw = backend.read_bytes(project_id, path)
+    if raw is None:
+        return None
+    try:
+        return json.loads(zlib.decompress(raw))
+    except (zlib.error, ValueError):
+        return None
+
+
+def _write(backend: Any, project_id: str, path: str, obj: Any) -> None:
+    data = json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    backend.write_bytes(project_id, path, zlib.compress(data, 6))
+
+
+def _encode_bucket(seg_id: int, postings: dict[str, list[bytes]]) -> bytes:
+    """桶的存储格式（zlib 压缩）：4 字节头长度 + JSON 头 {seg, terms, ends} + 各词倒排项依次拼接的 uint32 小端数组。"""
+    terms = sorted(postings)
+    pieces, ends, end = [], [], 0
+    for t in terms:
+        for piece in postings[t]:
+            pieces.append(piece)
+            end += len(piece) // 4
+        ends.append(end)
+    flat = b"".join(pieces)
+    if sys.byteorder == "big":
+        swapped = array("I")
+        swapped.frombytes(flat)
+        swapped.byteswap()
+        flat = swapped.tobytes()
+    head = json.dumps({"seg": seg_id, "terms": terms, "ends": ends}, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return zlib.compress(struct.pack("<I", len(head)) + head + flat, 1)
+
+
+def _decode_bucket(raw: Optional[bytes]) -> Optional[tuple[int, dict[str, tuple[int, int]], array]]:
+    """(段 id, 词 → 在数组中的 [起, 止), 数组)；缺失或损坏时返回 None。"""
+    if not raw:
+        return None
+    try:
+        data = zlib.decompress(raw)
+        (n,) = struct.unpack_from("<I", data)
+        head = json.loads(data[4:4 + n])
+    except (zlib.error, struct.error, ValueError):
+        return None
+    flat = array("I")
+    flat.frombytes(data[4 + n:])
+    if sys.byteorder == "big":
+        flat.byteswap()
+    spans, start = {}, 0
+    for t, end in zip(head["terms"], head["ends"]):
+        spans[t] = (start, end)
+        start = end
+    return head["seg"], spans, flat
+
+
+def _read_shard(backend: Any, project_id: str, chapter_id: str) -> Optional[dict]:
+    return _read(backend, project_id, _shard_path(chapter_id))
+
+
+def _write_shard(backend: Any, project_id: str, chapter_id: str, shard: dict) -> None:
+    _write(backend, project_id, _shard_path(chapter_id), shard)
+
+
+class _StaleSegment(Exception):
+    """段已被其他进程合并替换，需重新载入段列表。"""
+
+
+def _bucket_count(n_postings: int) -> int:
+    """段的桶数：每桶约 _BUCKET_POSTINGS 个倒排项，取 2 的幂，不超过 _MAX_BUCKETS。"""
+    n = 1
+    while n < _MAX_BUCKETS and n * _BUCKET_POSTINGS < n_postings:
+        n *= 2
+    return n
+
+
+class ProjectIndex:
+    """
+    一个项目的倒排索引：持久化的若干段 + 内存中的增量层。
+    片段以整数编号，段中倒排项为 词 → [编号, 词频, 编号, 词频, ...]，按桶在首次查询其中的词时读取；
+    章节改动后其在旧段中的记录作废（签名不符），合并时丢弃。
+    增量层为尚未写入任何段的章节，各片段带词频。片段文本在需要时按章读取分片。
+    """
+
+    def __init__(self, backend: Any, project_id: str):
+        self.backend = backend
+        self.project_id = project_id
+        self.load_content: Callable[[str], str] = lambda cid: ""
+        self.live: dict[str, dict] = {}
+        self.overlay: dict[str, dict] = {}
+        self._bytes = {"segments": 0, "buckets": 0, "texts": 0, "overlay": 0, "terms": 0}
+        self.reload()
+
+    def reload(self) -> None:
+        """从存储后端重新载入段列表并清空各段的缓存；增量层按签名保留，下次 sync 时去掉已写入段的章节。"""
+        manifest = _read(self.backend, self.project_id, _SEGMENTS_PATH)
+        if manifest is None or manifest.get("version") != _SEGMENT_VERSION:
+            manifest = {"seq": 0, "next": 0, "segments": []}
+        self.seq: int = manifest["seq"]
+        self.next: int = manifest["next"]
+        # 由旧到新：{id, slot, buckets, docs, chapters: {章节 id: [签名, 首个片段编号, [[类别, 长度], ...]]}}
+        self.segments: list[dict] = manifest["segments"]
+        # 各章当前有效的记录：章节 id → (段 id, 首个片段编号, [[类别, 长度], ...])
+        self.entries: dict[str, tuple[int, int, list]] = {}
+        self.doc_of: dict[int, tuple[str, int]] = {}
+        self.entries_len = 0
+        # (段 id, 桶) → (词 → [起, 止), 倒排数组)
+        self.buckets: dict[tuple[int, int], tuple[dict[str, tuple[int, int]], array]] = {}
+        self.texts: dict[str, list[dict]] = {}
+        self.terms: dict[str, dict[tuple[str, int], int]] = {}
+        self.n_docs = 0
+        self.total_len = 0
+        self._bytes.update(segments=0, buckets=0, texts=0, terms=0)
+
+    @property
+    def nbytes(self) -> int:
+        """估算的内存占用（字节）。"""
+        return sum(self._bytes.values())
+
+    def trim(self) -> None:
+        """丢弃可从存储重新读取的缓存（倒排桶、片段文本、词的合并结果）。"""
+        self.buckets.clear()
+        self.texts.clear()
+        self.terms.clear()
+        self._bytes.update(buckets=0, texts=0, terms=0)
+
+    def sync(self, chapters: list[dict], load_content: Callable[[str], str]) -> bool:
+        """
+        让索引与 chapters 一致：各章取签名相符的最新段记录，没有的进增量层（先读持久化分片，仍不符则重建）。
+        返回增量层是否已达到应写成新段的规模。
+        """
+        self.load_content = load_content
+        self.live = {ch["id"]: ch for ch in chapters}
+        sigs = {cid: chapter_signature(ch) for cid, ch in self.live.items()}
+        entries: dict[str, tuple[int, int, list]] = {}
+        for seg in reversed(self.segments):
+            for cid, (sig, base, ps) in seg["chapters"].items():
+                if cid not in entries and sigs.get(cid) == sig:
+                    entries[cid] = (seg["id"], base, ps)
+        changed = entries != self.entries
+        if changed:
+            self.entries = entries
+            self.doc_of = {base + i: (cid, i) for cid, (_, base, ps) in entries.items() for i in range(len(ps))}
+            self.entries_len = sum(p[1] for _, _, ps in entries.values() for p in ps)
+            self._bytes["segments"] = 120 * len(self.doc_of)
+        fresh = sigs.keys() - entries.keys()
+        for cid in list(self.overlay):
+            if cid not in fresh or self.overlay[cid]["sig"] != sigs[cid]:
+                self._drop_overlay(cid)
+                changed = True
+        for cid in fresh - self.overlay.keys():
+            self._add_overlay(cid, sigs[cid])
+            changed = True
+        if changed:
+            self.terms.clear()
+            self._bytes["terms"] = 0
+            self.n_docs = len(self.doc_of) + sum(len(sh["passages"]) for sh in self.overlay.values())
+            self.total_len = self.entries_len + sum(p["len"] for sh in self.overlay.values() for p in sh["passages"])
+        n = len(self.overlay)
+        return n > 0 and n >= max(config.RETRIEVAL_MERGE_MIN, int(len(chapters) * config.RETRIEVAL_MERGE_RATIO))
+
+    def _add_overlay(self, cid: str, sig: str) -> None:
+        shard = _read_shard(self.backend, self.project_id, cid)
+        if shard is None or shard.get("sig") != sig:
+            shard = _build_shard(self.live[cid], self.load_content(cid))
+            _write_shard(self.backend, self.project_id, cid, shard)
+        size = 0
+        for p in shard["passages"]:
+            p["tf"] = _tf(p["text"])
+            p["len"] = sum(p["tf"].values())
+            size += 150 + 2 * len(p["text"]) + 100 * len(p["tf"])
+        self.overlay[cid] = {"sig": sig, "passages": shard["passages"], "bytes": size}
+        self._bytes["overlay"] += size
+        self._drop_text(cid)
+
+    def _drop_overlay(self, cid: str) -> None:
+        sh = self.overlay.pop(cid)
+        self._bytes["overlay"] -= sh["bytes"]
+
+    def _drop_text(self, cid: str) -> None:
+        ps = self.texts.pop(cid, None)
+        if ps is not None:
+            self._bytes["texts"] -= sum(150 + 2 * len(p["text"]) for p in ps)
+
+    def _read_bucket(self, seg: dict, b: int) -> Optional[tuple[dict[str, tuple[int, int]], array]]:
+        """段的一个桶；槽已被其他段重用或数据损坏时返回 None。"""
+        data = _decode_bucket(self.backend.read_bytes(self.project_id, _postings_path(seg["slot"], b)))
+        if data is None or data[0] != seg["id"]:
+            return None
+        return data[1], data[2]
+
+    def _postings(self, term: str) -> array:
+        """各段中词的倒排项（含作废的记录），按段由旧到新拼接。"""
+        out = array("I")
+        for seg in self.segments:
+            b = zlib.crc32(term.encode("utf-8")) % seg["buckets"]
+            bucket = self.buckets.get((seg["id"], b))
+            if bucket is None:
+                bucket = self._read_bucket(seg, b)
+                if bucket is None:
+                    manifest = _read(self.backend, self.project_id, _SEGMENTS_PATH)
+                    if manifest is not None and manifest.get("seq") != self.seq:
+                        raise _StaleSegment()
+                    bucket = ({}, array("I"))  # 桶缺失或损坏：只能按空处理，该段下次合并时重写
+                self.buckets[(seg["id"], b)] = bucket
+                self._bytes["buckets"] += 64 + 120 * len(bucket[0]) + 4 * len(bucket[1])
+            spans, flat = bucket
+            span = spans.get(term)
+            if span is not None:
+                out.extend(flat[span[0]:span[1]])
+        return out
+
+    def docs(self, term: str) -> dict[tuple[str, int], int]:
+        """词的倒排项 {(章节 id, 片段序号): 词频}：各段中有效的记录与增量层合并。"""
+        docs = self.terms.get(term)
+        if docs is None:
+            docs = {}
+            flat = self._postings(term)
+            for j in range(0, len(flat), 2):
+                key = self.doc_of.get(flat[j])
+                if key is not None:
+                    docs[key] = flat[j + 1]
+            for cid, sh in self.overlay.items():
+                for i, p in enumerate(sh["passages"]):
+                    n = p["tf"].get(term)
+                    if n:
+                        docs[(cid, i)] = n
+            self.terms[term] = docs
+            self._bytes["terms"] += 64 + 100 * len(docs)
+        return docs
+
+    def _info(self, cid: str, i: int) -> tuple[str, int]:
+        """片段的 (类别, 长度)，不读取文本。"""
+        sh = self.overlay.get(cid)
+        if sh is not None:
+            p = sh["passages"][i]
+            return p["kind"], p["len"]
+        kind, length = self.entries[cid][2][i]
+        return kind, length
+
+    def _keys(self) -> list[tuple[str, int]]:
+        return list(self.doc_of.values()) + [(cid, i) for cid, sh in self.overlay.items() for i in range(len(sh["passages"]))]
+
+    def passage(self, cid: str, i: int) -> Optional[dict]:
+        """片段 {kind, text, start, overlap}；分片已被其他进程改写（与所用段记录不符）时返回 None。"""
+        sh = self.overlay.get(cid)
+        if sh is not None:
+            return sh["passages"][i]
+        ps = self.texts.get(cid)
+        if ps is None:
+            shard = _read_shard(self.backend, self.project_id, cid)
+            if shard is None or shard.get("sig") != chapter_signature(self.live[cid]):
+                return None
+            ps = [{k: p[k] for k in ("kind", "text", "start", "overlap")} for p in shard["passages"]]
+            self.texts[cid] = ps
+            self._bytes["texts"] += sum(150 + 2 * len(p["text"]) for p in ps)
+        return ps[i] if i < len(ps) else None
+
+    def flush(self) -> None:
+        """
+        把增量层写成新段（调用方持有项目锁，且刚 reload 并 sync 过）。
+        末尾不大于新段的段依次合并进来（去掉其中作废的记录），段数随全书规模按对数增长；
+        新段写入当前与被合并的段都未用的槽，写完各桶后才替换段列表。
+        """
+        size = sum(len(sh["passages"]) for sh in self.overlay.values())
+        k = 0
+        while k < len(self.segments) and self.segments[-1 - k]["docs"] <= size:
+            size += self.segments[-1 - k]["docs"]
+            k += 1
+        merged = self.segments[len(self.segments) - k:]
+
+        # 各词的倒排项以本机字节序的 uint32 字节串分段收集，编码时直接拼接
+        postings: dict[str, list[bytes]] = {}
+        chapters: dict[str, list] = {}
+        for seg in merged:
+            # 段中没有作废的记录时整段照搬，不必逐项核对
+            clean = all(self.entries.get(cid, (None,))[0] == seg["id"] for cid in seg["chapters"])
+            for b in range(seg["buckets"]):
+                bucket = self._read_bucket(seg, b)
+                if bucket is None:
+                    # 桶缺失或损坏：丢弃该段，其中的章节回到增量层后重来
+                    live = list(self.live.values())
+                    self.segments = [s for s in self.segments if s is not seg]
+                    self.sync(live, self.load_content)
+                    self.flush()
+                    return
+                spans, flat = bucket
+                if clean:
+                    raw = flat.tobytes()
+                    for t, (lo, hi) in spans.items():
+                        postings.setdefault(t, []).append(raw[4 * lo:4 * hi])
+                    continue
+                for t, (lo, hi) in spans.items():
+                    kept = array("I", (x for j in range(lo, hi, 2) if flat[j] in self.doc_of for x in flat[j:j + 2]))
+                    if kept:
+                        postings.setdefault(t, []).append(kept.tobytes())
+            for cid, entry in seg["chapters"].items():
+                if self.entries.get(cid, (None,))[0] == seg["id"]:
+                    chapters[cid] = entry
+        nxt = self.next
+        fresh: dict[str, list[int]] = {}
+        for cid, sh in self.overlay.items():
+            chapters[cid] = [sh["sig"], nxt, [[p["kind"], p["len"]] for p in sh["passages"]]]
+            for p in sh["passages"]:
+                for t, n in p["tf"].items():
+                    flat = fresh.get(t)
+                    if flat is None:
+                        fresh[t] = [nxt, n]
+                    else:
+                        flat.append(nxt)
+                        flat.append(n)
+                nxt += 1
+        for t, flat in fresh.items():
+            postings.setdefault(t, []).append(array("I", flat).tobytes())
+
+        seq = self.seq + 1
+        used = {seg["slot"] for seg in self.segments}
+        slot = min(set(range(len(used) + 1)) - used)
+        n_buckets = _bucket_count(sum(len(piece) for pieces in postings.values() for piece in pieces) // 8)
+        by_bucket: list[dict[str, list[bytes]]] = [{} for _ in range(n_buckets)]
+        for t, pieces in postings.items():
+            by_bucket[zlib.crc32(t.encode("utf-8")) % n_buckets][t] = pieces
+        for b, terms in enumerate(by_bucket):
+            self.backend.write_bytes(self.project_id, _postings_path(slot, b), _encode_bucket(seq, terms))
+        segment = {"id": seq, "slot": slot, "buckets": n_buckets, "docs": sum(len(e[2]) for e in chapters.values()),
+                   "chapters": chapters}
+        _write(self.backend, self.project_id, _SEGMENTS_PATH, {
+            "version": _SEGMENT_VERSION, "seq": seq, "next": nxt,
+            "segments": self.segments[:len(self.segments) - k] + [segment],
+        })
+
+        # 切换到新的段列表；增量层的文本留作片段文本缓存
+        live = list(self.live.values())
+        texts = {cid: [{k: p[k] for k in ("kind", "text", "start", "overlap")} for p in sh["passages"]]
+                 for cid, sh in self.overlay.items()}
+        self.reload()
+        self.sync(live, self.load_content)
+        self.texts = texts
+        self._bytes["texts"] = sum(150 + 2 * len(p["text"]) for ps in texts.values() for p in ps)
+
+    def _scores(self, query: str) -> dict[tuple[str, int], float]:
+        """含 query 任一词的片段的 BM25 得分。"""
+        if not self.n_docs:
+            return {}
+        avg_len = self.total_len / self.n_docs
+        scores: dict[tuple[str, int], float] = {}
+        for t in set(tokenize(query)):
+            docs = self.docs(t)
+            if not docs:
+                continue
+            w = idf(self.n_docs, len(docs))
+            for key, tf in docs.items():
+                scores[key] = scores.get(key, 0.0) + bm25(tf, w, self._info(*key)[1], avg_len)
+        return scores
+
+    def _hit(self, cid: str) -> dict:
+        ch = self.live[cid]
+        return {"chapter_id": cid, "volume_idx": ch.get("volume_idx", 0), "chapter_idx": ch.get("chapter_idx", 0)}
+
+    def search(self, query: str, k: int, skip: Callable[[str, dict], bool] = lambda cid, p: False) -> list[dict]:
+        scores = self._scores(query)
+        out = []
+        for (cid, i), score in sorted(scores.items(), key=lambda kv: kv[1], reverse=True):
+            p = self.passage(cid, i)
+            if p is None or skip(cid, p):
+                continue
+            out.append({**self._hit(cid), "kind": p["kind"], "text": p["text"], "score": round(score, 4)})
+            if len(out) >= k:
+                break
+        return out
+
+    def _candidates(self, word: str) -> Optional[set[tuple[str, int]]]:
+        """含 word 全部可索引词项的片段；word 只有单个汉字等无法用倒排表筛选时返回 None（需逐片段核对）。"""
+        keys = None
+        for t in set(tokenize(word)):
+            if len(t) == 1 and _CJK.fullmatch(t):
+                continue  # 单字只在孤立出现时入索引，不能用来筛选
+            docs = self.docs(t)
+            if not docs:
+                return set()
+            keys = set(docs) if keys is None else keys & docs.keys()
+        return keys
+
+    def find(self, query: str, kinds: tuple[str, ...] = _KINDS, snippet_chars: int = 40) -> list[dict]:
+        """
+        全文查找：query 按空白分成若干词，片段须逐字包含每个词（英文不区分大小写）。
+        返回每个命中片段的 {chapter_id, volume_idx, chapter_idx, kind, offset, matches, snippet, score}：
+        offset / matches 为在正文（kind=content）或摘要、走向文本中的字符偏移，matches 为 [[偏移, 长度], ...]。
+        整个落在与上一片段重叠部分内的命中已由上一片段报告，不再重复。
+        """
+        words = [w.lower() for w in query.split()]
+        if not words:
+            return []
+        keys: Optional[set[tuple[str, int]]] = None
+        for w in words:
+            cand = self._candidates(w)
+            if cand is not None:
+                keys = cand if keys is None else keys & cand
+        if keys is None:
+            keys = set(self._keys())
+        scores = self._scores(query)
+        out = []
+        for cid, i in keys:
+            if self._info(cid, i)[0] not in kinds:
+                continue
+            p = self.passage(cid, i)
+            if p is None:
+                continue
+            text = p["text"].lower()
+            matches = []
+            for w in words:
+                at = text.find(w)
+                if at < 0:
+                    break
+                while at >= 0:
+                    matches.append([at, len(w)])
+                    at = text.find(w, at + len(w))
+            else:
+                matches = sorted(m for m in matches if m[0] + m[1] > p.get("overlap", 0))
+                if not matches:
+                    continue
+                first, n = matches[0]
+                lo, hi = max(0, first - snippet_chars), min(len(text), first + n + snippet_chars)
+                start = p.get("start", 0)
+                out.append({
+                    **self._hit(cid),
+                    "kind": p["kind"],
+                    "offset": start + first,
+                    "matches": [[start + m, n] for m, n in matches],
+                    "snippet": p["text"][lo:hi],
+                    "snippet_offset": start + lo,
+                    "score": round(scores.get((cid, i), 0.0), 4),
+                })
+        return out
+
+
+# project_id -> ProjectIndex，按最近使用排序
+_indexes: "OrderedDict[str, ProjectIndex]" = OrderedDict()
+_project_locks: dict[str, threading.Lock] = {}
+# 保护以上两个字典本身；各项目索引的读写在该项目的锁内
+_lock = threading.Lock()
+
+
+def _project_lock(project_id: str) -> threading.Lock:
+    with _lock:
+        return _project_locks.setdefault(project_id, threading.Lock())
+
+
+def _get(backend: Any, project_id: str) -> ProjectIndex:
+    """取项目的索引（没有则载入段）。调用方持有该项目的锁。"""
+    with _lock:
+        idx = _indexes.get(project_id)
+        if idx is not None:
+            _indexes.move_to_end(project_id)
+            return idx
+    idx = ProjectIndex(backend, project_id)
+    with _lock:
+        _indexes[project_id] = idx
+    return idx
+
+
+def _evict(keep: str) -> None:
+    """总占用超过 RETRIEVAL_CACHE_MAX_BYTES 时淘汰最久未用的项目索引；仍超出时丢弃 keep 可重新读取的缓存。"""
+    with _lock:
+        total = sum(idx.nbytes for idx in _indexes.values())
+        for pid in list(_indexes):
+            if total <= config.RETRIEVAL_CACHE_MAX_BYTES:
+                break
+            if pid != keep:
+                total -= _indexes.pop(pid).nbytes
+        idx = _indexes.get(keep)
+    if total > config.RETRIEVAL_CACHE_MAX_BYTES and idx is not None:
+        idx.trim()
+
+
+def _refresh(backend: Any, project_id: str, chapters: list[dict], load_content: Callable[[str], str]) -> None:
+    """
+    分片写入后（调用方持有项目的跨进程锁 locks.project_lock）：同步本进程的索引，增量层达到规模时写成新段。
+    写入前重新载入段列表，接上其他进程已写入的段。
+    """
+    with _project_lock(project_id):
+        idx = _get(backend, project_id)
+        if idx.sync(chapters, load_content):
+            idx.reload()
+            if idx.sync(chapters, load_content):
+                idx.flush()
+        _evict(project_id)
+
+
+def index_chapter(
+    backend: Any,
+    project_id: str,
+    chapter: dict,
+    content: str,
+    chapters: list[dict],
+    load_content: Callable[[str], str],
+) -> None:
+    """章节写入或正文/摘要变化后重建该章分片并持久化（chapters 为写入后的全部章节，调用方持有项目锁）。"""
+    _write_shard(backend, project_id, chapter["id"], _build_shard(chapter, content))
+    _refresh(backend, project_id, chapters, load_content)
+
+
+def index_summary(
+    backend: Any,
+    project_id: str,
+    chapter: dict,
+    chapters: list[dict],
+    load_content: Callable[[str], str],
+) -> None:
+    """章摘要更新后重建该章分片：正文未变时沿用已有分片的正文片段，不重新读取、切分正文。"""
+    shard = _read_shard(backend, project_id, chapter["id"])
+    if shard is not None and shard.get("version") == _SHARD_VERSION and shard["content_hash"] == chapter.get("content_hash", ""):
+        content = [p for p in shard["passages"] if p["kind"] == "content"]
+        shard = _build_shard(chapter, "", content)
+    else:
+        shard = _build_shard(chapter, load_content(chapter["id"]))
+    _write_shard(backend, project_id, chapter["id"], shard)
+    _refresh(backend, project_id, chapters, load_content)
+
+
+def _query(backend: Any, project_id: str, chapters: list[dict], load_content: Callable[[str], str], fn: Callable[[ProjectIndex], list]) -> list:
+    with _project_lock(project_id):
+        idx = _get(backend, project_id)
+        try:
+            for _ in range(3):
+                try:
+                    idx.sync(chapters, load_content)
+                    return fn(idx)
+                except _StaleSegment:
+                    idx.reload()
+            raise RuntimeError("检索索引正在频繁重建，请稍后重试")
+        finally:
+            _evict(project_id)
+
+
+def search(
+    backend: Any,
+    project_id: str,
+    chapters: list[dict],
+    query: str,
+    k: int,
+    load_content: Callable[[str], str],
+    skip: Callable[[str, dict], bool] = lambda cid, p: False,
+) -> list[dict]:
+    """
+    返回与 query 最相关的 k 个片段：[{chapter_id, volume_idx, chapter_idx, kind, text, score}]，按得分降序。
+    skip(chapter_id, passage) 为真的片段不计入结果（如上下文中已有的摘要）。
+    """
+    if not query.strip():
+        return []
+    return _query(backend, project_id, chapters, load_content, lambda idx: idx.search(query, k, skip))
+
+
+def find(
+    backend: Any,
+    project_id: str,
+    chapters: list[dict],
+    query: str,
+    load_content: Callable[[str], str],
+    kinds: tuple[str, ...] = _KINDS,
+    snippet_chars: int = 40,
+) -> list[dict]:
+    """全文查找（见 ProjectIndex.find），结果未排序。"""
+    if not query.strip():
+        return []
+    return _query(backend, project_id, chapters, load_content, lambda idx: idx.find(query, kinds, snippet_chars))
@@ -0,0 +1,179 @@
+"""DashScope 调用调度：按模型的令牌桶限流 + 优先级排队。
+
+每个模型两个令牌桶：请求数（RPM）与 token 数（TPM，按估算输入 + 输出上限计），
+容量为每分钟配额、按秒匀速补充；配额见 config.RATE_LIMITS，未配置的模型不限流。
+排队按 (优先级, 到达顺序)：交互式生成（INTERACTIVE）先于后台摘要（BACKGROUND），
+只有队首可以取令牌，吞吐稳定在配额上限而不是撞上限后报错。
+同时支持 asyncio（acquire）与线程（acquire_sync）调用方。
+"""
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+from typing import Optional
+
+import config
+
+INTERACTIVE = 0
+BACKGROUND = 1
+_PRIORITY_NAMES = {INTERACTIVE: "interactive", BACKGROUND: "background"}
+# 非队首等待者的轮询间隔，以及单次等待的上限（秒）
+_POLL = 0.05
+_MAX_SLEEP = 0.5
+
+
+class _Bucket:
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.level = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.t = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.t) * self.rate)
+        self.t = now
+
+    def wait_time(self, cost: float) -> float:
+        cost = min(cost, self.capacity)
+        return 0.0 if self.level >= cost else (cost - self.level) / self.rate
+
+    def take(self, cost: float) -> None:
+        self.level -= min(cost, self.capacity)
+
+
+class _Limiter:
+    """单个模型的令牌桶、等待队列与统计。"""
+
+    def __init__(self, rpm: Optional[float], tpm: Optional[float]):
+        self.requests = _Bucket(rpm) if rpm else None
+        self.tokens = _Bucket(tpm) if tpm else None
+        self.waiters: list[list] = []  # 堆：[priority, seq]
+        self.granted = {p: 0 for p in _PRIORITY_NAMES}
+        self.wait_total = {p: 0.0 for p in _PRIORITY_NAMES}
+        self.wait_max = {p: 0.0 for p in _PRIORITY_NAMES}
+
+
+class Scheduler:
+    def __init__(self, limits: dict[str, dict]):
+        self._limits = limits
+        self._limiters: dict[str, _Limiter] = {}
+        self._lock = threading.Lock()
+        self._seq = itertools.count()
+
+    def _limiter(self, model: str) -> Optional[_Limiter]:
+        conf = self._limits.get(model)
+        if not conf:
+            return None
+        with self._lock:
+            lim = self._limiters.get(model)
+            if lim is None:
+                lim = self._limiters[model] = _Limiter(conf.get("rpm"), conf.get("tpm"))
+            return lim
+
+    def _enqueue(self, lim: _Limiter, priority: int) -> list:
+        entry = [priority, next(self._seq)]
+        with self._lock:
+            heapq.heappush(lim.waiters, entry)
+        return entry
+
+    def _leave(self, lim: _Limiter, entry: list) -> None:
+        with self._lock:
+            if entry in lim.waiters:
+                lim.waiters.remove(entry)
+                heapq.heapify(lim.waiters)
+
+    def _try(self, lim: _Limiter, entry: list, cost: float, start: float) -> Optional[float]:
+        """队首且令牌足够时取走令牌并出队，返回 None；否则返回建议的等待秒数。"""
+        with self._lock:
+            if lim.waiters[0] is not entry:
+                return _POLL
+            now = time.monotonic()
+            buckets = [(b, c) for b, c in ((lim.requests, 1), (lim.tokens, cost)) if b is not None]
+            for b, _ in buckets:
+                b.refill(now)
+            wait = max(b.wait_time(c) for b, c in buckets)
+            if wait > 0:
+                return wait
+            for b, c in buckets:
+                b.take(c)
+            heapq.heappop(lim.waiters)
+            waited = now - start
+            p = entry[0]
+            lim.granted[p] += 1
+            lim.wait_total[p] += waited
+            lim.wait_max[p] = max(lim.wait_max[p], waited)
+            return None
+
+    async def acquire(self, model: str, tokens: int, priority: int = INTERACTIVE) -> None:
+        """
+        等待直到可以向 model 发出一次估算消耗 tokens 的请求（协程被取消时退出队列）。
+        priority 为 INTERACTIVE 或 BACKGROUND。
+        """
+        lim = self._limiter(model)
+        if lim is None:
+            return
+        entry = self._enqueue(lim, priority)
+        start = time.monotonic()
+        try:
+            while True:
+                wait = self._try(lim, entry, tokens, start)
+                if wait is None:
+                    return
+                await asyncio.sleep(min(wait, _MAX_SLEEP))
+        except BaseException:
+            self._leave(lim, entry)
+            raise
+
+    def acquire_sync(self, model: str, tokens: int, priority: int = INTERACTIVE) -> None:
+        """acquire 的阻塞版本，供同步调用方（线程）使用。"""
+        lim = self._limiter(model)
+        if lim is None:
+            return
+        entry = self._enqueue(lim, priority)
+        start = time.monotonic()
+        try:
+            while True:
+                wait = self._try(lim, entry, tokens, start)
+                if wait is None:
+                    return
+                time.sleep(min(wait, _MAX_SLEEP))
+        except BaseException:
+            self._leave(lim, entry)
+            raise
+
+    def release(self, model: str, tokens: int) -> None:
+        """退回已放行、但被放弃（超时、对冲落败、提前关闭）的请求没有用到的 token（按估算预扣的部分）。"""
+        lim = self._limiter(model)
+        if lim is None or lim.tokens is None or tokens <= 0:
+            return
+        with self._lock:
+            lim.tokens.level = min(lim.tokens.capacity, lim.tokens.level + tokens)
+
+    def stats(self) -> dict:
+        """各模型的排队深度、已放行数、平均/最大等待（毫秒）与桶内剩余令牌。"""
+        out = {}
+        with self._lock:
+            now = time.monotonic()
+            for model, lim in self._limiters.items():
+                for b in (lim.requests, lim.tokens):
+                    if b is not None:
+                        b.refill(now)
+                queued = {p: 0 for p in _PRIORITY_NAMES}
+                for p, _ in lim.waiters:
+                    queued[p] += 1
+                out[model] = {
+                    "queued": {name: queued[p] for p, name in _PRIORITY_NAMES.items()},
+                    "granted": {name: lim.granted[p] for p, name in _PRIORITY_NAMES.items()},
+                    "avg_wait_ms": {
+                        name: round(lim.wait_total[p] / lim.granted[p] * 1000, 1) if lim.granted[p] else 0.0
+                        for p, name in _PRIORITY_NAMES.items()
+                    },
+                    "max_wait_ms": {name: round(lim.wait_max[p] * 1000, 1) for p, name in _PRIORITY_NAMES.items()},
+                    "requests_available": round(lim.requests.level, 1) if lim.requests else None,
+                    "tokens_available": round(lim.tokens.level) if lim.tokens else None,
+                }
+        return out
+
+
+scheduler = Scheduler(config.RATE_LIMITS)
@@ -0,0 +1,228 @@
+"""项目设定（世界/背景/人物设定、大纲）的分节索引：长设定不再整篇放入提示词，只放纲要与和本章相关的小节。
+
+分节：按标题行（Markdown #、【…】、第X卷/章/部/篇、一、/1. 等短行）与「名称：」开头的行切成小节，
+过长的小节再按段落切成不超过 SETTING_SECTION_CHARS 字的几节（沿用标题）。
+纲要：各节标题与首句，截到 SETTING_DIGEST_CHARS 字；只取决于设定本身，放在提示词前缀中逐字节稳定。
+选取：以本章走向（及最近的章摘要）为查询，对各节做 BM25（retrieval.tokenize 字二元组），
+标题（如人物名）在查询中逐字出现的小节优先，按原文顺序输出，不超过 SETTING_SELECT_CHARS 字。
+
+各字段的索引经由存储后端持久化于 setting_index/{field}，以设定内容哈希为签名：
+建项目与 update_project 改动设定时只重建改动的字段；缺失或签名不符（旧项目、其他进程改动）时读取时重建。
+"""
+import hashlib
+import json
+import re
+import threading
+import zlib
+from typing import Any, Optional
+
+import config
+import retrieval
+
+# 字段 → 标题（与提示词中设定各段的标题一致）
+FIELDS = {
+    "world_setting": "世界设定",
+    "background_setting": "背景设定",
+    "character_setting": "人物设定",
+    "outline": "整体大纲",
+}
+
+# 索引格式版本：格式变化时旧索引的签名不再匹配，读取时自动重建
+_INDEX_VERSION = "1"
+_HEADING = re.compile(
+    r"^(?:#{1,6}\s*(?P<md>[^#]+?)\s*#*"
+    r"|【(?P<br>[^】]{1,30})】"
+    r"|(?P<cn>第[0-9０-９一二三四五六七八九十百千零两]+[卷章部篇节幕回集][^。！？]{0,30})"
+    r"|(?P<num>(?:[一二三四五六七八九十]+[、.．]|[0-9]{1,2}[、.．](?![0-9]))[^。！？]{1,30})"
+    r"|(?P<colon>[^。！？：:]{1,20})[：:])$"
+)
+_LABEL = re.compile(r"^(?P<label>[^\s，。、；！？,.;!?：:（）()【】]{1,12})[：:]\s*\S")
+_SENTENCE = re.compile(r"[^。！？!?\n]+[。！？!?]?")
+_DIGEST_LINE_CHARS = 40
+
+_cache: dict[tuple[str, str], dict] = {}
+_lock = threading.Lock()
+
+
+def signature(text: str) -> str:
+    return hashlib.sha1(f"{_INDEX_VERSION}\0{text}".encode("utf-8")).hexdigest()
+
+
+def _title_of(line: str) -> Optional[str]:
+    """标题行或「名称：」开头的行返回标题，否则 None。"""
+    s = line.strip()
+    if not s:
+        return None
+    m = _HEADING.match(s)
+    if m:
+        return next(g for g in m.groups() if g).strip()
+    m = _LABEL.match(s)
+    return m.group("label") if m else None
+
+
+def parse_sections(text: str, size: int) -> list[dict]:
+    """切成小节：[{title, text, start, cont}]，start 为在原文中的偏移，cont 表示是同一标题下的续节。"""
+    blocks: list[tuple[str, int, int]] = []
+    title, start, pos = "", 0, 0
+    for line in text.split("\n"):
+        t = _title_of(line)
+        if t is not None and pos > start:
+            blocks.append((title, start, pos))
+            start = pos
+        if t is not None:
+            title = t
+        pos += len(line) + 1
+    blocks.append((title, start, len(text)))
+
+    sections = []
+    for title, s, e in blocks:
+        for i, (a, b) in enumerate(retrieval.chunk_spans(text[s:e], size)):
+            sections.append({"title": title, "text": text[s + a:s + b], "start": s + a, "cont": i > 0})
+    return sections
+
+
+def _first_sentence(section: dict) -> str:
+    body = section["text"]
+    if section["title"] and not section["cont"]:
+        # 去掉标题行本身，或「名称：」前缀
+        first, _, rest = body.partition("\n")
+        first = first.strip()
+        if _HEADING.match(first):
+            body = rest
+        elif first.startswith(section["title"]):
+            body = first[len(section["title"]):].lstrip("：:") + "\n" + rest
+    m = _SENTENCE.search(body.strip())
+    s = m.group(0).strip() if m else ""
+    return s if len(s) <= _DIGEST_LINE_CHARS else s[:_DIGEST_LINE_CHARS] + "…"
+
+
+def _digest(sections: list[dict], max_chars: int) -> str:
+    """各节标题与首句；同一标题的续节不重复列出。"""
+    lines, used = [], 0
+    for i, sec in enumerate(sections):
+        if sec["cont"]:
+            continue
+        first = _first_sentence(sec)
+        line = f"- {sec['title']}：{first}" if sec["title"] and first else f"- {sec['title'] or first}"
+        if line == "- ":
+            continue
+        if used + len(line) + 1 > max_chars:
+            lines.append(f"……（其余 {sum(1 for s in sections[i:] if not s['cont'])} 节从略）")
+            break
+        lines.append(line)
+        used += len(line) + 1
+    return "\n".join(lines)
+
+
+def build(text: str) -> dict:
+    """建立一个字段的索引：{sig, sections: [{title, text, start, cont, tf, len}], digest}。"""
+    sections = parse_sections(text, config.SETTING_SECTION_CHARS)
+    for sec in sections:
+        tf: dict[str, int] = {}
+        for t in retrieval.tokenize(sec["title"] + "\n" + sec["text"]):
+            tf[t] = tf.get(t, 0) + 1
+        sec["tf"] = tf
+        sec["len"] = sum(tf.values())
+    return {"sig": signature(text), "sections": sections, "digest": _digest(sections, config.SETTING_DIGEST_CHARS)}
+
+
+def _path(field: str) -> str:
+    return f"setting_index/{field}"
+
+
+def _read(backend: Any, project_id: str, field: str) -> Optional[dict]:
+    raw = backend.read_bytes(project_id, _path(field))
+    if raw is None:
+        return None
+    try:
+        return json.loads(zlib.decompress(raw))
+    except (zlib.error, ValueError):
+        return None
+
+
+def _write(backend: Any, project_id: str, field: str, index: dict) -> None:
+    data = json.dumps(index, ensure_ascii=False).encode("utf-8")
+    backend.write_bytes(project_id, _path(field), zlib.compress(data, 6))
+
+
+def is_long(text: str) -> bool:
+    """是否需要分节（否则整篇放入提示词）。"""
+    return len(text or "") > config.SETTING_INLINE_CHARS
+
+
+def index_settings(backend: Any, project_id: str, meta: dict, fields: Optional[list[str]] = None) -> None:
+    """为 fields（缺省为全部设定字段）中的长设定重建索引并持久化；上传或修改设定时调用。"""
+    for field in fields or FIELDS:
+        text = meta.get(field) or ""
+        if not is_long(text):
+            continue
+        index = build(text)
+        _write(backend, project_id, field, index)
+        with _lock:
+            _cache[(project_id, field)] = index
+
+
+def load(backend: Any, project_id: str, field: str, text: str) -> dict:
+    """取字段的索引：内存缓存 → 持久化索引 → 当场重建，均按内容签名核对。"""
+    sig = signature(text)
+    with _lock:
+        index = _cache.get((project_id, field))
+    if index is not None and index["sig"] == sig:
+        return index
+    index = _read(backend, project_id, field)
+    if index is None or index.get("sig") != sig:
+        index = build(text)
+        _write(backend, project_id, field, index)
+    with _lock:
+        _cache[(project_id, field)] = index
+    return index
+
+
+def select(index: dict, query: str, max_chars: int) -> list[dict]:
+    """
+    与 query 相关的小节，按原文顺序，合计不超过 max_chars 字（至少一节）：
+    标题在 query 中逐字出现的优先，其余按 BM25 得分；query 为空时取开头各节。
+    """
+    sections = index["sections"]
+    if not sections:
+        return []
+    if query.strip():
+        terms = set(retrieval.tokenize(query))
+        avg_len = sum(s["len"] for s in sections) / len(sections) or 1
+        scores = [0.0] * len(sections)
+        for t in terms:
+            df = sum(1 for s in sections if t in s["tf"])
+            if not df:
+                continue
+            idf = retrieval.idf(len(sections), df)
+            for i, s in enumerate(sections):
+                tf = s["tf"].get(t)
+                if tf:
+                    scores[i] += retrieval.bm25(tf, idf, s["len"], avg_len)
+        named = [len(s["title"]) >= 2 and s["title"] in query for s in sections]
+        ranked = [i for i in sorted(range(len(sections)), key=lambda i: (named[i], scores[i]), reverse=True)
+                  if named[i] or scores[i] > 0]
+    else:
+        ranked = list(range(len(sections)))
+    picked, used = [], 0
+    for i in ranked:
+        n = len(sections[i]["text"])
+        if picked and used + n > max_chars:
+            continue
+        picked.append(i)
+        used += n
+        if used >= max_chars:
+            break
+    return [sections[i] for i in sorted(picked)]
+
+
+def render(sections: list[dict]) -> str:
+    """选中小节的文本；续节和不以标题开头的小节前标注所属标题。"""
+    out = []
+    for s in sections:
+        head = s["text"].split("\n", 1)[0]
+        if s["title"] and (s["cont"] or _title_of(head) != s["title"]):
+            out.append(f"（{s['title']}）\n{s['text']}")
+        else:
+            out.append(s["text"])
+    return "\n\n".join(out)
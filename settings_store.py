@@ -4,6 +4,7 @@ import os
 from pathlib import Path
 
 import config
+import locks
 
 SETTINGS_PATH = Path(config.DATA_DIR) / "settings.json"
 
@@ -31,14 +32,13 @@ def get_settings() -> dict:
 
 def save_settings(updates: dict) -> dict:
     """保存设置，返回合并后的完整设置。"""
-    Path(config.DATA_DIR).mkdir(parents=True, exist_ok=True)
-    cur = get_settings()
-    for k, v in updates.items():
-        if k in DEFAULTS and v is not None:
-            try:
-                cur[k] = float(v)
-            except (TypeError, ValueError):
-                pass
-    with open(SETTINGS_PATH, "w", encoding="utf-8") as f:
-        json.dump(cur, f, ensure_ascii=False, indent=2)
+    with locks.named_lock("settings"):
+        cur = get_settings()
+        for k, v in updates.items():
+            if k in DEFAULTS and v is not None:
+                try:
+                    cur[k] = float(v)
+                except (TypeError, ValueError):
+                    pass
+        locks.atomic_write(SETTINGS_PATH, json.dumps(cur, ensure_ascii=False, indent=2).encode("utf-8"))
     return cur
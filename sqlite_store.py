@@ -0,0 +1,310 @@
+"""SQLite 存储后端（WAL 模式）：projects / volumes / chapters / versions / blobs 五张表，
+另有 project_revs 记录每个项目的写入计数（供元信息缓存判断失效），
+catalog / catalog_rev 存放项目目录索引及其写入计数。
+
+与 json_store 提供相同的接口；write_meta 只写入相对上次读取发生变化的行，
+不再像 meta.json 那样每次整体重写。比较所用的快照记有读取时的写入计数，
+与库中计数不符（其他线程或进程已写入）时不做增量，整体重写该项目的行。
+"""
+import json
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Optional
+
+import config
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS projects (
+    id TEXT PRIMARY KEY,
+    name TEXT,
+    created_at TEXT,
+    updated_at TEXT,
+    world_setting TEXT,
+    background_setting TEXT,
+    character_setting TEXT,
+    outline TEXT,
+    extra TEXT NOT NULL DEFAULT '{}'
+);
+CREATE TABLE IF NOT EXISTS volumes (
+    project_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    summary TEXT,
+    chapters TEXT NOT NULL DEFAULT '[]',
+    extra TEXT NOT NULL DEFAULT '{}',
+    PRIMARY KEY (project_id, idx)
+);
+CREATE TABLE IF NOT EXISTS chapters (
+    project_id TEXT NOT NULL,
+    id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    volume_idx INTEGER,
+    chapter_idx INTEGER,
+    direction TEXT,
+    summary TEXT,
+    summary_status TEXT,
+    created_at TEXT,
+    extra TEXT NOT NULL DEFAULT '{}',
+    PRIMARY KEY (project_id, id)
+);
+CREATE TABLE IF NOT EXISTS versions (
+    project_id TEXT NOT NULL,
+    chapter_id TEXT NOT NULL,
+    id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    note TEXT,
+    created_at TEXT,
+    extra TEXT NOT NULL DEFAULT '{}',
+    PRIMARY KEY (project_id, chapter_id, id)
+);
+CREATE TABLE IF NOT EXISTS project_revs (
+    project_id TEXT PRIMARY KEY,
+    rev INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS blobs (
+    project_id TEXT NOT NULL,
+    path TEXT NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY (project_id, path)
+);
+CREATE TABLE IF NOT EXISTS catalog (
+    id TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS catalog_rev (
+    k INTEGER PRIMARY KEY CHECK (k = 0),
+    rev INTEGER NOT NULL
+);
+"""
+
+_PROJECT_COLS = ("name", "created_at", "updated_at", "world_setting", "background_setting", "character_setting", "outline")
+_CHAPTER_COLS = ("volume_idx", "chapter_idx", "direction", "summary", "summary_status", "created_at")
+_VERSION_COLS = ("note", "created_at")
+
+_local = threading.local()
+# project_id -> (写入计数, {表名: {主键: 行}})，记录本进程最近一次读/写时各行的内容，用于只写变化的行
+_snapshots: dict[str, tuple[int, dict[str, dict]]] = {}
+_snap_lock = threading.Lock()
+
+
+def _conn() -> sqlite3.Connection:
+    """每个线程一个连接。"""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        Path(config.SQLITE_PATH).parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(config.SQLITE_PATH, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(_SCHEMA)
+        _local.conn = conn
+    return conn
+
+
+def _split(d: dict, cols: tuple, skip: tuple = ()) -> tuple:
+    """拆成 (已知列值..., extra JSON)。"""
+    extra = {k: v for k, v in d.items() if k not in cols and k not in skip}
+    return tuple(d.get(c) for c in cols) + (json.dumps(extra, ensure_ascii=False, sort_keys=True),)
+
+
+def _merge(cols: tuple, values: tuple, extra: str) -> dict:
+    """_split 的逆操作；值为 NULL 的列视为缺省字段。"""
+    d = {c: v for c, v in zip(cols, values) if v is not None}
+    d.update(json.loads(extra or "{}"))
+    return d
+
+
+def _rows(project_id: str, meta: dict) -> dict[str, dict]:
+    """把 meta 拆成各表的行：{表名: {主键: 行 tuple}}。"""
+    rows = {
+        "projects": {project_id: (project_id,) + _split(meta, _PROJECT_COLS, skip=("id", "volumes", "chapters"))},
+        "volumes": {},
+        "chapters": {},
+        "versions": {},
+    }
+    for i, v in enumerate(meta.get("volumes", [])):
+        rows["volumes"][i] = (project_id, i, v.get("summary"), json.dumps(v.get("chapters", []))) + _split(v, (), skip=("summary", "chapters"))[-1:]
+    for pos, ch in enumerate(meta.get("chapters", [])):
+        rows["chapters"][ch["id"]] = (project_id, ch["id"], pos) + _split(ch, _CHAPTER_COLS, skip=("id", "versions"))
+        for vpos, ver in enumerate(ch.get("versions", [])):
+            rows["versions"][(ch["id"], ver["id"])] = (project_id, ch["id"], ver["id"], vpos) + _split(ver, _VERSION_COLS, skip=("id",))
+    return rows
+
+
+_UPSERT = {
+    "projects": "INSERT OR REPLACE INTO projects VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+    "volumes": "INSERT OR REPLACE INTO volumes VALUES (?, ?, ?, ?, ?)",
+    "chapters": "INSERT OR REPLACE INTO chapters VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+    "versions": "INSERT OR REPLACE INTO versions VALUES (?, ?, ?, ?, ?, ?, ?)",
+}
+_DELETE = {
+    "projects": "DELETE FROM projects WHERE id = ?",
+    "volumes": "DELETE FROM volumes WHERE project_id = ? AND idx = ?",
+    "chapters": "DELETE FROM chapters WHERE project_id = ? AND id = ?",
+    "versions": "DELETE FROM versions WHERE project_id = ? AND chapter_id = ? AND id = ?",
+}
+
+_DELETE_PROJECT = (
+    "DELETE FROM projects WHERE id = ?",
+    "DELETE FROM volumes WHERE project_id = ?",
+    "DELETE FROM chapters WHERE project_id = ?",
+    "DELETE FROM versions WHERE project_id = ?",
+)
+
+
+def _key_params(project_id: str, table: str, key) -> tuple:
+    if table == "projects":
+        return (key,)
+    if table == "versions":
+        return (project_id,) + key
+    return (project_id, key)
+
+
+def list_project_ids() -> list[str]:
+    """列出所有项目 id。"""
+    return [r[0] for r in _conn().execute("SELECT id FROM projects")]
+
+
+def meta_stamp(project_id: str) -> Optional[int]:
+    """项目的写入计数（每次 write_meta 加一），用于缓存失效判断；不存在返回 None。"""
+    row = _conn().execute(
+        "SELECT p.id, r.rev FROM projects p LEFT JOIN project_revs r ON r.project_id = p.id WHERE p.id = ?",
+        (project_id,),
+    ).fetchone()
+    if row is None:
+        return None
+    return row[1] or 0
+
+
+def _rev(conn: sqlite3.Connection, project_id: str) -> int:
+    row = conn.execute("SELECT rev FROM project_revs WHERE project_id = ?", (project_id,)).fetchone()
+    return row[0] if row else 0
+
+
+def _keep_snapshot(project_id: str, rev: int, snap: dict) -> None:
+    """记下快照；不以较旧的读取覆盖较新的快照。"""
+    with _snap_lock:
+        cur = _snapshots.get(project_id)
+        if cur is None or cur[0] <= rev:
+            _snapshots[project_id] = (rev, snap)
+
+
+def read_meta(project_id: str) -> Optional[dict]:
+    """从各表重组项目元信息（与 meta.json 结构相同），不存在返回 None。"""
+    conn = _conn()
+    # 在同一读事务中读取各表与写入计数，快照与计数一致
+    conn.execute("BEGIN")
+    try:
+        return _read_meta(conn, project_id)
+    finally:
+        conn.commit()
+
+
+def _read_meta(conn: sqlite3.Connection, project_id: str) -> Optional[dict]:
+    prow = conn.execute("SELECT * FROM projects WHERE id = ?", (project_id,)).fetchone()
+    if prow is None:
+        return None
+    rev = _rev(conn, project_id)
+    snap = {"projects": {project_id: tuple(prow)}, "volumes": {}, "chapters": {}, "versions": {}}
+    meta = _merge(_PROJECT_COLS, prow[1:-1], prow[-1])
+
+    meta["volumes"] = []
+    for row in conn.execute("SELECT * FROM volumes WHERE project_id = ? ORDER BY idx", (project_id,)):
+        snap["volumes"][row[1]] = tuple(row)
+        vol = {"chapters": json.loads(row[3]), "summary": row[2] or ""}
+        vol.update(json.loads(row[4] or "{}"))
+        meta["volumes"].append(vol)
+
+    versions: dict[str, list] = {}
+    for row in conn.execute("SELECT * FROM versions WHERE project_id = ? ORDER BY chapter_id, position", (project_id,)):
+        snap["versions"][(row[1], row[2])] = tuple(row)
+        versions.setdefault(row[1], []).append({"id": row[2], **_merge(_VERSION_COLS, row[4:-1], row[-1])})
+
+    meta["chapters"] = []
+    for row in conn.execute("SELECT * FROM chapters WHERE project_id = ? ORDER BY position", (project_id,)):
+        snap["chapters"][row[1]] = tuple(row)
+        ch = {"id": row[1], **_merge(_CHAPTER_COLS, row[3:-1], row[-1])}
+        ch["versions"] = versions.get(row[1], [])
+        meta["chapters"].append(ch)
+
+    _keep_snapshot(project_id, rev, snap)
+    return meta
+
+
+def write_meta(project_id: str, meta: dict) -> None:
+    """
+    在一个事务中写回项目元信息，只 upsert/删除相对上次读取有变化的行；
+    没有快照或快照的写入计数与库中不符时，删除该项目的旧行后整体写入。
+    """
+    rows = _rows(project_id, meta)
+    with _snap_lock:
+        rev, old = _snapshots.get(project_id) or (None, None)
+    conn = _conn()
+    with conn:
+        # 立即取得写锁，核对计数到写入之间不会有其他写入
+        conn.execute("BEGIN IMMEDIATE")
+        cur = _rev(conn, project_id)
+        if old is None or rev != cur:
+            for sql in _DELETE_PROJECT:
+                conn.execute(sql, (project_id,))
+            old = {t: {} for t in rows}
+        for table, new_rows in rows.items():
+            old_rows = old.get(table, {})
+            changed = [r for k, r in new_rows.items() if old_rows.get(k) != r]
+            if changed:
+                conn.executemany(_UPSERT[table], changed)
+            removed = [_key_params(project_id, table, k) for k in old_rows.keys() - new_rows.keys()]
+            if removed:
+                conn.executemany(_DELETE[table], removed)
+        conn.execute(
+            "INSERT INTO project_revs VALUES (?, 1) ON CONFLICT(project_id) DO UPDATE SET rev = rev + 1",
+            (project_id,),
+        )
+    _keep_snapshot(project_id, cur + 1, rows)
+
+
+def catalog_stamp() -> int:
+    """项目目录索引的写入计数。"""
+    row = _conn().execute("SELECT rev FROM catalog_rev WHERE k = 0").fetchone()
+    return row[0] if row else 0
+
+
+def read_catalog() -> Optional[dict]:
+    """读取项目目录索引 {project_id: 摘要}，表为空返回 None。"""
+    rows = _conn().execute("SELECT id, data FROM catalog").fetchall()
+    if not rows:
+        return None
+    return {r[0]: json.loads(r[1]) for r in rows}
+
+
+def write_catalog(entries: dict, changed: Optional[str] = None) -> None:
+    """写回项目目录索引；给出 changed 时只写该项目的一行。"""
+    conn = _conn()
+    with conn:
+        if changed is not None:
+            if changed in entries:
+                conn.execute(
+                    "INSERT OR REPLACE INTO catalog VALUES (?, ?)",
+                    (changed, json.dumps(entries[changed], ensure_ascii=False)),
+                )
+            else:
+                conn.execute("DELETE FROM catalog WHERE id = ?", (changed,))
+        else:
+            conn.execute("DELETE FROM catalog")
+            conn.executemany(
+                "INSERT INTO catalog VALUES (?, ?)",
+                [(k, json.dumps(v, ensure_ascii=False)) for k, v in entries.items()],
+            )
+        conn.execute("INSERT INTO catalog_rev VALUES (0, 1) ON CONFLICT(k) DO UPDATE SET rev = rev + 1")
+
+
+def read_bytes(project_id: str, rel_path: str) -> Optional[bytes]:
+    """读取内容 blob（路径与 JSON 后端的相对文件路径一致），不存在返回 None。"""
+    row = _conn().execute("SELECT data FROM blobs WHERE project_id = ? AND path = ?", (project_id, rel_path)).fetchone()
+    return bytes(row[0]) if row else None
+
+
+def write_bytes(project_id: str, rel_path: str, data: bytes) -> None:
+    """写入内容 blob。"""
+    conn = _conn()
+    with conn:
+        conn.execute("INSERT OR REPLACE INTO blobs VALUES (?, ?, ?)", (project_id, rel_path, data))
@@ -1,50 +1,150 @@
-"""本地 JSON + 文本存储。"""
+"""本地存储：项目元信息 + 章节/版本文本。
+
+读写经由存储后端完成：默认 json_store（meta.json + 文本文件），
+config.STORAGE_BACKEND = "sqlite" 时使用 sqlite_store（WAL 模式）。
+章节正文与版本存于 blob_store（按内容哈希去重、压缩、增量编码），
+章节记录 content_hash，版本记录 hash；旧数据的 chapters/、versions/ 文本文件仍可读取。
+修改项目的函数在项目锁（locks.project_lock，跨线程与进程）内完成 meta 的读-改-写，
+多个 worker 进程同时写同一项目不会互相覆盖。
+"""
+import functools
 import json
-import os
 import uuid
 from pathlib import Path
 from typing import Any, Optional
 from datetime import datetime
 
+import blob_store
+import catalog
 import config
+import context_builder
+import entity_index
+import json_store
+import locks
+import meta_cache
+import metrics
+import retrieval
+import setting_index
+import sqlite_store
 
 # 确保目录存在
 Path(config.PROJECTS_DIR).mkdir(parents=True, exist_ok=True)
 
+_backend = metrics.InstrumentedBackend(sqlite_store if config.STORAGE_BACKEND == "sqlite" else json_store)
+_meta_cache = meta_cache.MetaCache(config.META_CACHE_MAX_BYTES)
+_catalog = catalog.Catalog(_backend, lambda project_id: get_project(project_id))
 
-def _project_path(project_id: str) -> Path:
-    return Path(config.PROJECTS_DIR) / project_id
 
+class ChapterIndex:
+    """
+    meta["chapters"] 的索引：章节 id → 下标，(volume_idx, chapter_idx) → 下标
+    （同一位置多次生成时指向最新一章）。只存下标，因此对 meta 的副本同样适用。
+    """
 
-def _ensure_project(project_id: str) -> Path:
-    p = _project_path(project_id)
-    p.mkdir(parents=True, exist_ok=True)
-    return p
+    def __init__(self, chapters: list[dict]):
+        self.by_id: dict[str, int] = {}
+        self.by_pos: dict[tuple[int, int], int] = {}
+        for i, ch in enumerate(chapters):
+            self.add(ch, i)
+
+    def copy(self) -> "ChapterIndex":
+        new = ChapterIndex([])
+        new.by_id = dict(self.by_id)
+        new.by_pos = dict(self.by_pos)
+        return new
+
+    def add(self, chapter: dict, i: int) -> None:
+        self.by_id[chapter["id"]] = i
+        self.by_pos[(chapter.get("volume_idx", 0), chapter.get("chapter_idx", 0))] = i
+
+    def get(self, chapters: list[dict], chapter_id: str) -> Optional[dict]:
+        i = self.by_id.get(chapter_id)
+        if i is not None and i < len(chapters) and chapters[i]["id"] == chapter_id:
+            return chapters[i]
+        return None
 
+    def find(self, chapters: list[dict], volume_idx: int, chapter_idx: int) -> Optional[dict]:
+        i = self.by_pos.get((volume_idx, chapter_idx))
+        if i is not None and i < len(chapters):
+            return chapters[i]
+        return None
+
+
+def _indexed(project_id: str) -> tuple[Optional[dict], Optional[ChapterIndex]]:
+    """取 meta（只读）及其章节索引；索引随缓存项保存，只在 meta 重新载入时重建。"""
+    meta = get_project(project_id)
+    if not meta:
+        return None, None
+    index = _meta_cache.get_index(project_id, meta)
+    if index is None:
+        index = ChapterIndex(meta.get("chapters", []))
+        _meta_cache.set_index(project_id, meta, index)
+    return meta, index
+
+
+def _exclusive(fn):
+    """fn(project_id, ...) 在该项目的锁内执行。"""
+    @functools.wraps(fn)
+    def wrapper(project_id: str, *args, **kwargs):
+        with locks.project_lock(project_id):
+            return fn(project_id, *args, **kwargs)
+    return wrapper
+
+
+def _load_for_update(project_id: str) -> tuple[Optional[dict], Optional[ChapterIndex]]:
+    """
+    取一份可修改的 meta 副本（不影响缓存中的共享对象）及其章节索引。调用方应持有项目锁（见 _exclusive）。
+    索引与缓存共享、只读：要增加章节时先 copy()，改好的副本随 _save_meta 装入缓存。
+    """
+    meta, index = _indexed(project_id)
+    if not meta:
+        return None, None
+    return meta_cache.clone(meta), index
+
+
+def _save_meta(project_id: str, meta: dict, index: Optional[ChapterIndex] = None) -> None:
+    """
+    写回 meta 并写穿缓存（章节列表未重排时可沿用索引）与项目目录；写入后调用方不应再修改 meta。
+    每次写入 meta["rev"] 加一（调用方持有项目锁，因此单调递增），供接口生成 ETag。
+    """
+    meta["rev"] = meta.get("rev", 0) + 1
+    _backend.write_meta(project_id, meta)
+    _meta_cache.put(project_id, _backend.meta_stamp(project_id), meta, index)
+    _catalog.update(project_id, meta)
+
+
+def cache_stats() -> dict:
+    """元信息缓存的命中/未命中计数与占用。"""
+    return _meta_cache.stats()
+
+
+def _read_text(project_id: str, rel_path: str) -> Optional[str]:
+    data = _backend.read_bytes(project_id, rel_path)
+    if data is None:
+        return None
+    return data.decode("utf-8").replace("\r\n", "\n")
+
+
+def _write_text(project_id: str, rel_path: str, content: str) -> None:
+    _backend.write_bytes(project_id, rel_path, content.encode("utf-8"))
+
+
+def list_projects(offset: int = 0, limit: Optional[int] = None, sort: str = "updated_at", order: str = "desc") -> dict:
+    """
+    分页列出项目摘要（id、名称、时间、卷数、章数、字数），来自项目目录索引，不读取各项目 meta。
+    返回 {"items", "total", "offset", "limit"}；sort / order 不合法时抛 ValueError。
+    """
+    return _catalog.query(offset, limit, sort, order)
 
-def list_projects() -> list[dict]:
-    """列出所有项目。"""
-    base = Path(config.PROJECTS_DIR)
-    if not base.exists():
-        return []
-    out = []
-    for d in base.iterdir():
-        if d.is_dir():
-            meta_path = d / "meta.json"
-            if meta_path.exists():
-                try:
-                    with open(meta_path, "r", encoding="utf-8") as f:
-                        meta = json.load(f)
-                    out.append({"id": d.name, **meta})
-                except Exception:
-                    pass
-    return out
+
+def list_project_ids() -> list[str]:
+    """列出所有项目 id。"""
+    return _backend.list_project_ids()
 
 
 def create_project(name: str, world_setting: str = "", background_setting: str = "", character_setting: str = "", outline: str = "") -> str:
     """创建新项目，返回 project_id。"""
     project_id = str(uuid.uuid4())[:8]
-    base = _ensure_project(project_id)
     meta = {
         "name": name,
         "created_at": datetime.now().isoformat(),
@@ -56,39 +156,72 @@ def create_project(name: str, world_setting: str = "", background_setting: str =
         "volumes": [],
         "chapters": [],
     }
-    with open(base / "meta.json", "w", encoding="utf-8") as f:
-        json.dump(meta, f, ensure_ascii=False, indent=2)
+    _save_meta(project_id, meta)
+    setting_index.index_settings(_backend, project_id, meta)
     return project_id
 
 
 def get_project(project_id: str) -> Optional[dict]:
-    """获取项目元信息。"""
-    base = _project_path(project_id)
-    meta_path = base / "meta.json"
-    if not meta_path.exists():
+    """
+    获取项目元信息。优先返回缓存（后端版本戳不变时不重新解析）。
+    返回的 dict 与缓存共享，只读；需要修改时用 _load_for_update 取副本。
+    """
+    stamp = _backend.meta_stamp(project_id)
+    if stamp is None:
+        _meta_cache.invalidate(project_id)
         return None
-    with open(meta_path, "r", encoding="utf-8") as f:
-        return json.load(f)
+    meta = _meta_cache.get(project_id, stamp)
+    if meta is None:
+        meta = _backend.read_meta(project_id)
+        if meta is None:
+            return None
+        _meta_cache.put(project_id, stamp, meta)
+    return meta
 
 
 def update_project(project_id: str, **kwargs) -> bool:
-    """更新项目字段。"""
-    meta = get_project(project_id)
-    if not meta:
+    """更新项目字段。人物设定改动时随即按新名单重建人物出场索引（在项目锁外，不阻塞其他写入）。"""
+    changed = _update_project(project_id, **kwargs)
+    if changed is None:
         return False
-    meta.update(kwargs)
-    meta["updated_at"] = datetime.now().isoformat()
-    base = _project_path(project_id)
-    with open(base / "meta.json", "w", encoding="utf-8") as f:
-        json.dump(meta, f, ensure_ascii=False, indent=2)
+    if "character_setting" in changed:
+        meta, chapters = book_chapters(project_id)
+        if meta is not None:
+            entity_index.rebuild(
+                _backend, project_id, chapters, meta.get("character_setting", ""),
+                lambda cid: get_chapter_content(project_id, cid),
+            )
     return True
 
 
-def add_chapter(project_id: str, volume_idx: int, chapter_idx: int, direction: str, content: str = "", summary: str = "") -> str:
-    """添加章节，返回 chapter_id。"""
-    base = _ensure_project(project_id)
+@_exclusive
+def _update_project(project_id: str, **kwargs) -> Optional[list[str]]:
+    """写入字段并重建改动的长设定索引，返回改动的设定字段；项目不存在时返回 None。"""
+    meta, index = _load_for_update(project_id)
+    if not meta:
+        return None
+    changed = [k for k in setting_index.FIELDS if k in kwargs and kwargs[k] != meta.get(k)]
+    meta.update(kwargs)
+    meta["updated_at"] = datetime.now().isoformat()
+    _save_meta(project_id, meta, index if "chapters" not in kwargs else None)
+    if changed:
+        setting_index.index_settings(_backend, project_id, meta, changed)
+    return changed
+
+
+@_exclusive
+def add_chapter(
+    project_id: str,
+    volume_idx: int,
+    chapter_idx: int,
+    direction: str,
+    content: str = "",
+    summary: str = "",
+    summary_status: str = "done",
+) -> str:
+    """添加章节，返回 chapter_id。summary_status 为 "pending" 表示摘要将由后台队列补上。"""
     chapter_id = str(uuid.uuid4())[:8]
-    meta = get_project(project_id)
+    meta, index = _load_for_update(project_id)
     if not meta:
         raise ValueError("项目不存在")
 
@@ -98,7 +231,9 @@ def add_chapter(project_id: str, volume_idx: int, chapter_idx: int, direction: s
         "chapter_idx": chapter_idx,
         "direction": direction,
         "summary": summary,
+        "summary_status": summary_status,
         "created_at": datetime.now().isoformat(),
+        "char_count": len(content),
         "versions": [],
     }
 
@@ -106,157 +241,593 @@ def add_chapter(project_id: str, volume_idx: int, chapter_idx: int, direction: s
     while len(meta.get("volumes", [])) <= volume_idx:
         meta["volumes"].append({"chapters": [], "summary": ""})
     meta["volumes"][volume_idx]["chapters"].append(chapter_id)
+    if summary:
+        _mark_volume_dirty(meta, chapter_info)
 
     if "chapters" not in meta:
         meta["chapters"] = []
     meta["chapters"].append(chapter_info)
+    # 在副本上登记新章，写入成功前缓存中的索引仍与缓存中的 meta 一致
+    index = index.copy()
+    index.add(chapter_info, len(meta["chapters"]) - 1)
     meta["updated_at"] = datetime.now().isoformat()
 
-    # 写入章节内容
-    (base / "chapters").mkdir(exist_ok=True)
-    content_path = base / "chapters" / f"{chapter_id}.txt"
-    with open(content_path, "w", encoding="utf-8") as f:
-        f.write(content)
+    # 写入章节内容与初始版本（同一内容只存一份），meta 只写一次
+    chapter_info["content_hash"] = blob_store.put(_backend, project_id, content)
+    _append_version(project_id, chapter_info, content, "初始生成")
+    _save_meta(project_id, meta, index)
+    retrieval.index_chapter(_backend, project_id, chapter_info, content, meta["chapters"], lambda cid: get_chapter_content(project_id, cid))
+    entity_index.index_chapter(_backend, project_id, chapter_info, content, meta.get("character_setting", ""))
 
-    # 先保存 meta，再添加版本（add_version 会读取 meta）
-    with open(base / "meta.json", "w", encoding="utf-8") as f:
-        json.dump(meta, f, ensure_ascii=False, indent=2)
+    return chapter_id
 
-    add_version(project_id, chapter_id, content, "初始生成")
 
-    return chapter_id
+def _append_version(project_id: str, chapter: dict, content: str, note: str) -> str:
+    """写入版本内容（相对上一版本增量存储）并在 chapter["versions"] 中登记（不写 meta），返回 version_id。"""
+    version_id = str(uuid.uuid4())[:8]
+    chapter.setdefault("versions", [])
+    h = blob_store.put(_backend, project_id, content, _latest_hash(chapter))
+    chapter["versions"].append({
+        "id": version_id,
+        "note": note,
+        "created_at": datetime.now().isoformat(),
+        "hash": h,
+    })
+    return version_id
 
 
+def _latest_hash(chapter: dict) -> Optional[str]:
+    """章节最近一个已入 blob 的版本哈希（无则用当前正文哈希），作为增量编码的基准。"""
+    for v in reversed(chapter.get("versions", [])):
+        if v.get("hash"):
+            return v["hash"]
+    return chapter.get("content_hash")
+
+
+@_exclusive
 def add_version(project_id: str, chapter_id: str, content: str, note: str = "") -> str:
     """为章节添加版本。"""
-    base = _project_path(project_id)
-    version_id = str(uuid.uuid4())[:8]
-    versions_dir = base / "versions"
-    versions_dir.mkdir(exist_ok=True)
-    v_path = versions_dir / f"{chapter_id}_{version_id}.txt"
-    with open(v_path, "w", encoding="utf-8") as f:
-        f.write(content)
+    meta, index = _load_for_update(project_id)
+    if not meta:
+        return str(uuid.uuid4())[:8]
+    ch = index.get(meta.get("chapters", []), chapter_id)
+    if ch is None:
+        # 章节不存在时仍保存内容（与旧行为一致），但不登记到 meta
+        return _append_version(project_id, {"id": chapter_id}, content, note)
+    version_id = _append_version(project_id, ch, content, note)
+    meta["updated_at"] = datetime.now().isoformat()
+    _save_meta(project_id, meta, index)
+    return version_id
+
+
+CHAPTER_FIELDS = ("id", "volume_idx", "chapter_idx", "summary_status", "char_count", "version_count", "created_at")
+DEFAULT_CHAPTER_FIELDS = ("id", "volume_idx", "chapter_idx", "summary_status")
+
+
+def _chapter_field(chapter: dict, field: str) -> Any:
+    if field == "version_count":
+        return len(chapter.get("versions", []))
+    if field == "summary_status":
+        return chapter.get("summary_status", "done")
+    return chapter.get(field)
 
+
+def list_chapters(
+    project_id: str,
+    offset: int = 0,
+    limit: Optional[int] = None,
+    fields: Optional[list[str]] = None,
+    volume_idx: Optional[int] = None,
+) -> Optional[dict]:
+    """
+    分页列出章节（meta 中的顺序），每项只含 fields 所列字段（取自 CHAPTER_FIELDS，缺省为 DEFAULT_CHAPTER_FIELDS），
+    不含走向、摘要与版本列表；volume_idx 限定某一卷。
+    返回 {"items", "total", "offset", "limit", "rev"}（rev 为 meta 写入计数），项目不存在时返回 None；字段不合法时抛 ValueError。
+    """
+    fields = tuple(fields or DEFAULT_CHAPTER_FIELDS)
+    bad = [f for f in fields if f not in CHAPTER_FIELDS]
+    if bad:
+        raise ValueError(f"不支持的章节字段：{bad[0]}")
     meta = get_project(project_id)
     if not meta:
-        return version_id
-    for ch in meta.get("chapters", []):
-        if ch["id"] == chapter_id:
-            ch.setdefault("versions", [])
-            ch["versions"].append({
-                "id": version_id,
-                "note": note,
-                "created_at": datetime.now().isoformat(),
-            })
-            break
-    update_project(project_id, **meta)
-    return version_id
+        return None
+    chapters = meta.get("chapters", [])
+    if volume_idx is not None:
+        chapters = [c for c in chapters if c.get("volume_idx", 0) == volume_idx]
+    offset = max(0, offset)
+    page = chapters[offset:offset + limit] if limit is not None else chapters[offset:]
+    items = [{f: _chapter_field(c, f) for f in fields} for c in page]
+    return {"items": items, "total": len(chapters), "offset": offset, "limit": limit, "rev": meta.get("rev", 0)}
+
+
+def get_chapter(project_id: str, chapter_id: str) -> Optional[dict]:
+    """按 id 取章节元信息（只读），O(1)。"""
+    meta, index = _indexed(project_id)
+    if not meta:
+        return None
+    return index.get(meta.get("chapters", []), chapter_id)
+
+
+def find_chapter(project_id: str, volume_idx: int, chapter_idx: int) -> Optional[dict]:
+    """按 (卷, 章) 取章节元信息（只读），同一位置有多章时取最新一章，O(1)。"""
+    meta, index = _indexed(project_id)
+    if not meta:
+        return None
+    return index.find(meta.get("chapters", []), volume_idx, chapter_idx)
 
 
 def get_chapter_content(project_id: str, chapter_id: str) -> str:
     """获取章节当前内容。"""
-    base = _project_path(project_id)
-    p = base / "chapters" / f"{chapter_id}.txt"
-    if not p.exists():
-        return ""
-    with open(p, "r", encoding="utf-8") as f:
-        return f.read()
+    return read_chapter_content(project_id, get_chapter(project_id, chapter_id) or {"id": chapter_id})
 
 
+def read_chapter_content(project_id: str, chapter: dict) -> str:
+    """按已取得的章节记录读取正文（不再查 meta），用于逐章遍历。"""
+    if chapter.get("content_hash"):
+        content = blob_store.get(_backend, project_id, chapter["content_hash"])
+        if content is not None:
+            return content
+    return _read_text(project_id, f"chapters/{chapter['id']}.txt") or ""
+
+
+def book_chapters(project_id: str) -> tuple[Optional[dict], list[dict]]:
+    """
+    全书阅读顺序的章节（只读）：按卷序、章序，同一位置多次生成时取最新一章。
+    返回 (meta, 章节列表)，项目不存在时为 (None, [])。
+    """
+    meta, index = _indexed(project_id)
+    if not meta:
+        return None, []
+    chapters = meta.get("chapters", [])
+    out = []
+    for vol in meta.get("volumes", []):
+        latest = {}
+        for cid in vol.get("chapters", []):
+            ch = index.get(chapters, cid)
+            if ch is not None:
+                latest[ch.get("chapter_idx", 0)] = ch
+        out.extend(latest[k] for k in sorted(latest))
+    return meta, out
+
+
+@_exclusive
 def set_chapter_content(project_id: str, chapter_id: str, content: str) -> None:
     """设置章节当前内容。"""
-    base = _project_path(project_id)
-    (base / "chapters").mkdir(exist_ok=True)
-    with open(base / "chapters" / f"{chapter_id}.txt", "w", encoding="utf-8") as f:
-        f.write(content)
+    meta, index = _load_for_update(project_id)
+    ch = index.get(meta.get("chapters", []), chapter_id) if meta else None
+    if ch is None:
+        _write_text(project_id, f"chapters/{chapter_id}.txt", content)
+        return
+    base = ch.get("content_hash") or _latest_hash(ch)
+    ch["content_hash"] = blob_store.put(_backend, project_id, content, base)
+    ch["char_count"] = len(content)
+    meta["updated_at"] = datetime.now().isoformat()
+    _save_meta(project_id, meta, index)
+    retrieval.index_chapter(_backend, project_id, ch, content, meta["chapters"], lambda cid: get_chapter_content(project_id, cid))
+    entity_index.index_chapter(_backend, project_id, ch, content, meta.get("character_setting", ""))
 
 
 def get_version_content(project_id: str, chapter_id: str, version_id: str) -> str:
     """获取指定版本内容。"""
-    base = _project_path(project_id)
-    p = base / "versions" / f"{chapter_id}_{version_id}.txt"
-    if not p.exists():
-        return ""
-    with open(p, "r", encoding="utf-8") as f:
-        return f.read()
+    ch = get_chapter(project_id, chapter_id)
+    v = next((v for v in ch.get("versions", []) if v["id"] == version_id), None) if ch else None
+    if v and v.get("hash"):
+        content = blob_store.get(_backend, project_id, v["hash"])
+        if content is not None:
+            return content
+    return _read_text(project_id, f"versions/{chapter_id}_{version_id}.txt") or ""
 
 
+@_exclusive
 def update_chapter_summary(project_id: str, chapter_id: str, summary: str) -> None:
-    """更新章节摘要。"""
-    meta = get_project(project_id)
+    """更新章节摘要，并将摘要状态置为 done。"""
+    meta, index = _load_for_update(project_id)
     if not meta:
         return
-    for ch in meta.get("chapters", []):
-        if ch["id"] == chapter_id:
-            ch["summary"] = summary
-            break
+    ch = index.get(meta.get("chapters", []), chapter_id)
+    changed = ch is not None and ch.get("summary") != summary
+    if ch is not None:
+        if changed:
+            _mark_volume_dirty(meta, ch)
+        ch["summary"] = summary
+        ch["summary_status"] = "done"
     meta["updated_at"] = datetime.now().isoformat()
-    base = _project_path(project_id)
-    with open(base / "meta.json", "w", encoding="utf-8") as f:
-        json.dump(meta, f, ensure_ascii=False, indent=2)
+    _save_meta(project_id, meta, index)
+    if changed:
+        retrieval.index_summary(_backend, project_id, ch, meta["chapters"], lambda cid: get_chapter_content(project_id, cid))
 
 
-def update_volume_summary(project_id: str, volume_idx: int, summary: str) -> None:
-    """更新卷摘要。"""
-    meta = get_project(project_id)
+@_exclusive
+def set_chapter_summary_status(project_id: str, chapter_id: str, status: str) -> None:
+    """设置章节摘要状态：pending（排队/生成中）、done、error。"""
+    meta, index = _load_for_update(project_id)
+    if not meta:
+        return
+    ch = index.get(meta.get("chapters", []), chapter_id)
+    if ch is not None:
+        ch["summary_status"] = status
+    _save_meta(project_id, meta, index)
+
+
+@_exclusive
+def update_volume_summary(project_id: str, volume_idx: int, summary: str, folded_chapters: Optional[list[str]] = None) -> None:
+    """
+    更新卷摘要。folded_chapters 为本次已并入卷摘要的章节 id：
+    从 dirty_chapters 中移除并记入 summarized_chapters（期间新变脏的章节保持 dirty）。
+    """
+    meta, index = _load_for_update(project_id)
     if not meta:
         return
     vols = meta.get("volumes", [])
     while len(vols) <= volume_idx:
         vols.append({"chapters": [], "summary": ""})
-    vols[volume_idx]["summary"] = summary
+    vol = vols[volume_idx]
+    if vol.get("summary") != summary:
+        _mark_arc_dirty(meta, volume_idx)
+    vol["summary"] = summary
+    if folded_chapters is not None:
+        folded = set(folded_chapters)
+        vol["dirty_chapters"] = [cid for cid in vol.get("dirty_chapters", []) if cid not in folded]
+        done = vol.setdefault("summarized_chapters", [])
+        done.extend(cid for cid in folded_chapters if cid not in done)
     meta["volumes"] = vols
     meta["updated_at"] = datetime.now().isoformat()
-    base = _project_path(project_id)
-    with open(base / "meta.json", "w", encoding="utf-8") as f:
-        json.dump(meta, f, ensure_ascii=False, indent=2)
+    _save_meta(project_id, meta, index)
+
+
+def arc_of(volume_idx: int) -> int:
+    """卷所属的篇章序号：每 config.SUMMARY_ARC_VOLUMES 卷一个篇章。"""
+    return volume_idx // config.SUMMARY_ARC_VOLUMES
+
+
+def _mark_arc_dirty(meta: dict, volume_idx: int) -> None:
+    """卷摘要有变化：所在篇章的摘要待重建（只标记已有的篇章摘要）。"""
+    arcs = meta.get("arcs", [])
+    a = arc_of(volume_idx)
+    if a < len(arcs) and arcs[a].get("summary"):
+        arcs[a]["dirty"] = True
 
 
-def get_rag_context(project_id: str, current_volume_idx: int) -> str:
+@_exclusive
+def update_arc_summary(project_id: str, arc_idx: int, summary: str) -> None:
+    """更新篇章摘要并清除 dirty；该篇章已并入全书梗概时，梗概标记为待重建。"""
+    meta, index = _load_for_update(project_id)
+    if not meta:
+        return
+    arcs = meta.setdefault("arcs", [])
+    while len(arcs) <= arc_idx:
+        arcs.append({"summary": ""})
+    arcs[arc_idx] = {"summary": summary, "dirty": False}
+    synopsis = meta.get("synopsis")
+    if synopsis and arc_idx < synopsis.get("arcs", 0):
+        synopsis["dirty"] = True
+    meta["updated_at"] = datetime.now().isoformat()
+    _save_meta(project_id, meta, index)
+
+
+@_exclusive
+def update_synopsis(project_id: str, summary: str, arcs: int) -> None:
+    """更新全书梗概，arcs 为其覆盖的篇章数（篇章 0 ~ arcs-1）。"""
+    meta, index = _load_for_update(project_id)
+    if not meta:
+        return
+    meta["synopsis"] = {"summary": summary, "arcs": arcs, "dirty": False}
+    meta["updated_at"] = datetime.now().isoformat()
+    _save_meta(project_id, meta, index)
+
+
+def _mark_volume_dirty(meta: dict, chapter: dict) -> None:
+    """章摘要有变化：记入所在卷的 dirty_chapters，等待并入卷摘要。"""
+    vols = meta.get("volumes", [])
+    vi = chapter.get("volume_idx", 0)
+    if vi < len(vols):
+        dirty = vols[vi].setdefault("dirty_chapters", [])
+        if chapter["id"] not in dirty:
+            dirty.append(chapter["id"])
+
+
+_USAGE_PATH = "usage.json"
+
+
+@_exclusive
+def add_token_usage(project_id: str, calls: dict[tuple[str, str], dict[str, int]]) -> None:
     """
-    构建 RAG 上下文，读取逻辑（当前卷为 n = current_volume_idx）：
-    - 卷 0 ~ n-2：只读卷摘要
-    - 卷 n-1：读该卷所有章摘要
-    - 卷 n（当前卷）：读该卷已有的所有章摘要
+    累计项目的模型 token 用量（按模型、按阶段），存于项目的 usage.json。
+    calls 为一批调用按 (模型, 阶段) 的合计 {calls, input, output, reasoning}（见 metrics.take_usage）。
+    """
+    raw = _backend.read_bytes(project_id, _USAGE_PATH)
+    usage = json.loads(raw) if raw else {"by_model": {}, "by_stage": {}}
+    for (model, stage), counts in calls.items():
+        for group, key in (("by_model", model), ("by_stage", stage)):
+            acc = usage.setdefault(group, {}).setdefault(key, {"calls": 0})
+            for kind, n in counts.items():
+                acc[kind] = acc.get(kind, 0) + n
+    usage["updated_at"] = datetime.now().isoformat()
+    _backend.write_bytes(project_id, _USAGE_PATH, json.dumps(usage, ensure_ascii=False).encode("utf-8"))
+
+
+def get_token_usage(project_id: str) -> dict:
+    """项目累计的模型 token 用量：{"by_model": {模型: {calls, input, output, reasoning}}, "by_stage": {...}}。"""
+    raw = _backend.read_bytes(project_id, _USAGE_PATH)
+    return json.loads(raw) if raw else {"by_model": {}, "by_stage": {}}
+
+
+def search_passages(project_id: str, query: str, k: Optional[int] = None, skip=lambda cid, p: False) -> list[dict]:
+    """按 query 在本项目章节摘要、走向与正文片段中做 BM25 检索，返回前 k 个片段（见 retrieval.search）。"""
+    meta = get_project(project_id)
+    if not meta:
+        return []
+    return retrieval.search(
+        _backend, project_id, meta.get("chapters", []), query,
+        k or config.RETRIEVAL_TOP_K,
+        lambda cid: get_chapter_content(project_id, cid),
+        skip,
+    )
+
+
+SEARCH_SORTS = ("score", "position")
+
+
+def search_chapters(
+    project_id: str,
+    query: str,
+    kinds: Optional[list[str]] = None,
+    sort: str = "score",
+    order: str = "desc",
+    offset: int = 0,
+    limit: Optional[int] = None,
+) -> dict:
     """
+    全文查找本项目的章节正文、摘要与走向（kinds 限定其中几类）：query 按空白分词，须全部逐字出现。
+    sort="score" 按相关度，"position" 按卷、章与命中位置（order="desc" 时最近出现的在前）。
+    返回 {"items", "total", "offset", "limit"}，各项见 retrieval.ProjectIndex.find；参数不合法时抛 ValueError。
+    """
+    if sort not in SEARCH_SORTS:
+        raise ValueError(f"不支持的排序字段：{sort}")
+    if order not in ("asc", "desc"):
+        raise ValueError(f"不支持的排序方向：{order}")
+    kinds = tuple(kinds or ("summary", "direction", "content"))
+    bad = [k for k in kinds if k not in ("summary", "direction", "content")]
+    if bad:
+        raise ValueError(f"不支持的查找范围：{bad[0]}")
     meta = get_project(project_id)
     if not meta:
-        return ""
+        return {"items": [], "total": 0, "offset": offset, "limit": limit}
+    hits = retrieval.find(
+        _backend, project_id, meta.get("chapters", []), query,
+        lambda cid: get_chapter_content(project_id, cid),
+        kinds, config.SEARCH_SNIPPET_CHARS,
+    )
+    # 先按位置排，按得分排序时同分者保持位置顺序
+    hits.sort(key=lambda h: (h["volume_idx"], h["chapter_idx"], h["kind"] == "content", h["offset"]), reverse=order == "desc")
+    if sort == "score":
+        hits.sort(key=lambda h: h["score"], reverse=order == "desc")
+    offset = max(0, offset)
+    page = hits[offset:offset + limit] if limit is not None else hits[offset:]
+    return {"items": page, "total": len(hits), "offset": offset, "limit": limit}
+
+
+def list_entities(project_id: str) -> Optional[list[dict]]:
+    """人物设定中各人物的出场概况（按阅读顺序的章节统计，见 entity_index.entities）；项目不存在时返回 None。"""
+    meta, chapters = book_chapters(project_id)
+    if meta is None:
+        return None
+    return entity_index.entities(
+        _backend, project_id, chapters, meta.get("character_setting", ""),
+        lambda cid: get_chapter_content(project_id, cid),
+    )
 
-    parts = []
-    if meta.get("world_setting"):
-        parts.append("【世界设定】\n" + meta["world_setting"])
-    if meta.get("background_setting"):
-        parts.append("【背景设定】\n" + meta["background_setting"])
-    if meta.get("character_setting"):
-        parts.append("【人物设定】\n" + meta["character_setting"])
-    if meta.get("outline"):
-        parts.append("【整体大纲】\n" + meta["outline"])
 
+def entity_appearances(project_id: str, name: str) -> Optional[list[dict]]:
+    """某人物（可用别名）按阅读顺序出场的章节及各章出现次数、首末偏移；项目不存在或名单中没有该人物时返回 None。"""
+    meta, chapters = book_chapters(project_id)
+    if meta is None:
+        return None
+    return entity_index.appearances(
+        _backend, project_id, chapters, meta.get("character_setting", ""),
+        lambda cid: get_chapter_content(project_id, cid), name,
+    )
+
+
+def get_rag_sections(project_id: str, current_volume_idx: int, query: str = "") -> list[context_builder.Section]:
+    """
+    RAG 上下文的各段，读取逻辑（当前卷为 n = current_volume_idx）：
+    - 卷 0 ~ n-2：只读摘要，按层级由粗到细（全书梗概 / 篇章摘要 / 卷摘要，见 _history_sections）
+    - 卷 n-1：读该卷所有章摘要（预算不足时改用该卷卷摘要）
+    - 卷 n（当前卷）：读该卷已有的所有章摘要
+    - 给出 query（通常是用户指定的走向）时，附上检索到的相关片段（不重复上面已有的章摘要），
+      以及 query 中提到的人物在卷 n-1 之前最近 ENTITY_RECENT_CHAPTERS 次出场的章摘要（见 _entity_sections）
+    设定各段为 static（提示词前缀），在预算的 CONTEXT_STATIC_SHARE 内按 人物设定 > 大纲 > 世界/背景设定 取舍；
+    长设定（setting_index.is_long）在前缀中只放纲要，与走向及最近章摘要相关的小节另作一段（同样的优先级）放在前缀之后；
+    其余按 当前卷近章 > 上一卷章摘要 > 人物最近出场 > 相关片段 > 更早的梗概/篇章/卷摘要。
+    """
+    meta, index = _indexed(project_id)
+    if not meta:
+        return []
+    Section = context_builder.Section
     vols = meta.get("volumes", [])
     chapters = meta.get("chapters", [])
 
-    # 卷 0 ~ n-2：只读卷摘要（vi = 0, 1, ..., n-2）
-    for vi in range(max(0, current_volume_idx - 1)):
-        if vi < len(vols) and vols[vi].get("summary"):
-            parts.append(f"【第{vi + 1}卷摘要】\n{vols[vi]['summary']}")
-
-    # 卷 n-1：读该卷所有章摘要
+    parts = []
+    settings = [
+        ("world_setting", 3),
+        ("background_setting", 3),
+        ("character_setting", 1),
+        ("outline", 2),
+    ]
+    setting_query = None
+    for order, (key, priority) in enumerate(settings):
+        text, title = meta.get(key), setting_index.FIELDS[key]
+        if not text:
+            continue
+        if not setting_index.is_long(text):
+            parts.append(Section(title, f"【{title}】\n{text}", priority, order, trimmable=True, static=True))
+            continue
+        if setting_query is None:
+            setting_query = _setting_query(chapters, current_volume_idx, query)
+        sidx = setting_index.load(_backend, project_id, key, text)
+        parts.append(Section(f"{title}纲要", f"【{title}·纲要】\n{sidx['digest']}", priority, order, trimmable=True, static=True))
+        picked = setting_index.select(sidx, setting_query, config.SETTING_SELECT_CHARS)
+        if picked:
+            parts.append(Section(f"{title}（相关部分）", f"【{title}·相关部分】\n{setting_index.render(picked)}",
+                                 priority, 5 + order, trimmable=True))
+
+    def chapter_text(vi: int, ch: dict) -> str:
+        s = ch.get("summary") or ch.get("direction", "")
+        return f"【第{vi + 1}卷 第{ch.get('chapter_idx', 0) + 1}章】\n{s}" if s else ""
+
+    # 卷 0 ~ n-2：按摘要层级由粗到细，越近越优先
+    parts.extend(_history_sections(meta, current_volume_idx))
+
+    # 卷 n-1：读该卷所有章摘要，作为一段；放不下时改用卷摘要
     if current_volume_idx >= 1 and current_volume_idx - 1 < len(vols):
-        prev_ch_ids = vols[current_volume_idx - 1].get("chapters", [])
-        for ch in chapters:
-            if ch["id"] in prev_ch_ids:
-                s = ch.get("summary") or ch.get("direction", "")
-                if s:
-                    parts.append(f"【第{current_volume_idx}卷 第{ch.get('chapter_idx', 0) + 1}章】\n{s}")
-
-    # 卷 n（当前卷）：读该卷已有的所有章摘要
+        vi = current_volume_idx - 1
+        texts = [chapter_text(vi, ch) for ch in (index.get(chapters, cid) for cid in vols[vi].get("chapters", [])) if ch]
+        texts = [t for t in texts if t]
+        if texts:
+            fb = None
+            if vols[vi].get("summary"):
+                fb = Section(f"第{vi + 1}卷摘要", f"【第{vi + 1}卷摘要】\n{vols[vi]['summary']}", 4, 0)
+            parts.append(Section(f"第{vi + 1}卷章摘要", "\n\n".join(texts), 4, 10000, fallback=fb))
+
+    # 卷 n（当前卷）：读该卷已有的所有章摘要，越近越优先
     if current_volume_idx < len(vols):
-        curr_ch_ids = vols[current_volume_idx].get("chapters", [])
-        for ch in chapters:
-            if ch["id"] in curr_ch_ids:
-                s = ch.get("summary") or ch.get("direction", "")
-                if s:
-                    parts.append(f"【第{current_volume_idx + 1}卷 第{ch.get('chapter_idx', 0) + 1}章】\n{s}")
-
-    return "\n\n".join(parts)
+        for pos, cid in enumerate(vols[current_volume_idx].get("chapters", [])):
+            ch = index.get(chapters, cid)
+            t = chapter_text(current_volume_idx, ch) if ch else ""
+            if t:
+                label = f"第{current_volume_idx + 1}卷 第{ch.get('chapter_idx', 0) + 1}章"
+                parts.append(Section(label, t, 0, 20000 + pos, rank=-pos))
+
+    if query:
+        parts.extend(_entity_sections(project_id, meta, current_volume_idx, query))
+        recent = {ch["id"] for ch in chapters if ch.get("volume_idx", 0) in (current_volume_idx - 1, current_volume_idx)}
+        hits = search_passages(project_id, query, skip=lambda cid, p: cid in recent and p["kind"] != "content")
+        if hits:
+            kinds = {"summary": "摘要", "direction": "走向", "content": "正文"}
+            parts.append(Section("相关片段", "【相关片段】\n" + "\n".join(
+                f"（第{h['volume_idx'] + 1}卷 第{h['chapter_idx'] + 1}章 · {kinds[h['kind']]}）{h['text']}" for h in hits
+            ), 5, 30000, trimmable=True))
+
+    return parts
+
+
+def _entity_chapters(project_id: str, meta: dict, current_volume_idx: int, query: str) -> list[tuple[str, list[dict]]]:
+    """
+    query 中提到的人物，及其在卷 n-1 之前（卷 n-1、n 的章摘要已在上下文中）最近出场、
+    有章摘要或章摘要仍在队列中的至多 ENTITY_RECENT_CHAPTERS 章（按阅读顺序）。
+    """
+    cs = meta.get("character_setting", "")
+    names = entity_index.roster(cs).mentioned(query)
+    if not names:
+        return []
+    _, chapters = book_chapters(project_id)
+    by_id = {ch["id"]: ch for ch in chapters}
+    seen = entity_index.appearances_many(
+        _backend, project_id, chapters, cs, lambda cid: get_chapter_content(project_id, cid), names,
+    )
+    out = []
+    for name in names:
+        picked = []
+        for a in reversed(seen.get(name, [])):
+            if a["volume_idx"] >= current_volume_idx - 1:
+                continue
+            ch = by_id[a["chapter_id"]]
+            if ch.get("summary") or ch.get("summary_status") == "pending":
+                picked.append(ch)
+                if len(picked) >= config.ENTITY_RECENT_CHAPTERS:
+                    break
+        out.append((name, picked[::-1]))
+    return out
+
+
+def _entity_sections(project_id: str, meta: dict, current_volume_idx: int, query: str) -> list[context_builder.Section]:
+    """query 中提到的每个人物一段：最近出场各章（见 _entity_chapters）的章摘要，久未出场的人物回归时也能接上前情。"""
+    parts = []
+    for i, (name, chs) in enumerate(_entity_chapters(project_id, meta, current_volume_idx, query)):
+        picked = [f"（第{ch.get('volume_idx', 0) + 1}卷 第{ch.get('chapter_idx', 0) + 1}章）{ch['summary']}"
+                  for ch in chs if ch.get("summary")]
+        if picked:
+            parts.append(context_builder.Section(
+                f"{name}最近出场", f"【{name}·最近出场】\n" + "\n".join(picked), 5, 25000 + i, rank=-1, trimmable=True,
+            ))
+    return parts
+
+
+def _setting_query(chapters: list[dict], current_volume_idx: int, query: str) -> str:
+    """选取长设定相关小节用的查询：走向加上当前卷与上一卷最近 SETTING_QUERY_CHAPTERS 章的摘要（出场人物、地点多在其中）。"""
+    recent = []
+    for ch in reversed(chapters):
+        if len(recent) >= config.SETTING_QUERY_CHAPTERS:
+            break
+        if ch.get("summary") and ch.get("volume_idx", 0) in (current_volume_idx - 1, current_volume_idx):
+            recent.append(ch["summary"])
+    return "\n".join([query] + recent[::-1]).strip()
+
+
+def _history_sections(meta: dict, current_volume_idx: int) -> list[context_builder.Section]:
+    """
+    卷 0 ~ n-2 的摘要段，用能覆盖它们的最粗一级：
+    完整的篇章（每 SUMMARY_ARC_VOLUMES 卷）中，最近 SUMMARY_RECENT_ARCS 个之前的由全书梗概覆盖，
+    其余篇章用篇章摘要，尚不完整的篇章内各卷用卷摘要；缺少某级摘要时退回下一级。
+    这样无论全书多长，早期历史只占大致固定的篇幅。
+    """
+    Section = context_builder.Section
+    k = config.SUMMARY_ARC_VOLUMES
+    vols = meta.get("volumes", [])
+    arcs = meta.get("arcs", [])
+    old = min(max(0, current_volume_idx - 1), len(vols))
+    closed = old // k
+    parts = []
+
+    def volume_section(vi: int):
+        if vols[vi].get("summary"):
+            parts.append(Section(f"第{vi + 1}卷摘要", f"【第{vi + 1}卷摘要】\n{vols[vi]['summary']}", 6, 10 + vi, rank=-vi))
+
+    covered = 0
+    synopsis = meta.get("synopsis") or {}
+    if synopsis.get("summary") and 0 < synopsis.get("arcs", 0) <= closed - config.SUMMARY_RECENT_ARCS:
+        covered = synopsis["arcs"]
+        title = f"前情梗概（第1–{covered * k}卷）"
+        parts.append(Section(title, f"【{title}】\n{synopsis['summary']}", 6, 9, rank=-(10 ** 6)))
+    for a in range(covered, closed):
+        if a < len(arcs) and arcs[a].get("summary"):
+            title = f"第{a * k + 1}–{(a + 1) * k}卷摘要"
+            parts.append(Section(title, f"【{title}】\n{arcs[a]['summary']}", 6, 10 + a * k, rank=-(a * k)))
+        else:
+            for vi in range(a * k, (a + 1) * k):
+                volume_section(vi)
+    for vi in range(closed * k, old):
+        volume_section(vi)
+    return parts
+
+
+def get_rag_context(project_id: str, current_volume_idx: int, query: str = "", budget: Optional[int] = None) -> str:
+    """构建 RAG 上下文（各段见 get_rag_sections）；给出 budget 时按 token 预算取舍。"""
+    return context_builder.assemble(get_rag_sections(project_id, current_volume_idx, query), budget)["text"]
+
+
+def get_rag_dependencies(project_id: str, current_volume_idx: int, query: str = "") -> tuple[list[str], list[int], bool]:
+    """
+    get_rag_context 实际读取的摘要：返回 (章节 id 列表, 卷序号列表, 是否读篇章摘要/全书梗概)。
+    与 get_rag_sections 的读取逻辑保持一致：卷 0 ~ n-2 读卷摘要，其中完整的篇章读篇章摘要与全书梗概（见 _history_sections），
+    卷 n-1、n 读章摘要；给出 query 时还有其中人物最近出场各章的章摘要（见 _entity_chapters）。
+    """
+    meta = get_project(project_id)
+    if not meta:
+        return [], [], False
+    vols = meta.get("volumes", [])
+    old = min(max(0, current_volume_idx - 1), len(vols))
+    volume_idxs = list(range(old))
+    chapter_ids = []
+    for vi in (current_volume_idx - 1, current_volume_idx):
+        if 0 <= vi < len(vols):
+            chapter_ids.extend(vols[vi].get("chapters", []))
+    if query:
+        seen = set(chapter_ids)
+        for _, chs in _entity_chapters(project_id, meta, current_volume_idx, query):
+            for ch in chs:
+                if ch["id"] not in seen:
+                    seen.add(ch["id"])
+                    chapter_ids.append(ch["id"])
+    return chapter_ids, volume_idxs, old >= config.SUMMARY_ARC_VOLUMES
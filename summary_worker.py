@@ -0,0 +1,305 @@
+"""摘要后台队列：章摘要、卷摘要不再阻塞生成请求。
+
+每个项目一条队列、一个 worker，按入队顺序串行执行，保证同一项目内摘要的先后顺序。
+章节入队时即标记 summary_status="pending"；规划请求只等待其 RAG 上下文实际依赖的那些摘要
+（上下文用到篇章摘要或全书梗概时，也等待随后的层级刷新）。
+摘要沿用入队时的追踪 id（由生成任务入队时即该任务 id），日志可与生成任务对应；
+每章的摘要（含随后的卷摘要与层级刷新）完成后，把其中模型调用的 token 用量计入项目。
+读写存储（项目锁、文件锁与索引更新）都经 asyncio.to_thread 在线程中执行，不阻塞事件循环。
+"""
+import asyncio
+import logging
+
+import config
+import metrics
+import storage
+import qwen_client
+
+log = logging.getLogger(__name__)
+
+_queues: dict[str, asyncio.Queue] = {}
+_workers: dict[str, asyncio.Task] = {}
+# (project_id, "chapter", chapter_id)、(project_id, "volume", volume_idx) 或
+# (project_id, "hierarchy")（章摘要之后的篇章摘要 / 全书梗概刷新）-> 未完成的 Future
+_pending: dict[tuple, set[asyncio.Future]] = {}
+
+
+def _track(key: tuple) -> asyncio.Future:
+    fut = asyncio.get_running_loop().create_future()
+    # 失败的 Future 可能无人 await，先取一次异常避免 "never retrieved" 警告
+    fut.add_done_callback(lambda f: f.cancelled() or f.exception())
+    _pending.setdefault(key, set()).add(fut)
+    return fut
+
+
+def _resolve(key: tuple, fut: asyncio.Future, result=None, exc: BaseException | None = None) -> None:
+    if not fut.done():
+        if exc is not None:
+            fut.set_exception(exc)
+        else:
+            fut.set_result(result)
+    futs = _pending.get(key)
+    if futs is not None:
+        futs.discard(fut)
+        if not futs:
+            del _pending[key]
+
+
+async def enqueue_chapter(project_id: str, chapter_id: str, gen: dict) -> asyncio.Future:
+    """
+    章摘要入队，完成后视情况刷新所在卷的卷摘要与篇章摘要、全书梗概。
+    返回章摘要完成时 resolve 的 Future（结果为摘要文本）。
+    """
+    ch = await asyncio.to_thread(storage.get_chapter, project_id, chapter_id)
+    if not ch:
+        raise ValueError("章节不存在")
+    volume_idx = ch.get("volume_idx", 0)
+
+    # 先登记 Future 再标记 pending：标记期间开始的 wait_for_context 也会等待该章
+    ch_key = (project_id, "chapter", chapter_id)
+    vol_key = (project_id, "volume", volume_idx)
+    hier_key = (project_id, "hierarchy")
+    job = (chapter_id, volume_idx, gen, ch_key, _track(ch_key), vol_key, _track(vol_key), hier_key, _track(hier_key),
+           metrics.current_trace_id())
+    try:
+        await asyncio.to_thread(storage.set_chapter_summary_status, project_id, chapter_id, "pending")
+    except BaseException:
+        # 标记失败或被取消：撤销登记，等待者不再等待该章
+        for key, fut in ((ch_key, job[4]), (vol_key, job[6]), (hier_key, job[8])):
+            fut.cancel()
+            _resolve(key, fut)
+        raise
+
+    q = _queues.setdefault(project_id, asyncio.Queue())
+    q.put_nowait(job)
+    if project_id not in _workers:
+        _workers[project_id] = asyncio.create_task(_worker(project_id, q))
+    return job[4]
+
+
+async def wait_for_context(project_id: str, current_volume_idx: int, query: str = "") -> None:
+    """等待 get_rag_context(project_id, current_volume_idx, query) 所依赖、仍在队列中的摘要。失败的摘要不抛出。"""
+    chapter_ids, volume_idxs, hierarchy = await asyncio.to_thread(storage.get_rag_dependencies, project_id, current_volume_idx, query)
+    keys = [(project_id, "chapter", cid) for cid in chapter_ids]
+    keys += [(project_id, "volume", vi) for vi in volume_idxs]
+    if hierarchy:
+        # 较早的卷由篇章摘要 / 全书梗概覆盖，等待它们随章摘要完成的刷新
+        keys.append((project_id, "hierarchy"))
+    futs = [f for k in keys for f in _pending.get(k, ())]
+    if futs:
+        await asyncio.wait(futs)
+
+
+def chapter_future(project_id: str, chapter_id: str) -> asyncio.Future | None:
+    """该章仍在队列中的章摘要 Future（启动时 resume_pending 入队的也在内），没有则返回 None。"""
+    return next(iter(_pending.get((project_id, "chapter", chapter_id), ())), None)
+
+
+def pending_count(project_id: str) -> int:
+    """项目队列中尚未完成的摘要任务数。"""
+    q = _queues.get(project_id)
+    return q.qsize() if q else 0
+
+
+async def resume_pending(gen: dict) -> int:
+    """启动时把上次进程退出前仍为 pending 的章节重新入队，返回入队数。"""
+    n = 0
+    for project_id in await asyncio.to_thread(storage.list_project_ids):
+        meta = await asyncio.to_thread(storage.get_project, project_id)
+        for ch in (meta or {}).get("chapters", []):
+            if ch.get("summary_status") == "pending":
+                await enqueue_chapter(project_id, ch["id"], gen)
+                n += 1
+    return n
+
+
+async def shutdown() -> None:
+    """
+    进程退出时取消各项目的 worker（在关闭共享的 DashScope 会话之前调用）。
+    被打断与尚未执行的章节保持 summary_status="pending"，下次启动由 resume_pending 重新入队。
+    """
+    tasks = list(_workers.values())
+    for t in tasks:
+        t.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    for futs in list(_pending.values()):
+        for fut in futs:
+            fut.cancel()
+    _pending.clear()
+    _queues.clear()
+
+
+async def _worker(project_id: str, q: asyncio.Queue) -> None:
+    try:
+        while not q.empty():
+            job = q.get_nowait()
+            await _run(project_id, *job)
+    finally:
+        # 队列清空后退出；之后的 enqueue 会重新创建 worker
+        _workers.pop(project_id, None)
+        if q.empty():
+            _queues.pop(project_id, None)
+
+
+async def _run(
+    project_id: str,
+    chapter_id: str,
+    volume_idx: int,
+    gen: dict,
+    ch_key: tuple,
+    ch_fut: asyncio.Future,
+    vol_key: tuple,
+    vol_fut: asyncio.Future,
+    hier_key: tuple,
+    hier_fut: asyncio.Future,
+    trace_id: str | None = None,
+) -> None:
+    with metrics.trace(trace_id, project_id):
+        try:
+            await _run_traced(project_id, chapter_id, volume_idx, gen, ch_key, ch_fut, vol_key, vol_fut, hier_key, hier_fut)
+        finally:
+            usage = metrics.take_usage()
+            if usage:
+                await asyncio.to_thread(storage.add_token_usage, project_id, usage)
+
+
+async def _run_traced(
+    project_id: str,
+    chapter_id: str,
+    volume_idx: int,
+    gen: dict,
+    ch_key: tuple,
+    ch_fut: asyncio.Future,
+    vol_key: tuple,
+    vol_fut: asyncio.Future,
+    hier_key: tuple,
+    hier_fut: asyncio.Future,
+) -> None:
+    try:
+        with metrics.span("chapter_summary", chapter=chapter_id):
+            ch = await asyncio.to_thread(storage.get_chapter, project_id, chapter_id)
+            if not ch:
+                raise ValueError("章节不存在")
+            content = await asyncio.to_thread(storage.get_chapter_content, project_id, chapter_id)
+            summary = await qwen_client.asummarize_chapter(
+                content, ch.get("direction", ""),
+                temperature=gen.get("temperature"),
+                top_p=gen.get("top_p"),
+            )
+            await asyncio.to_thread(storage.update_chapter_summary, project_id, chapter_id, summary)
+        _resolve(ch_key, ch_fut, summary)
+    except Exception as e:
+        log.exception("章摘要失败 project=%s chapter=%s", project_id, chapter_id)
+        await asyncio.to_thread(storage.set_chapter_summary_status, project_id, chapter_id, "error")
+        _resolve(ch_key, ch_fut, exc=e)
+        _resolve(vol_key, vol_fut)
+        _resolve(hier_key, hier_fut)
+        return
+
+    try:
+        with metrics.span("volume_summary", volume=volume_idx):
+            await _refresh_volume_summary(project_id, volume_idx, gen)
+    except Exception:
+        log.exception("卷摘要失败 project=%s volume=%s", project_id, volume_idx)
+    finally:
+        _resolve(vol_key, vol_fut)
+
+    try:
+        with metrics.span("summary_hierarchy"):
+            await _refresh_hierarchy(project_id, gen)
+    except Exception:
+        log.exception("篇章摘要/全书梗概失败 project=%s", project_id)
+    finally:
+        _resolve(hier_key, hier_fut)
+
+
+async def _refresh_volume_summary(project_id: str, volume_idx: int, gen: dict) -> None:
+    """
+    早期卷：章节数达到阈值后维护卷摘要。
+    首次整卷压缩；之后只把 dirty_chapters（新增/改动的章摘要）并入已有卷摘要，无变化则不调用模型。
+    """
+    meta = await asyncio.to_thread(storage.get_project, project_id)
+    vols = meta.get("volumes", [])
+    if volume_idx >= len(vols):
+        return
+    vol = vols[volume_idx]
+    ch_ids = vol.get("chapters", [])
+    if len(ch_ids) < 3:  # 每卷≥3章时生成卷摘要
+        return
+    dirty = set(vol.get("dirty_chapters", []))
+    if not dirty:
+        return
+
+    chapters = await asyncio.to_thread(lambda: {cid: storage.get_chapter(project_id, cid) or {} for cid in ch_ids})
+    if not vol.get("summary"):
+        # 只压缩摘要已完成的章节；其余章节保持 dirty，摘要完成后再增量并入
+        done = [cid for cid in ch_ids if chapters[cid].get("summary_status") == "done" and chapters[cid].get("summary")]
+        if not done:
+            return
+        vol_sum = await qwen_client.asummarize_volume(
+            [chapters[cid]["summary"] for cid in done],
+            temperature=gen.get("temperature"),
+            top_p=gen.get("top_p"),
+        )
+        await asyncio.to_thread(storage.update_volume_summary, project_id, volume_idx, vol_sum, folded_chapters=done)
+        return
+
+    summarized = set(vol.get("summarized_chapters", []))
+    folded, new, revised = [], [], []
+    for cid in ch_ids:
+        ch = chapters[cid]
+        if cid not in dirty or not ch.get("summary"):
+            continue
+        folded.append(cid)
+        item = (ch.get("chapter_idx", 0) + 1, ch["summary"])
+        (revised if cid in summarized else new).append(item)
+    if not folded:
+        return
+    vol_sum = await qwen_client.afold_volume_summary(
+        vol["summary"], new, revised,
+        temperature=gen.get("temperature"),
+        top_p=gen.get("top_p"),
+    )
+    await asyncio.to_thread(storage.update_volume_summary, project_id, volume_idx, vol_sum, folded_chapters=folded)
+
+
+async def _refresh_hierarchy(project_id: str, gen: dict) -> None:
+    """
+    卷以上的摘要层级：每 config.SUMMARY_ARC_VOLUMES 卷一个篇章。
+    篇章内各卷都已成为较早的卷（不再是最新两卷）且都有卷摘要后生成篇章摘要；
+    最近 SUMMARY_RECENT_ARCS 个篇章之前的篇章合成全书梗概，新篇章增量并入。
+    只重建子节点有变化（dirty）或尚未生成的节点。
+    """
+    k = config.SUMMARY_ARC_VOLUMES
+    temperature, top_p = gen.get("temperature"), gen.get("top_p")
+    meta = await asyncio.to_thread(storage.get_project, project_id)
+    vols = meta.get("volumes", [])
+    arcs = meta.get("arcs", [])
+    complete = 0
+    for a in range(max(0, len(vols) - 2) // k):
+        vol_sums = [v.get("summary", "") for v in vols[a * k:(a + 1) * k]]
+        if not all(vol_sums):
+            break
+        arc = arcs[a] if a < len(arcs) else {}
+        if not arc.get("summary") or arc.get("dirty"):
+            items = [(f"第{a * k + i + 1}卷", s) for i, s in enumerate(vol_sums)]
+            summary = await qwen_client.amerge_summaries(items, f"第{a * k + 1}–{(a + 1) * k}卷", temperature=temperature, top_p=top_p)
+            await asyncio.to_thread(storage.update_arc_summary, project_id, a, summary)
+        complete += 1
+
+    target = complete - config.SUMMARY_RECENT_ARCS
+    if target <= 0:
+        return
+    meta = await asyncio.to_thread(storage.get_project, project_id)
+    arcs = meta.get("arcs", [])
+    synopsis = meta.get("synopsis") or {}
+    covered = synopsis.get("arcs", 0)
+    if synopsis.get("summary") and not synopsis.get("dirty"):
+        if covered >= target:
+            return
+        base, start = synopsis["summary"], covered
+    else:
+        base, start = "", 0
+    items = [(f"第{a * k + 1}–{(a + 1) * k}卷", arcs[a]["summary"]) for a in range(start, target)]
+    summary = await qwen_client.amerge_summaries(items, f"全书前情（第1–{target * k}卷）", base, temperature, top_p)
+    await asyncio.to_thread(storage.update_synopsis, project_id, summary, target)
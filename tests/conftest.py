@@ -0,0 +1,62 @@
+"""测试公共设置：数据目录指向临时目录（须在导入 storage 等模块之前），
+假 DashScope 服务（benchmarks/fake_dashscope.py）在后台线程中启动，不访问真实 DashScope。"""
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+import config  # noqa: E402
+
+_DATA_DIR = tempfile.mkdtemp(prefix="novel-test-")
+config.DATA_DIR = _DATA_DIR
+config.PROJECTS_DIR = os.path.join(_DATA_DIR, "projects")
+config.SQLITE_PATH = os.path.join(_DATA_DIR, "novel.db")
+config.LLM_CACHE_DIR = os.path.join(_DATA_DIR, "llm_cache")
+
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(_DATA_DIR, ignore_errors=True)
+
+
+@pytest.fixture(scope="session")
+def fake_server():
+    """启动假 DashScope 服务，返回其 base URL。"""
+    import uvicorn
+    import fake_dashscope
+
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(fake_dashscope.app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    yield f"http://127.0.0.1:{port}/api/v1"
+    server.should_exit = True
+    thread.join(timeout=5)
+
+
+@pytest.fixture
+def fake(fake_server, monkeypatch):
+    """指向假服务的 qwen_client 配置（短超时、短退避、不限流），返回 fake_dashscope 模块；
+    用 fake.fault = fake.Fault(...) 注入故障，fake.calls 为本测试中的请求数。"""
+    import fake_dashscope
+
+    monkeypatch.setattr(config, "DASHSCOPE_BASE_URL", fake_server)
+    monkeypatch.setattr(config, "DASHSCOPE_API_KEY", "fake")
+    monkeypatch.setattr(config, "LLM_RETRY_BASE_DELAY", 0.05)
+    monkeypatch.setattr(config, "LLM_TIMEOUTS", {"test": {"first_token": 0.5, "total": 3}})
+    monkeypatch.setattr(config, "LLM_HEDGE_AFTER", {"hedge": 0.3})
+    monkeypatch.setattr(fake_dashscope, "fault", fake_dashscope.Fault())
+    monkeypatch.setattr(fake_dashscope, "calls", 0)
+    return fake_dashscope
@@ -0,0 +1,57 @@
+"""blob_store：去重、增量编码，以及增量链达到 BLOB_MAX_DELTA_CHAIN 时的读取与改存全文。"""
+import json
+import uuid
+import zlib
+
+import blob_store
+import config
+import json_store
+
+
+def _chapter(n: int) -> str:
+    return "".join(f"第{i}段：林晓走进了玄天宗的山门，回头看了一眼。\n" for i in range(n))
+
+
+def _kind(pid: str, h: str) -> tuple[bytes, dict]:
+    raw = json_store.read_bytes(pid, blob_store._path(h))
+    payload = zlib.decompress(raw[1:])
+    return raw[:1], (json.loads(payload) if raw[:1] == blob_store._DELTA else {})
+
+
+def test_dedup():
+    pid = uuid.uuid4().hex
+    text = _chapter(50)
+    h = blob_store.put(json_store, pid, text)
+    assert blob_store.put(json_store, pid, text, base_hash=h) == h
+    assert blob_store.get(json_store, pid, h) == text
+    assert blob_store.get(json_store, pid, "0" * 64) is None
+
+
+def test_delta_chain_limit():
+    pid = uuid.uuid4().hex
+    text = _chapter(200)
+    hashes = [blob_store.put(json_store, pid, text)]
+    versions = [text]
+    for i in range(config.BLOB_MAX_DELTA_CHAIN + 1):
+        text = text.replace(f"第{i}段：", f"第{i}段（改）：")
+        versions.append(text)
+        hashes.append(blob_store.put(json_store, pid, text, base_hash=hashes[-1]))
+
+    # 第 1..BLOB_MAX_DELTA_CHAIN 版为增量，深度依次加一；再下一版超过上限改存全文
+    for depth in range(1, config.BLOB_MAX_DELTA_CHAIN + 1):
+        kind, delta = _kind(pid, hashes[depth])
+        assert kind == blob_store._DELTA and delta["depth"] == depth
+    assert _kind(pid, hashes[-1])[0] == blob_store._FULL
+    # 链末端（沿整条链还原）与各版本都能原样读出
+    assert blob_store.get(json_store, pid, hashes[config.BLOB_MAX_DELTA_CHAIN]) == versions[config.BLOB_MAX_DELTA_CHAIN]
+    for h, v in zip(hashes, versions):
+        assert blob_store.get(json_store, pid, h) == v
+
+
+def test_missing_base_reads_none():
+    pid = uuid.uuid4().hex
+    base = blob_store.put(json_store, pid, _chapter(100))
+    h = blob_store.put(json_store, pid, _chapter(100) + "尾声。\n", base_hash=base)
+    assert _kind(pid, h)[0] == blob_store._DELTA
+    (json_store._project_path(pid) / blob_store._path(base)).unlink()
+    assert blob_store.get(json_store, pid, h) is None
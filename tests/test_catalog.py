@@ -0,0 +1,87 @@
+"""项目目录索引：分页排序、与后端项目对账，以及随 meta 写入更新。"""
+import pytest
+
+import catalog
+import storage
+
+
+class _Backend:
+    """内存中的后端：只实现目录索引用到的接口；写入次数记在 writes。"""
+
+    def __init__(self, metas: dict[str, dict]):
+        self.metas = metas
+        self.catalog = None
+        self.writes = 0
+
+    def catalog_stamp(self):
+        return self.writes
+
+    def read_catalog(self):
+        return dict(self.catalog) if self.catalog is not None else None
+
+    def write_catalog(self, entries, changed=None):
+        self.catalog = dict(entries)
+        self.writes += 1
+
+    def list_project_ids(self):
+        return list(self.metas)
+
+
+def _meta(name: str, chapters: int, updated: str) -> dict:
+    return {
+        "name": name,
+        "created_at": "2024-01-01T00:00:00",
+        "updated_at": updated,
+        "volumes": [{"chapters": []}],
+        "chapters": [{"id": f"c{i}", "char_count": 100} for i in range(chapters)],
+    }
+
+
+def _catalog(metas: dict[str, dict]) -> tuple[catalog.Catalog, _Backend]:
+    backend = _Backend(metas)
+    return catalog.Catalog(backend, metas.get), backend
+
+
+def test_query_sort_and_page():
+    cat, _ = _catalog({
+        "a": _meta("甲", 3, "2024-01-03"),
+        "b": _meta("乙", 1, "2024-01-02"),
+        "c": _meta("丙", 2, "2024-01-01"),
+    })
+    page = cat.query(offset=1, limit=1)
+    assert page["total"] == 3 and [e["id"] for e in page["items"]] == ["b"]
+    assert [e["id"] for e in cat.query(sort="chapter_count", order="asc")["items"]] == ["b", "c", "a"]
+    assert cat.query(sort="word_count")["items"][0]["word_count"] == 300
+    with pytest.raises(ValueError):
+        cat.query(sort="rev")
+    with pytest.raises(ValueError):
+        cat.query(order="up")
+
+
+def test_reconcile_with_backend():
+    metas = {"a": _meta("甲", 1, "2024-01-01"), "b": _meta("乙", 1, "2024-01-02")}
+    cat, backend = _catalog(metas)
+    backend.catalog = {"gone": catalog.entry_for("gone", _meta("已删", 0, "")), "a": catalog.entry_for("a", metas["a"])}
+    # 缺失的项目补上，已不存在的项目移除
+    assert sorted(e["id"] for e in cat.query()["items"]) == ["a", "b"]
+    assert set(backend.catalog) == {"a", "b"}
+
+
+def test_update_writes_only_on_change():
+    metas = {"a": _meta("甲", 1, "2024-01-01")}
+    cat, backend = _catalog(metas)
+    cat.query()
+    writes = backend.writes
+    cat.update("a", metas["a"])
+    assert backend.writes == writes
+    metas["a"] = _meta("甲", 2, "2024-01-05")
+    cat.update("a", metas["a"])
+    assert backend.writes == writes + 1
+    assert cat.query()["items"][0]["chapter_count"] == 2
+
+
+def test_storage_listing_follows_writes():
+    pid = storage.create_project("目录测试")
+    storage.add_chapter(pid, 0, 0, "走向", "正文" * 10)
+    entry = next(e for e in storage.list_projects()["items"] if e["id"] == pid)
+    assert (entry["name"], entry["chapter_count"], entry["word_count"]) == ("目录测试", 1, 20)
@@ -0,0 +1,50 @@
+"""storage 的章节索引：按 id / (卷, 章) 查找、全书顺序，以及写入失败时缓存中的索引不变。"""
+import pytest
+
+import storage
+
+
+def _project(n_vols: int = 2, n_chs: int = 3) -> tuple[str, dict]:
+    pid = storage.create_project("索引测试")
+    ids = {}
+    for v in range(n_vols):
+        for c in range(n_chs):
+            ids[(v, c)] = storage.add_chapter(pid, v, c, f"走向{v}-{c}", f"正文{v}-{c}")
+    return pid, ids
+
+
+def test_lookup_by_id_and_position():
+    pid, ids = _project()
+    for (v, c), cid in ids.items():
+        assert storage.get_chapter(pid, cid)["direction"] == f"走向{v}-{c}"
+        assert storage.find_chapter(pid, v, c)["id"] == cid
+        assert storage.get_chapter_content(pid, cid) == f"正文{v}-{c}"
+    assert storage.get_chapter(pid, "missing") is None
+    assert storage.find_chapter(pid, 5, 0) is None
+
+
+def test_regenerated_position_points_to_latest():
+    pid, ids = _project(1, 2)
+    newer = storage.add_chapter(pid, 0, 1, "重写", "新正文")
+    assert storage.find_chapter(pid, 0, 1)["id"] == newer
+    # 旧章仍可按 id 取到；全书顺序中同一位置只取最新一章
+    assert storage.get_chapter(pid, ids[(0, 1)])["direction"] == "走向0-1"
+    _, book = storage.book_chapters(pid)
+    assert [ch["id"] for ch in book] == [ids[(0, 0)], newer]
+
+
+def test_failed_write_leaves_cached_index(monkeypatch):
+    pid, ids = _project(1, 2)
+
+    def fail(project_id, meta):
+        raise OSError("磁盘已满")
+
+    monkeypatch.setattr(storage._backend, "write_meta", fail)
+    with pytest.raises(OSError):
+        storage.add_chapter(pid, 0, 1, "重写", "新正文")
+    monkeypatch.undo()
+    # 缓存中的索引没有登记未写入的章节
+    assert storage.find_chapter(pid, 0, 1)["id"] == ids[(0, 1)]
+    assert len(storage.get_project(pid)["chapters"]) == 2
+    cid = storage.add_chapter(pid, 0, 2, "第三章", "正文")
+    assert storage.find_chapter(pid, 0, 2)["id"] == cid
@@ -0,0 +1,54 @@
+"""context_builder：按优先级在预算内取舍、改用更高层摘要、截断，以及稳定的提示词前缀。"""
+import context_builder
+from context_builder import Section, assemble, estimate_tokens
+
+
+def _text(label: str, chars: int) -> str:
+    return f"【{label}】\n" + "字" * chars
+
+
+def _status(ctx: dict) -> dict[str, str]:
+    return {r["section"]: r["status"] for r in ctx["sections"]}
+
+
+def test_unlimited_keeps_everything_in_order():
+    sections = [Section("b", _text("b", 10), priority=0, order=1), Section("a", _text("a", 10), priority=1, order=0)]
+    ctx = assemble(sections)
+    assert ctx["text"] == _text("a", 10) + "\n\n" + _text("b", 10)
+    assert ctx["dropped"] == []
+
+
+def test_priority_decides_what_is_dropped():
+    keep = Section("近章", _text("近章", 600), priority=0, order=2)
+    drop = Section("远章", _text("远章", 600), priority=5, order=1)
+    budget = estimate_tokens(keep.text) + 50
+    ctx = assemble([drop, keep], budget)
+    assert _status(ctx) == {"近章": "kept", "远章": "dropped"}
+    assert ctx["tokens"] <= budget
+    assert ctx["dropped"] == ["远章"]
+
+
+def test_fallback_replaces_section():
+    vol = Section("第1卷卷摘要", _text("卷摘要", 100), priority=3, order=0)
+    chs = Section("第1卷章摘要", _text("章摘要", 3000), priority=3, order=0, fallback=vol)
+    ctx = assemble([chs], estimate_tokens(vol.text) + 100)
+    assert ctx["sections"][0]["status"] == "replaced" and ctx["sections"][0]["by"] == "第1卷卷摘要"
+    assert ctx["text"] == vol.text
+
+
+def test_trimmable_section_is_cut_to_budget():
+    first = Section("走向", _text("走向", 300), priority=0, order=0)
+    long = Section("正文片段", "行\n" * 3000, priority=1, order=1, trimmable=True)
+    budget = estimate_tokens(first.text) + 400
+    ctx = assemble([first, long], budget)
+    assert _status(ctx) == {"走向": "kept", "正文片段": "trimmed"}
+    assert ctx["tokens"] <= budget
+    assert ctx["body"].endswith(context_builder._TRIM_MARK)
+
+
+def test_static_prefix_is_stable():
+    setting = Section("世界设定", _text("世界设定", 200), priority=0, order=0, static=True)
+    a = assemble([setting, Section("章摘要", _text("甲", 300), priority=1, order=1)], 2000)
+    b = assemble([setting, Section("章摘要", _text("乙", 900), priority=1, order=1)], 2000)
+    assert a["prefix"] == b["prefix"] == setting.text
+    assert a["body"] != b["body"]
@@ -0,0 +1,57 @@
+"""entity_index：从人物设定取名单、自动机的最长匹配、出场统计随正文与设定修改更新，以及人物最近出场段。"""
+import entity_index
+import storage
+
+_SETTING = """## 主要人物
+1. 林晓（小晓、晓哥）：主角，散修。
+【苏婉】
+玄天宗弟子。
+- 林晓月：林晓的妹妹。
+姓名：韩立
+性格：沉稳
+"""
+
+
+def test_extract_names():
+    assert entity_index.extract_names(_SETTING) == {
+        "林晓": "林晓", "小晓": "林晓", "晓哥": "林晓", "苏婉": "苏婉", "林晓月": "林晓月", "韩立": "韩立",
+    }
+
+
+def test_automaton_prefers_longest():
+    r = entity_index.roster(_SETTING)
+    assert r.automaton.find("林晓月喊林晓，晓哥没应") == [(0, "林晓月"), (4, "林晓"), (7, "晓哥")]
+    assert r.scan("林晓月喊林晓，晓哥没应") == {"林晓月": [1, 0, 0], "林晓": [2, 4, 7]}
+    assert r.mentioned("晓哥与苏婉") == ["林晓", "苏婉"]
+
+
+def test_appearances_follow_writes():
+    pid = storage.create_project("人物测试", character_setting=_SETTING)
+    c1 = storage.add_chapter(pid, 0, 0, "走向", "林晓下山。苏婉送别林晓。")
+    c0 = storage.add_chapter(pid, 0, 1, "走向", "晓哥独行。")
+    stats = {e["name"]: e for e in storage.list_entities(pid)}
+    assert (stats["林晓"]["chapters"], stats["林晓"]["mentions"]) == (2, 3)
+    assert stats["林晓"]["aliases"] == ["小晓", "晓哥"]
+    assert stats["林晓"]["last"] == {"chapter_id": c0, "volume_idx": 0, "chapter_idx": 1, "offset": 0}
+    assert stats["韩立"]["first"] is None
+
+    assert [(a["chapter_id"], a["count"]) for a in storage.entity_appearances(pid, "小晓")] == [(c1, 2), (c0, 1)]
+    assert storage.entity_appearances(pid, "路人") is None
+
+    storage.set_chapter_content(pid, c0, "韩立独行。")
+    assert [a["chapter_id"] for a in storage.entity_appearances(pid, "林晓")] == [c1]
+    # 设定改动后按新名单重扫
+    storage.update_project(pid, character_setting=_SETTING.replace("苏婉", "苏清"))
+    assert storage.entity_appearances(pid, "苏婉") is None
+    assert storage.entity_appearances(pid, "苏清") == []
+
+
+def test_recent_appearance_section():
+    pid = storage.create_project("人物测试", character_setting=_SETTING)
+    storage.add_chapter(pid, 0, 0, "走向", "韩立初入宗门。", summary="韩立入宗")
+    storage.add_chapter(pid, 1, 0, "走向", "林晓闭关。", summary="林晓闭关")
+    storage.add_chapter(pid, 2, 0, "走向", "林晓出关。", summary="林晓出关")
+    labels = {s.label: s.text for s in storage.get_rag_sections(pid, 3, "韩立回归")}
+    assert labels["韩立最近出场"] == "【韩立·最近出场】\n（第1卷 第1章）韩立入宗"
+    # 卷 n-1 及之后的出场已在章摘要中，不重复
+    assert "林晓最近出场" not in {s.label for s in storage.get_rag_sections(pid, 2, "林晓")}
@@ -0,0 +1,46 @@
+"""条件请求：项目、章节列表与单章接口的 ETag / If-None-Match（304），以及写入后 ETag 随之变化。"""
+from fastapi.testclient import TestClient
+
+import main
+import storage
+
+client = TestClient(main.app)
+
+
+def _revalidate(url: str) -> tuple[str, int]:
+    r = client.get(url)
+    assert r.status_code == 200 and r.headers["cache-control"] == "no-cache"
+    etag = r.headers["etag"]
+    return etag, client.get(url, headers={"If-None-Match": etag}).status_code
+
+
+def test_chapter_list_304_until_write():
+    pid = storage.create_project("缓存测试")
+    cid = storage.add_chapter(pid, 0, 0, "走向", "正文")
+    url = f"/api/projects/{pid}/chapters"
+    etag, status = _revalidate(url)
+    assert status == 304
+    # 弱比较、多个候选值与 * 都算匹配
+    assert client.get(url, headers={"If-None-Match": f'"x", W/{etag}'}).status_code == 304
+    assert client.get(url, headers={"If-None-Match": "*"}).status_code == 304
+    # 不同参数是不同的表示
+    assert client.get(f"{url}?fields=id,char_count", headers={"If-None-Match": etag}).status_code == 200
+
+    storage.update_chapter_summary(pid, cid, "摘要")
+    r = client.get(url, headers={"If-None-Match": etag})
+    assert r.status_code == 200 and r.headers["etag"] != etag
+
+
+def test_project_and_chapter_304():
+    pid = storage.create_project("缓存测试")
+    cid = storage.add_chapter(pid, 0, 0, "走向", "正文")
+    project_etag, status = _revalidate(f"/api/projects/{pid}?chapters=false")
+    assert status == 304
+    chapter_url = f"/api/projects/{pid}/chapters/{cid}"
+    chapter_etag, status = _revalidate(chapter_url)
+    assert status == 304
+
+    storage.set_chapter_content(pid, cid, "新正文")
+    r = client.get(chapter_url, headers={"If-None-Match": chapter_etag})
+    assert r.status_code == 200 and r.json()["content"] == "新正文"
+    assert client.get(f"/api/projects/{pid}?chapters=false", headers={"If-None-Match": project_etag}).status_code == 200
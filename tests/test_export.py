@@ -0,0 +1,56 @@
+"""整书导出：章节顺序、EPUB 的包结构与 XHTML 转义，以及不支持的格式。"""
+import io
+import xml.etree.ElementTree as ET
+import zipfile
+
+import pytest
+
+import export
+import storage
+
+_XHTML = "{http://www.w3.org/1999/xhtml}"
+
+
+def _book() -> str:
+    pid = storage.create_project("导出<测试>")
+    storage.add_chapter(pid, 1, 0, "走向", "第二卷开篇。")
+    storage.add_chapter(pid, 0, 1, "走向", "旧稿")
+    storage.add_chapter(pid, 0, 0, "走向", "林晓说：“a < b & c”\x01\n\n  第二段。  ")
+    storage.add_chapter(pid, 0, 1, "重写", "第二章新稿。")
+    return pid
+
+
+def test_txt_follows_book_order():
+    text = "".join(export.export(_book(), "txt"))
+    assert "旧稿" not in text
+    assert text.index("第1卷") < text.index("第二段。") < text.index("第二章新稿。") < text.index("第2卷") < text.index("第二卷开篇。")
+
+
+def test_epub_package():
+    data = b"".join(export.export(_book(), "epub"))
+    zf = zipfile.ZipFile(io.BytesIO(data))
+    first = zf.infolist()[0]
+    assert (first.filename, first.compress_type) == ("mimetype", zipfile.ZIP_STORED)
+    assert zf.read("mimetype") == b"application/epub+zip"
+    assert zf.testzip() is None
+
+    opf = ET.fromstring(zf.read("OEBPS/content.opf"))
+    ns = {"opf": "http://www.idpf.org/2007/opf", "dc": "http://purl.org/dc/elements/1.1/"}
+    assert opf.find(".//dc:title", ns).text == "导出<测试>"
+    hrefs = {i.get("id"): i.get("href") for i in opf.iterfind(".//opf:item", ns)}
+    spine = [hrefs[r.get("idref")] for r in opf.iterfind(".//opf:itemref", ns)]
+    assert spine == ["v1_c1.xhtml", "v1_c2.xhtml", "v2_c1.xhtml"]
+
+    # 各页都是合法的 XML：正文中的 < & 已转义，控制字符已去掉
+    ET.fromstring(zf.read("OEBPS/nav.xhtml"))
+    page = ET.fromstring(zf.read("OEBPS/v1_c1.xhtml"))
+    assert [p.text for p in page.iter(f"{_XHTML}p")] == ["林晓说：“a < b & c”", "第二段。"]
+    assert [h.text for h in page.iter(f"{_XHTML}h1")] == ["第1卷"]
+    assert "第二章新稿。" in zf.read("OEBPS/v1_c2.xhtml").decode("utf-8")
+
+
+def test_unknown_format_or_project():
+    with pytest.raises(ValueError):
+        export.export(_book(), "pdf")
+    with pytest.raises(ValueError):
+        export.export("missing", "epub")
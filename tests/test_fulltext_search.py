@@ -0,0 +1,75 @@
+"""全文查找：跨硬切边界的命中、从持久化的段冷启动查询、随写入更新，以及按项目加锁与缓存淘汰。"""
+import threading
+
+import config
+import retrieval
+import storage
+
+
+def _chapters(pid: str, n: int) -> list[str]:
+    return [storage.add_chapter(pid, 0, i, f"走向{i}", f"第{i}章：林晓路过客栈{i}号房。") for i in range(n)]
+
+
+def test_match_across_hard_split_reported_once():
+    pid = storage.create_project("查找测试")
+    size, overlap = config.RETRIEVAL_PASSAGE_CHARS, config.RETRIEVAL_PASSAGE_OVERLAP
+    # 一处命中跨过第一个硬切点（只有第二片完整包含），另一处整个落在第二、三片的重叠部分内（只由第二片报告）
+    second = 2 * size - overlap - 5
+    content = "啊" * (size - 1) + "青冥剑" + "啊" * (second - size - 2) + "青冥剑" + "啊" * 400
+    cid = storage.add_chapter(pid, 0, 0, "寻剑", content)
+    res = storage.search_chapters(pid, "青冥剑", kinds=["content"], sort="position", order="asc")
+    assert [(h["chapter_id"], h["offset"], h["matches"]) for h in res["items"]] == [(cid, size - 1, [[size - 1, 3], [second, 3]])]
+    assert "青冥剑" in res["items"][0]["snippet"]
+
+
+def test_cold_query_reads_persisted_segments(monkeypatch):
+    monkeypatch.setattr(config, "RETRIEVAL_MERGE_MIN", 2)
+    pid = storage.create_project("查找测试")
+    ids = _chapters(pid, 5)
+    manifest = retrieval._read(storage._backend, pid, retrieval._SEGMENTS_PATH)
+    assert manifest and manifest["segments"]
+
+    retrieval._indexes.pop(pid, None)
+    res = storage.search_chapters(pid, "客栈3号", sort="position")
+    assert [h["chapter_id"] for h in res["items"]] == [ids[3]]
+    assert len(retrieval._indexes[pid].overlay) < len(ids)
+
+
+def test_updates_are_visible(monkeypatch):
+    monkeypatch.setattr(config, "RETRIEVAL_MERGE_MIN", 2)
+    pid = storage.create_project("查找测试")
+    ids = _chapters(pid, 4)
+    # 已写入段的章节改了正文，旧段中的记录作废
+    storage.set_chapter_content(pid, ids[0], "林晓在客栈里拔出了青冥剑。")
+    assert storage.search_chapters(pid, "客栈0号")["total"] == 0
+    assert [h["chapter_id"] for h in storage.search_chapters(pid, "青冥剑")["items"]] == [ids[0]]
+
+    storage.update_chapter_summary(pid, ids[1], "林晓结识了苏婉。")
+    hits = storage.search_chapters(pid, "苏婉", kinds=["summary"])["items"]
+    assert [(h["chapter_id"], h["kind"], h["offset"]) for h in hits] == [(ids[1], "summary", 5)]
+    retrieval._indexes.pop(pid, None)
+    assert storage.search_chapters(pid, "苏婉")["total"] == 1
+
+
+def test_per_project_locks_and_eviction(monkeypatch):
+    monkeypatch.setattr(config, "RETRIEVAL_CACHE_MAX_BYTES", 1)
+    pids = [storage.create_project(f"查找测试{i}") for i in range(3)]
+    ids = {pid: _chapters(pid, 3) for pid in pids}
+    errors = []
+
+    def query(pid: str) -> None:
+        for _ in range(20):
+            hits = storage.search_chapters(pid, "客栈2号")["items"]
+            if [h["chapter_id"] for h in hits] != [ids[pid][2]]:
+                errors.append(pid)
+
+    threads = [threading.Thread(target=query, args=(pid,)) for pid in pids for _ in range(2)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == []
+    # 超出上限时只留下最近使用的项目索引，且其可重新读取的缓存已丢弃
+    storage.search_chapters(pids[0], "客栈")
+    assert list(retrieval._indexes) == [pids[0]]
+    assert not retrieval._indexes[pids[0]].buckets and not retrieval._indexes[pids[0]].texts
@@ -0,0 +1,168 @@
+"""qwen_client 的重试、首段/总时长超时与对冲：对假 DashScope 服务注入错误与延迟。"""
+import asyncio
+import time
+
+import pytest
+
+import config
+import qwen_client
+from scheduler import Scheduler
+
+MESSAGES = [{"role": "user", "content": "测试"}]
+TEXT = "测试输出。" * 5
+
+
+def _run(coro):
+    """在新事件循环中运行，结束前关闭该循环的共享 aiohttp 会话。"""
+    async def run():
+        try:
+            return await coro
+        finally:
+            await qwen_client.aclose_session()
+    return asyncio.run(run())
+
+
+def _call(stage="test", thinking=False):
+    return _run(qwen_client._acall("fake", MESSAGES, enable_thinking=thinking, stage=stage))
+
+
+def _astream():
+    async def run():
+        return [d async for d in qwen_client._astream("fake", MESSAGES, stage="test")]
+    return _run(run())
+
+
+def _scheduler(monkeypatch, **limits) -> Scheduler:
+    s = Scheduler({"fake": limits})
+    monkeypatch.setattr(qwen_client, "scheduler", s)
+    return s
+
+
+def test_normal_call(fake):
+    assert _call() == TEXT
+    assert fake.calls == 1
+
+
+def test_retry_429(fake):
+    fake.fault = fake.Fault(fail_first=2, fail_status=429)
+    assert _call() == TEXT
+    assert fake.calls == 3
+
+
+def test_retry_503(fake):
+    fake.fault = fake.Fault(fail_first=2, fail_status=503)
+    assert _call() == TEXT
+    assert fake.calls == 3
+
+
+def test_persistent_500_exhausts_retries(fake):
+    fake.fault = fake.Fault(fail_first=5, fail_status=500)
+    with pytest.raises(qwen_client.LLMError) as e:
+        _call()
+    assert e.value.status == 500
+    assert fake.calls == config.LLM_RETRY_ATTEMPTS
+
+
+def test_400_not_retried(fake):
+    fake.fault = fake.Fault(fail_first=1, fail_status=400)
+    with pytest.raises(qwen_client.LLMError) as e:
+        _call()
+    assert e.value.status == 400 and not e.value.retryable
+    assert fake.calls == 1
+
+
+def test_stream_retries_429_before_first_chunk(fake):
+    fake.fault = fake.Fault(fail_first=1, fail_status=429)
+    assert "".join(_astream()) == TEXT
+    assert fake.calls == 2
+
+
+def test_first_token_timeout(fake):
+    fake.fault = fake.Fault(latency=5)
+    t = time.monotonic()
+    with pytest.raises(qwen_client.LLMTimeout, match="首段"):
+        _call(thinking=True)
+    assert fake.calls == config.LLM_RETRY_ATTEMPTS
+    assert time.monotonic() - t < 0.5 * config.LLM_RETRY_ATTEMPTS + 1
+
+
+def test_first_token_timeout_non_stream(fake):
+    # 非流式调用的整个响应受 first_token 限制
+    fake.fault = fake.Fault(latency=2)
+    with pytest.raises(qwen_client.LLMTimeout, match="首段"):
+        _call()
+    assert fake.calls == config.LLM_RETRY_ATTEMPTS
+
+
+def test_total_timeout_after_streaming_started(fake):
+    fake.fault = fake.Fault(chunks=10, chunk_delay=0.4)
+    t = time.monotonic()
+    with pytest.raises(qwen_client.LLMTimeout, match="总时长"):
+        _astream()
+    # 已产出内容后不再重试
+    assert fake.calls == 1
+    assert time.monotonic() - t < 3.5
+
+
+def test_no_hedge_waits_for_slow_call(fake):
+    fake.fault = fake.Fault(slow_first=1, slow_latency=1)
+    assert _call("no_hedge") == TEXT
+    assert fake.calls == 1
+
+
+def test_hedge(fake):
+    fake.fault = fake.Fault(slow_first=1, slow_latency=2)
+    t = time.monotonic()
+    assert _call("hedge") == TEXT
+    assert fake.calls == 2
+    assert time.monotonic() - t < 1.5
+
+
+def test_hedge_loser_leaves_scheduler_queue(fake, monkeypatch):
+    # 每分钟 1 个请求：对冲的一份在队列中等待，首个请求返回后应退出队列
+    s = _scheduler(monkeypatch, rpm=1)
+    fake.fault = fake.Fault(slow_first=1, slow_latency=0.6)
+    assert _call("hedge") == TEXT
+    deadline = time.monotonic() + 1
+    while s.stats()["fake"]["queued"]["interactive"] and time.monotonic() < deadline:
+        time.sleep(0.02)
+    assert s.stats()["fake"]["queued"]["interactive"] == 0
+    assert fake.calls == 1
+
+
+def test_hedge_loser_stream_closed_and_tokens_released(fake, monkeypatch):
+    # 先发的一份晚开始、逐段输出；后发的一份先完成，先发的一份应停止读取并退回预扣的 token
+    s = _scheduler(monkeypatch, tpm=1_000_000)
+    fake.fault = fake.Fault(slow_first=1, slow_latency=0.4, chunks=40, chunk_delay=0.02)
+    tokens = qwen_client._estimated_tokens(MESSAGES, True, 8000, None)
+    assert _call("hedge", thinking=True) == "测试输出。" * 40
+    # 落后的一份在返回前已被取消并关闭流；桶内只少了胜出一份的预扣量
+    assert s.stats()["fake"]["tokens_available"] >= 1_000_000 - tokens - 1
+
+
+def test_timeout_releases_tokens(fake, monkeypatch):
+    s = _scheduler(monkeypatch, tpm=1_000_000)
+    monkeypatch.setattr(config, "LLM_RETRY_ATTEMPTS", 1)
+    fake.fault = fake.Fault(latency=5)
+    with pytest.raises(qwen_client.LLMTimeout):
+        _call(thinking=True)
+    assert s.stats()["fake"]["tokens_available"] == 1_000_000
+
+
+def test_length_cutoff_closes_stream(fake, monkeypatch):
+    # 正文按字数截断后，底层的流在返回前关闭，预扣的 token 随即退回
+    s = _scheduler(monkeypatch, tpm=1_000_000)
+    monkeypatch.setattr(config, "MODEL_CONTENT", "fake")
+    monkeypatch.setattr(config, "CHAPTER_LENGTH_CONTROL", True)
+    monkeypatch.setattr(config, "CHAPTER_MIN_CHARS", 10)
+    monkeypatch.setattr(config, "CHAPTER_MAX_CHARS", 20)
+    monkeypatch.setattr(config, "CHAPTER_CUTOFF_SLACK_CHARS", 0)
+    fake.fault = fake.Fault(chunks=40, chunk_delay=0.02)
+
+    async def run():
+        text = await qwen_client.agenerate_chapter_content("", "走向", 0, 0)
+        return text, s.stats()["fake"]["tokens_available"]
+
+    text, available = _run(run())
+    assert text == "测试输出。" * 5
+    assert available >= 1_000_000 - 1
@@ -0,0 +1,37 @@
+"""retrieval 的 BM25 检索：中文二元组分词、正文切片，以及随章节写入增量更新的 search_passages。"""
+import retrieval
+import storage
+
+
+def test_tokenize():
+    assert retrieval.tokenize("林晓拔剑") == ["林晓", "晓拔", "拔剑"]
+    assert retrieval.tokenize("剑，Sword 2") == ["剑", "sword", "2"]
+
+
+def test_chunk_spans():
+    text = "第一段。\n\n第二段。\n" + "长" * 25
+    spans = retrieval.chunk_spans(text, 10, 3)
+    assert [text[s:e] for s, e in spans] == ["第一段。\n\n第二段。", "长" * 10, "长" * 10, "长" * 10, "长" * 4]
+    # 硬切的相邻片段重叠 3 字
+    assert spans[2][0] == spans[1][1] - 3
+
+
+def test_search_ranks_relevant_chapter_first():
+    pid = storage.create_project("检索测试")
+    storage.add_chapter(pid, 0, 0, "下山", "林晓辞别师父，独自下山。", summary="林晓下山")
+    hit = storage.add_chapter(pid, 0, 1, "寻剑", "林晓在古墓深处找到了青冥剑，剑身刻着青冥二字。")
+    storage.add_chapter(pid, 0, 2, "入城", "林晓来到京城，街上人来人往。")
+    results = storage.search_passages(pid, "青冥剑", k=2)
+    assert results[0]["chapter_id"] == hit and results[0]["kind"] == "content"
+    assert all(r["chapter_id"] == hit for r in results)
+    assert storage.search_passages(pid, "   ") == []
+
+
+def test_search_follows_content_changes_and_skip():
+    pid = storage.create_project("检索测试")
+    cid = storage.add_chapter(pid, 0, 0, "寻剑", "林晓在古墓里找到了青冥剑。")
+    assert storage.search_passages(pid, "青冥剑")
+    storage.set_chapter_content(pid, cid, "林晓在古墓里只找到一卷残破的秘籍。")
+    assert not any(r["kind"] == "content" for r in storage.search_passages(pid, "青冥剑"))
+    assert storage.search_passages(pid, "秘籍")[0]["chapter_id"] == cid
+    assert storage.search_passages(pid, "秘籍", skip=lambda c, p: c == cid) == []
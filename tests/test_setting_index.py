@@ -0,0 +1,55 @@
+"""setting_index：长设定的分节、纲要、按走向选取相关小节，以及持久化索引随设定修改重建。"""
+import config
+import setting_index
+import storage
+
+
+def _characters(n: int = 12) -> str:
+    names = ["林晓", "苏婉", "韩立", "墨老", "青衣", "赵无极", "柳如烟", "石破天", "萧炎", "云韵", "紫妍", "药尘"]
+    return "\n".join(
+        f"{names[i]}：{'玄天宗弟子' if i % 2 else '散修'}，擅长第{i}式剑法。" + f"{names[i]}的往事。" * 100
+        for i in range(n)
+    )
+
+
+def test_parse_sections_titles():
+    text = "# 势力\n玄天宗。\n【地理】\n东洲。\n第一卷 入门\n拜师。\n一、修炼体系\n炼气。\n林晓：主角。\n" + "长" * 30
+    sections = setting_index.parse_sections(text, 20)
+    assert [(s["title"], s["cont"]) for s in sections] == [
+        ("势力", False), ("地理", False), ("第一卷 入门", False), ("一、修炼体系", False),
+        ("林晓", False), ("林晓", True), ("林晓", True),
+    ]
+    assert all(text[s["start"]:s["start"] + len(s["text"])] == s["text"] for s in sections)
+
+
+def test_digest_is_bounded():
+    index = setting_index.build(_characters())
+    assert len(index["digest"]) <= config.SETTING_DIGEST_CHARS + 20
+    assert index["digest"].startswith("- 林晓：散修，擅长第0式剑法。")
+    assert index == setting_index.build(_characters())
+
+
+def test_select_prefers_named_sections():
+    index = setting_index.build(_characters())
+    size = max(len(s["text"]) for s in index["sections"])
+    picked = setting_index.select(index, "韩立与萧炎在山门前比剑", 2 * size)
+    assert [s["title"] for s in picked] == ["韩立", "萧炎"]
+    # BM25：没有点名时按词项得分
+    assert setting_index.select(index, "第11式剑法", size)[0]["title"] == "药尘"
+    # 空查询取开头各节，至少一节
+    assert [s["title"] for s in setting_index.select(index, "", 1)] == ["林晓"]
+
+
+def test_rag_sections_and_rebuild():
+    text = _characters()
+    assert setting_index.is_long(text)
+    pid = storage.create_project("设定测试", character_setting=text)
+    assert storage._backend.read_bytes(pid, setting_index._path("character_setting")) is not None
+    parts = {s.label: s for s in storage.get_rag_sections(pid, 0, "苏婉出场")}
+    assert parts["人物设定纲要"].static
+    assert parts["人物设定（相关部分）"].text.startswith("【人物设定·相关部分】\n苏婉：")
+
+    storage.update_project(pid, character_setting=text.replace("苏婉", "苏清"))
+    setting_index._cache.clear()
+    parts = {s.label: s for s in storage.get_rag_sections(pid, 0, "苏清出场")}
+    assert "苏清：" in parts["人物设定（相关部分）"].text
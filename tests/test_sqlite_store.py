@@ -0,0 +1,111 @@
+"""sqlite_store：元信息往返、只写变化的行、快照过期（并发读写）时仍写入正确的值，以及从 JSON 存储迁移。"""
+import uuid
+
+import json_store
+import migrate_to_sqlite
+import sqlite_store
+
+
+def _meta(status="pending", chapters=2) -> dict:
+    return {
+        "name": "测试",
+        "created_at": "2024-01-01T00:00:00",
+        "world_setting": "世界",
+        "volumes": [{"chapters": [f"c{i}" for i in range(chapters)], "summary": "", "dirty_chapters": []}],
+        "chapters": [
+            {"id": f"c{i}", "volume_idx": 0, "chapter_idx": i, "direction": "走向", "summary": "",
+             "summary_status": status, "versions": [{"id": "v1", "note": "初稿", "hash": "abc"}]}
+            for i in range(chapters)
+        ],
+        "rev": 1,
+    }
+
+
+def _status(pid: str) -> list[str]:
+    return [ch["summary_status"] for ch in sqlite_store.read_meta(pid)["chapters"]]
+
+
+def test_round_trip():
+    pid = uuid.uuid4().hex
+    meta = _meta()
+    sqlite_store.write_meta(pid, meta)
+    assert sqlite_store.read_meta(pid) == meta
+    assert sqlite_store.meta_stamp(pid) == 1
+
+
+def test_removed_rows_are_deleted():
+    pid = uuid.uuid4().hex
+    sqlite_store.write_meta(pid, _meta(chapters=3))
+    meta = sqlite_store.read_meta(pid)
+    del meta["chapters"][1]
+    sqlite_store.write_meta(pid, meta)
+    assert [ch["id"] for ch in sqlite_store.read_meta(pid)["chapters"]] == ["c0", "c2"]
+
+
+def test_value_reverted_after_stale_read():
+    """较早开始的读取晚于写入登记快照时，改回旧值的写入仍须落库（pending→done→pending）。"""
+    pid = uuid.uuid4().hex
+    sqlite_store.write_meta(pid, _meta("pending"))
+    sqlite_store.read_meta(pid)
+    stale = sqlite_store._snapshots[pid]
+
+    meta = _meta("done")
+    sqlite_store.write_meta(pid, meta)
+    # 模拟在上面写入提交之前开始的读取最后才登记快照
+    sqlite_store._keep_snapshot(pid, *stale)
+    assert sqlite_store._snapshots[pid][0] > stale[0]
+    sqlite_store._snapshots[pid] = stale
+
+    sqlite_store.write_meta(pid, _meta("pending"))
+    assert _status(pid) == ["pending", "pending"]
+
+
+def test_write_from_other_process():
+    """其他进程写入后（本进程快照计数落后），整体重写而不是按旧快照做增量。"""
+    pid = uuid.uuid4().hex
+    sqlite_store.write_meta(pid, _meta("pending", chapters=3))
+    sqlite_store.read_meta(pid)
+    stale = sqlite_store._snapshots[pid]
+    other = _meta("done", chapters=3)
+    del other["chapters"][2]
+    sqlite_store.write_meta(pid, other)
+    sqlite_store._snapshots[pid] = stale
+
+    mine = _meta("pending", chapters=2)
+    sqlite_store.write_meta(pid, mine)
+    assert sqlite_store.read_meta(pid) == mine
+
+
+def test_only_changed_rows_written():
+    pid = uuid.uuid4().hex
+    sqlite_store.write_meta(pid, _meta(chapters=50))
+    meta = sqlite_store.read_meta(pid)
+    meta["chapters"][7]["summary"] = "新摘要"
+    conn = sqlite_store._conn()
+    before = conn.total_changes
+    sqlite_store.write_meta(pid, meta)
+    # 一行章节 + 写入计数
+    assert conn.total_changes - before == 2
+    assert sqlite_store.read_meta(pid) == meta
+
+
+def test_migrate_from_json():
+    pid = uuid.uuid4().hex
+    meta = _meta(chapters=3)
+    json_store.write_meta(pid, meta)
+    files = {"chapters/c0.txt": "正文".encode("utf-8"), "retrieval/shards/c0": b"\x78\x9c", "usage.json": b"{}"}
+    for rel, data in files.items():
+        json_store.write_bytes(pid, rel, data)
+
+    migrate_to_sqlite.migrate()
+    assert sqlite_store.read_meta(pid) == meta
+    for rel, data in files.items():
+        assert sqlite_store.read_bytes(pid, rel) == data
+
+    # 已迁移的项目默认跳过；--force 时整体覆盖，JSON 中已删除的章节在库中也删除
+    del meta["chapters"][2]
+    json_store.write_meta(pid, meta)
+    migrate_to_sqlite.migrate()
+    assert len(sqlite_store.read_meta(pid)["chapters"]) == 3
+    migrate_to_sqlite.migrate(force=True)
+    assert sqlite_store.read_meta(pid) == meta
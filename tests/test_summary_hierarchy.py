@@ -0,0 +1,64 @@
+"""多级摘要：早期历史取能覆盖它的最粗一级（全书梗概 / 篇章摘要 / 卷摘要），层级只重建有变化的节点。"""
+import asyncio
+
+import qwen_client
+import storage
+import summary_worker
+
+
+def _project(n_vols: int = 12) -> str:
+    pid = storage.create_project("层级测试")
+    for vi in range(n_vols):
+        storage.update_volume_summary(pid, vi, f"卷{vi + 1}摘要{pid}")
+    return pid
+
+
+def _labels(pid: str, current: int) -> list[str]:
+    return [s.label for s in storage.get_rag_sections(pid, current) if s.label.startswith(("前情", "第"))]
+
+
+def test_history_uses_coarsest_level():
+    pid = _project()
+    # 还没有篇章摘要：逐卷
+    assert _labels(pid, 12) == [f"第{vi + 1}卷摘要" for vi in range(11)]
+    storage.update_arc_summary(pid, 0, "篇章一")
+    storage.update_arc_summary(pid, 1, "篇章二")
+    assert _labels(pid, 12) == ["第1–5卷摘要", "第6–10卷摘要", "第11卷摘要"]
+    storage.update_synopsis(pid, "梗概", 1)
+    assert _labels(pid, 12) == ["前情梗概（第1–5卷）", "第6–10卷摘要", "第11卷摘要"]
+    # 梗概覆盖的篇章须早于最近 SUMMARY_RECENT_ARCS 个完整篇章
+    assert _labels(pid, 10) == ["第1–5卷摘要"] + [f"第{vi + 1}卷摘要" for vi in range(5, 9)]
+    assert storage.get_rag_dependencies(pid, 12)[2] and not storage.get_rag_dependencies(pid, 5)[2]
+
+
+def test_refresh_rebuilds_dirty_nodes_only(fake, monkeypatch):
+    pid = _project()
+    merged = []
+    real = qwen_client.amerge_summaries
+
+    async def spy(items, title, *args, **kwargs):
+        merged.append(title)
+        return await real(items, title, *args, **kwargs)
+
+    monkeypatch.setattr(qwen_client, "amerge_summaries", spy)
+
+    def refresh() -> list[str]:
+        async def run():
+            try:
+                await summary_worker._refresh_hierarchy(pid, {})
+            finally:
+                await qwen_client.aclose_session()
+        merged.clear()
+        asyncio.run(run())
+        return list(merged)
+
+    assert refresh() == ["第1–5卷", "第6–10卷", "全书前情（第1–5卷）"]
+    assert refresh() == []
+    # 篇章二尚未并入梗概：只重建篇章二
+    storage.update_volume_summary(pid, 7, "卷8改")
+    assert refresh() == ["第6–10卷"]
+    # 篇章一已并入梗概：重建篇章一，梗概随之重建
+    storage.update_volume_summary(pid, 2, "卷3改")
+    assert refresh() == ["第1–5卷", "全书前情（第1–5卷）"]
+    meta = storage.get_project(pid)
+    assert not any(a["dirty"] for a in meta["arcs"]) and meta["synopsis"] == {"summary": meta["synopsis"]["summary"], "arcs": 1, "dirty": False}
@@ -0,0 +1,75 @@
+"""摘要后台队列：入队即标记 pending、完成后写回摘要，失败标记 error，规划只等待其上下文依赖的摘要。"""
+import asyncio
+import time
+
+import pytest
+
+import qwen_client
+import storage
+import summary_worker
+
+TEXT = "测试输出。" * 5
+
+
+def _run(coro):
+    """在新事件循环中运行，结束前关闭该循环的共享 aiohttp 会话。"""
+    async def run():
+        try:
+            return await coro
+        finally:
+            await qwen_client.aclose_session()
+    return asyncio.run(run())
+
+
+def test_summary_written_back(fake):
+    pid = storage.create_project("摘要测试")
+    cid = storage.add_chapter(pid, 0, 0, "走向", f"正文{pid}", summary_status="pending")
+
+    async def run():
+        fut = await summary_worker.enqueue_chapter(pid, cid, {})
+        assert storage.get_chapter(pid, cid)["summary_status"] == "pending"
+        assert summary_worker.chapter_future(pid, cid) is fut
+        return await fut
+
+    assert _run(run()) == TEXT
+    ch = storage.get_chapter(pid, cid)
+    assert (ch["summary"], ch["summary_status"]) == (TEXT, "done")
+    assert summary_worker.chapter_future(pid, cid) is None
+    assert storage.get_token_usage(pid)["by_stage"]["summary"]["calls"] == 1
+
+
+def test_failed_summary_marks_error(fake):
+    fake.fault = fake.Fault(fail_first=100, fail_status=500)
+    pid = storage.create_project("摘要测试")
+    # 正文各不相同，不命中摘要的模型调用缓存
+    cid = storage.add_chapter(pid, 0, 0, "走向", f"正文{pid}")
+
+    async def run():
+        fut = await summary_worker.enqueue_chapter(pid, cid, {})
+        # 等待者不因摘要失败而出错
+        await summary_worker.wait_for_context(pid, 0)
+        with pytest.raises(qwen_client.LLMError):
+            await fut
+
+    _run(run())
+    assert storage.get_chapter(pid, cid)["summary_status"] == "error"
+
+
+def test_wait_only_for_dependencies(fake):
+    fake.fault = fake.Fault(latency=1)
+    pid = storage.create_project("摘要测试")
+    near = storage.add_chapter(pid, 0, 0, "走向", f"正文{pid}")
+    far = storage.add_chapter(pid, 3, 0, "走向", f"后文{pid}")
+
+    async def run():
+        fut = await summary_worker.enqueue_chapter(pid, far, {})
+        # 第 1 卷的上下文只读卷 0、1 的章摘要，不等待卷 3 中的章节
+        t0 = time.monotonic()
+        await summary_worker.wait_for_context(pid, 1)
+        assert time.monotonic() - t0 < 0.5 and not fut.done()
+        await summary_worker.wait_for_context(pid, 3)
+        assert fut.done()
+
+    _run(run())
+    assert storage.get_rag_dependencies(pid, 1) == ([near], [], False)
+    assert storage.get_chapter(pid, far)["summary"] == TEXT